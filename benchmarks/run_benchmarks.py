@@ -0,0 +1,424 @@
+"""Benchmarks of the FLS verification pipeline on synthetic input.
+
+Every benchmark is timed (best of --repeat runs) and run once more with
+tracemalloc to record the peak of traced memory. The results are compared to
+the stored baseline; the script exits with 1 if a benchmark is slower or
+needs more memory than the baseline allows.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--save_baseline] [--only NAME ...]
+"""
+# Standard library
+import contextlib
+import datetime as dt
+import io
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Third-party
+import click
+import numpy as np
+import pandas as pd
+
+# First-party
+from fls_sat_verif.contingency import ContingencyAccumulator
+from fls_sat_verif.plot import plt_contingency_maps
+from fls_sat_verif.plot import plt_fraction_per_leadtime
+from fls_sat_verif.plot import plt_median_day_cycle
+from fls_sat_verif.store import read_store
+from fls_sat_verif.store import write_store
+from fls_sat_verif.synthetic import create_fixtures
+from fls_sat_verif.synthetic import DEFAULT_GRID
+from fls_sat_verif.utils import calc_fls_fractions
+from fls_sat_verif.utils import find_region_labels
+from fls_sat_verif.utils import get_ml_mask
+from fls_sat_verif.utils import read_latlon
+from fls_sat_verif.utils import read_lscl
+from fls_sat_verif.utils import reduce_fcst
+from fls_sat_verif.utils import reduce_obs
+from fls_sat_verif.utils import region_points
+from fls_sat_verif.utils import sat_file_path
+
+BASELINE_FILE = Path(__file__).with_name("baseline.json")
+
+START = dt.datetime(2021, 11, 1, 0)
+EXP = "bench"
+MODEL = "c1e"
+INTERVAL = 3
+LSCL_THRESHOLD = 0.7
+TQC_THRESHOLDS = (0.0001,)
+
+
+class Context:
+    """Synthetic input shared by the benchmarks.
+
+    Args:
+        wd (Path):          working directory with sat/ and tqc/
+        shape (tuple):      grid size (ny, nx)
+        hours (int):        length of the period of init times
+        max_lt (int):       maximum leadtime
+        store_days (int):   length of the period in the store benchmarks
+
+    """
+
+    def __init__(self, wd, shape, hours, max_lt, store_days):
+        self.wd = Path(wd)
+        self.max_lt = max_lt
+        self.in_dir_obs = self.wd / "sat"
+        self.in_dir_model = self.wd / "tqc"
+        if not self.in_dir_obs.is_dir():
+            logging.info(f"Writing synthetic input to {self.wd}")
+            create_fixtures(self.wd, START, hours, INTERVAL, max_lt, EXP, MODEL, shape)
+        self.end = START + dt.timedelta(hours=hours - 1)
+        self.valid_times = pd.date_range(START, periods=hours + max_lt, freq="1H")
+
+        self.lats, self.lons = read_latlon(sat_file_path(self.in_dir_obs, START, MODEL))
+        labels, self.window = find_region_labels(
+            self.valid_times, self.in_dir_obs, MODEL
+        )
+        self.points = region_points(labels, 1)
+
+        self.obs, self.fcst = synthetic_fractions(store_days, max_lt)
+
+    def tmp_dir(self, name):
+        """New empty directory for output."""
+        return Path(tempfile.mkdtemp(prefix=f"{name}_", dir=self.wd))
+
+
+def synthetic_fractions(days, max_lt, seed=2):
+    """OBS and FCST fractions of an hourly period as written by the pipeline."""
+    rng = np.random.default_rng(seed)
+    valid_times = pd.date_range(START, periods=days * 24, freq="1H")
+    obs_index = pd.MultiIndex.from_product(
+        [valid_times, ["plateau"], [LSCL_THRESHOLD]],
+        names=["valid_time", "region", "lscl_threshold"],
+    )
+    obs = pd.DataFrame(
+        {
+            "fls_frac": rng.random(len(obs_index)),
+            "high_clouds": rng.random(len(obs_index)),
+        },
+        index=obs_index,
+    )
+    fcst_index = pd.MultiIndex.from_product(
+        [valid_times, ["plateau"], list(TQC_THRESHOLDS)],
+        names=["valid_time", "region", "tqc_threshold"],
+    )
+    fcst = pd.DataFrame(
+        rng.random((len(fcst_index), max_lt + 1)),
+        index=fcst_index,
+        columns=range(max_lt + 1),
+    )
+    return obs, fcst
+
+
+def _obs_reduction(ctx):
+    """High clouds of every valid time, as needed by the FCST reduction."""
+    in_regions, groups, sizes = ctx.points
+    high_clouds = {}
+    for valid_time in ctx.valid_times:
+        lscl = read_lscl(sat_file_path(ctx.in_dir_obs, valid_time, MODEL), ctx.window)
+        lscl_ml = lscl[in_regions]
+        reduce_obs(lscl_ml, [LSCL_THRESHOLD], groups, len(sizes))
+        high_clouds[valid_time] = np.isnan(lscl_ml)
+    return high_clouds
+
+
+def bench_ml_mask(ctx):
+    get_ml_mask(ctx.lats, ctx.lons)
+
+
+def bench_reduce_obs(ctx):
+    _obs_reduction(ctx)
+
+
+def bench_reduce_fcst(ctx):
+    if not hasattr(ctx, "high_clouds"):
+        ctx.high_clouds = _obs_reduction(ctx)
+    for valid_time in ctx.valid_times:
+        reduce_fcst(
+            valid_time,
+            ctx.high_clouds[valid_time],
+            ctx.points,
+            ctx.window,
+            ctx.in_dir_model,
+            EXP,
+            ctx.max_lt,
+            TQC_THRESHOLDS,
+        )
+
+
+def bench_calc_fls_fractions(ctx):
+    calc_fls_fractions(
+        START,
+        ctx.end,
+        INTERVAL,
+        ctx.in_dir_obs,
+        ctx.in_dir_model,
+        ctx.tmp_dir("fls"),
+        EXP,
+        ctx.max_lt,
+        extend_previous=False,
+        threshold=LSCL_THRESHOLD,
+        model=MODEL,
+        reduction_cache=False,
+    )
+
+
+def bench_store_save(ctx):
+    store_dir = ctx.tmp_dir("store")
+    write_store(ctx.obs, store_dir / "obs")
+    write_store(ctx.fcst, store_dir / "fcst")
+    ctx.store_dir = store_dir
+
+
+def bench_store_load(ctx):
+    if not hasattr(ctx, "store_dir"):
+        bench_store_save(ctx)
+    read_store(ctx.store_dir / "obs")
+    read_store(ctx.store_dir / "fcst")
+
+
+def _plot_inputs(ctx):
+    obs = ctx.obs.xs(("plateau", LSCL_THRESHOLD), level=["region", "lscl_threshold"])
+    fcst = ctx.fcst.xs(
+        ("plateau", TQC_THRESHOLDS[0]), level=["region", "tqc_threshold"]
+    )
+    return obs, fcst
+
+
+def bench_plt_median_day_cycle(ctx):
+    obs, fcst = _plot_inputs(ctx)
+    plt_median_day_cycle(obs, fcst, ctx.tmp_dir("plots"), EXP, ctx.max_lt, [0, 12])
+
+
+def bench_plt_fraction_per_leadtime(ctx):
+    obs, fcst = _plot_inputs(ctx)
+    plt_fraction_per_leadtime(obs, fcst, ctx.tmp_dir("plots"), EXP, ctx.max_lt, [0, 12])
+
+
+def bench_plt_contingency_maps(ctx):
+    in_regions = ctx.points[0]
+    tables = ContingencyAccumulator(
+        in_regions, ctx.window, ctx.max_lt, LSCL_THRESHOLD, TQC_THRESHOLDS[0]
+    )
+    rng = np.random.default_rng(3)
+    tables.counts[:] = rng.integers(0, 100, tables.counts.shape)
+    plt_contingency_maps(tables, ctx.tmp_dir("plots"), EXP, [0, ctx.max_lt])
+
+
+BENCHMARKS = {
+    "get_ml_mask": bench_ml_mask,
+    "reduce_obs": bench_reduce_obs,
+    "reduce_fcst": bench_reduce_fcst,
+    "calc_fls_fractions": bench_calc_fls_fractions,
+    "store_save": bench_store_save,
+    "store_load": bench_store_load,
+    "plt_median_day_cycle": bench_plt_median_day_cycle,
+    "plt_fraction_per_leadtime": bench_plt_fraction_per_leadtime,
+    "plt_contingency_maps": bench_plt_contingency_maps,
+}
+
+
+def measure(func, ctx, repeat):
+    """Best wall time of repeat runs and peak of traced memory of one run.
+
+    Memory allocated by C libraries outside of numpy (e.g. eccodes, netCDF)
+    is not traced.
+
+    Returns:
+        dict: wall_time in s, peak_memory in MB
+
+    """
+    wall_times = []
+    # plot functions print the names of the saved files
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(ctx)
+            wall_times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            func(ctx)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {"wall_time": round(min(wall_times), 4), "peak_memory": round(peak / 1e6, 2)}
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """Print results next to the baseline and list regressions.
+
+    Args:
+        results (dict):             name -> wall_time, peak_memory
+        baseline (dict):            name -> wall_time, peak_memory
+        time_tolerance (float):     allowed relative increase of wall time
+        memory_tolerance (float):   allowed relative increase of peak memory
+
+    Returns:
+        list of names of benchmarks exceeding the tolerances
+
+    """
+    regressions = []
+    print(
+        f"{'benchmark':<28}{'time [s]':>10}{'base':>10}{'ratio':>8}"
+        f"{'mem [MB]':>11}{'base':>10}{'ratio':>8}"
+    )
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(
+                f"{name:<28}{result['wall_time']:>10.3f}{'-':>10}{'-':>8}"
+                f"{result['peak_memory']:>11.1f}{'-':>10}{'-':>8}"
+            )
+            continue
+        time_ratio = result["wall_time"] / base["wall_time"]
+        memory_ratio = result["peak_memory"] / max(base["peak_memory"], 1e-6)
+        flag = ""
+        if time_ratio > 1 + time_tolerance or memory_ratio > 1 + memory_tolerance:
+            regressions.append(name)
+            flag = "  <-- regression"
+        print(
+            f"{name:<28}{result['wall_time']:>10.3f}{base['wall_time']:>10.3f}"
+            f"{time_ratio:>8.2f}{result['peak_memory']:>11.1f}"
+            f"{base['peak_memory']:>10.1f}{memory_ratio:>8.2f}{flag}"
+        )
+    return regressions
+
+
+@click.command()
+@click.option(
+    "--only",
+    type=click.Choice(list(BENCHMARKS)),
+    multiple=True,
+    help="Run only these benchmarks (multiple allowed).",
+)
+@click.option(
+    "--grid",
+    type=(int, int),
+    default=DEFAULT_GRID,
+    show_default=True,
+    help="Size of the synthetic grid: ny nx.",
+)
+@click.option(
+    "--hours",
+    type=int,
+    default=24,
+    show_default=True,
+    help="Length of the period of init times.",
+)
+@click.option("--max_lt", type=int, default=12, show_default=True)
+@click.option(
+    "--store_days",
+    type=int,
+    default=365,
+    show_default=True,
+    help="Length of the period in the store and plot benchmarks.",
+)
+@click.option("--repeat", type=int, default=3, show_default=True)
+@click.option(
+    "--data_dir",
+    type=click.Path(file_okay=False),
+    help="Keep synthetic input here and reuse it in later runs.",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(dir_okay=False),
+    default=str(BASELINE_FILE),
+    show_default=True,
+)
+@click.option("--save_baseline", is_flag=True, help="Overwrite baseline.")
+@click.option(
+    "--time_tolerance",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="Allowed relative increase of wall time.",
+)
+@click.option(
+    "--memory_tolerance",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="Allowed relative increase of peak memory.",
+)
+@click.option("--output", type=click.Path(dir_okay=False), help="JSON results.")
+def main(
+    only,
+    grid,
+    hours,
+    max_lt,
+    store_days,
+    repeat,
+    data_dir,
+    baseline,
+    save_baseline,
+    time_tolerance,
+    memory_tolerance,
+    output,
+):
+    # the pipeline logs every input file as warning
+    logging.basicConfig(level=logging.ERROR)
+    config = {
+        "grid": list(grid),
+        "hours": hours,
+        "max_lt": max_lt,
+        "store_days": store_days,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wd = Path(data_dir or tmp_dir, f"{grid[0]}x{grid[1]}_{hours}h_{max_lt}lt")
+        ctx = Context(wd, tuple(grid), hours, max_lt, store_days)
+        results = {}
+        for name in only or BENCHMARKS:
+            logging.info(f"Running {name}")
+            results[name] = measure(BENCHMARKS[name], ctx, repeat)
+
+    report = {
+        "config": config,
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.machine(),
+        },
+        "results": results,
+    }
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+
+    baseline = Path(baseline)
+    if save_baseline:
+        if baseline.is_file():
+            # keep baseline of benchmarks not run
+            previous = json.loads(baseline.read_text())
+            if previous["config"] == config:
+                report["results"] = {**previous["results"], **results}
+        baseline.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Saved baseline to {baseline}")
+        compare(results, {}, time_tolerance, memory_tolerance)
+        return
+
+    reference = {}
+    if baseline.is_file():
+        reference = json.loads(baseline.read_text())
+        if reference["config"] != config:
+            print(f"Baseline was recorded with {reference['config']}; not compared.")
+            reference = {"results": {}}
+    regressions = compare(
+        results, reference.get("results", {}), time_tolerance, memory_tolerance
+    )
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
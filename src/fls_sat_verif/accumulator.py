@@ -0,0 +1,104 @@
+"""Accumulator of FLS fractions during calc_fls_fractions."""
+# Third-party
+import numpy as np
+import pandas as pd
+
+OBS_COLUMNS = ["fls_frac", "high_clouds"]
+
+
+class FractionAccumulator:
+    """Preallocated float32 arrays for OBS and FCST fractions.
+
+    Rows are addressed by integer offsets of the valid times from the first
+    valid time, regions, thresholds and leadtimes by their position.
+
+    Args:
+        valid_times (DatetimeIndex):    regularly spaced valid times
+        max_lt (int):                   maximum leadtime
+        lscl_thresholds (list):         thresholds for low stratus confidence level
+        tqc_thresholds (list):          thresholds for TQC
+        regions (list):                 region names
+
+    """
+
+    def __init__(
+        self,
+        valid_times,
+        max_lt,
+        lscl_thresholds=(0.7,),
+        tqc_thresholds=(0.0001,),
+        regions=("plateau",),
+    ):
+        self.valid_times = pd.DatetimeIndex(valid_times)
+        self.max_lt = max_lt
+        self.lscl_thresholds = list(lscl_thresholds)
+        self.tqc_thresholds = list(tqc_thresholds)
+        self.regions = list(regions)
+        self.step = pd.Timedelta(hours=1)
+        if len(self.valid_times) > 1:
+            self.step = self.valid_times[1] - self.valid_times[0]
+        n_times = len(self.valid_times)
+        n_regions = len(self.regions)
+        n_lscl = len(self.lscl_thresholds)
+        n_tqc = len(self.tqc_thresholds)
+        self.fls = np.full((n_times, n_regions, n_lscl), np.nan, dtype=np.float32)
+        self.high_clouds = np.full((n_times, n_regions), np.nan, dtype=np.float32)
+        self.fcst = np.full(
+            (n_times, n_regions, n_tqc, max_lt + 1), np.nan, dtype=np.float32
+        )
+
+    def offset(self, valid_time):
+        """Row of a valid time."""
+        return int((pd.Timestamp(valid_time) - self.valid_times[0]) // self.step)
+
+    def add(self, valid_time, obs_fracs, fcst_fracs):
+        """Fill in the fractions of one valid time.
+
+        Args:
+            valid_time (datetime):  valid time
+            obs_fracs (tuple):      FLS fractions per region and threshold,
+                                    high cloud fraction per region
+            fcst_fracs (dict):      FLS fractions per region and threshold per
+                                    leadtime
+
+        """
+        i = self.offset(valid_time)
+        self.fls[i], self.high_clouds[i] = obs_fracs
+        if fcst_fracs:
+            lts = np.fromiter(fcst_fracs.keys(), dtype=np.intp, count=len(fcst_fracs))
+            self.fcst[i][..., lts] = np.stack(list(fcst_fracs.values()), axis=-1)
+
+    def to_dataframes(self):
+        """Convert to OBS and FCST dataframes.
+
+        Returns:
+            obs (pd.Dataframe):     indexed by valid time, region and LSCL
+                                    threshold
+            fcst (pd.Dataframe):    indexed by valid time, region and TQC
+                                    threshold, one column per leadtime
+
+        """
+        obs_index = pd.MultiIndex.from_product(
+            [self.valid_times, self.regions, self.lscl_thresholds],
+            names=["valid_time", "region", "lscl_threshold"],
+        )
+        obs = pd.DataFrame(
+            {
+                "fls_frac": self.fls.ravel(),
+                "high_clouds": np.repeat(
+                    self.high_clouds.ravel(), len(self.lscl_thresholds)
+                ),
+            },
+            index=obs_index,
+        )
+
+        fcst_index = pd.MultiIndex.from_product(
+            [self.valid_times, self.regions, self.tqc_thresholds],
+            names=["valid_time", "region", "tqc_threshold"],
+        )
+        fcst = pd.DataFrame(
+            self.fcst.reshape(-1, self.max_lt + 1),
+            index=fcst_index,
+            columns=np.arange(self.max_lt + 1),
+        )
+        return obs, fcst
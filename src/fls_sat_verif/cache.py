@@ -0,0 +1,122 @@
+"""Cache of per-file reduction results.
+
+Counts of FLS and high cloud grid points are stored in a sqlite database,
+keyed by the identity of the input files (path, size, mtime), the reduction
+parameters and the mask. Reruns over an overlapping period only need to
+reduce new or changed files.
+"""
+# Standard library
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+
+def cache_path(cache_dir, shard=None):
+    """sqlite database of the reduction cache in cache_dir.
+
+    Every shard (i, N) gets a database of its own: the tasks of an array job
+    run on several nodes and sqlite must not be shared over a network file
+    system.
+    """
+    if shard is None:
+        return Path(cache_dir, "reductions.sqlite")
+    return Path(cache_dir, f"reductions_shard{shard[0]}of{shard[1]}.sqlite")
+
+
+def file_key(path):
+    """Identity of an input file: path, size and modification time.
+
+    Raises:
+        FileNotFoundError: if path does not exist
+
+    """
+    stat = os.stat(path)
+    return [str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+class ReductionCache:
+    """Per-file reduction results in a sqlite database.
+
+    Args:
+        path (str):         sqlite database
+        namespace (str):    included in every key, e.g. hash of the mask
+        counters (array):   [hits, misses], e.g. a multiprocessing.Array shared
+                            between worker processes (optional)
+
+    """
+
+    def __init__(self, path, namespace="", counters=None):
+        self.path = Path(path)
+        self.namespace = namespace
+        self.counters = counters if counters is not None else [0, 0]
+        self._con = None
+
+    @property
+    def hits(self):
+        return self.counters[0]
+
+    @property
+    def misses(self):
+        return self.counters[1]
+
+    def _connection(self):
+        if self._con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._con = sqlite3.connect(self.path, timeout=60)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS reductions "
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+        return self._con
+
+    def _count(self, i):
+        lock = getattr(self.counters, "get_lock", None)
+        if lock is None:
+            self.counters[i] += 1
+        else:
+            with lock():
+                self.counters[i] += 1
+
+    def key(self, *parts):
+        """Build key from json-serialisable parts."""
+        text = json.dumps([self.namespace, *parts], default=str)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def get(self, key):
+        """Cached value (list) or None."""
+        row = (
+            self._connection()
+            .execute("SELECT value FROM reductions WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            self._count(1)
+            return None
+        self._count(0)
+        return json.loads(row[0])
+
+    def contains(self, key):
+        """Whether key is cached (not counted as hit or miss)."""
+        row = (
+            self._connection()
+            .execute("SELECT 1 FROM reductions WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row is not None
+
+    def put(self, key, value):
+        """Store value (list)."""
+        con = self._connection()
+        with con:
+            con.execute(
+                "INSERT OR REPLACE INTO reductions VALUES (?, ?)",
+                (key, json.dumps(value)),
+            )
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
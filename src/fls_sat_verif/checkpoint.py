@@ -0,0 +1,129 @@
+"""Checkpoints of calc_fls_fractions (--resume).
+
+The fractions accumulated so far and the valid times already reduced are
+written to <fls_dir>/checkpoint.npz every few valid times or minutes. The
+file is replaced atomically, so a run killed at any moment leaves the last
+complete checkpoint behind. With --resume, a run with the same parameters
+continues from there instead of starting over. Contingency tables are
+checkpointed next to it and only replace <fls_dir>/contingency/ together with
+the stores. The checkpoint is removed once the stores are written.
+"""
+# Standard library
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+# Third-party
+import numpy as np
+import pandas as pd
+
+# Local
+from .profiling import stage
+
+# checkpoint after this many valid times or minutes, whichever comes first
+CHECKPOINT_INTERVAL = 24
+CHECKPOINT_MINUTES = 10.0
+
+
+def checkpoint_path(fls_dir):
+    """Checkpoint of a run writing to fls_dir."""
+    return Path(fls_dir, "checkpoint.npz")
+
+
+class Checkpoint:
+    """Periodic atomic checkpoint of FractionAccumulators.
+
+    Args:
+        path (str):         checkpoint file
+        params (dict):      identify the run; a checkpoint is only resumed by
+                            a run with equal params (JSON serialisable)
+        every (int):        valid times between checkpoints (0: no limit)
+        minutes (float):    minutes between checkpoints (0: no limit)
+
+    """
+
+    def __init__(
+        self, path, params, every=CHECKPOINT_INTERVAL, minutes=CHECKPOINT_MINUTES
+    ):
+        self.path = Path(path)
+        self.params = json.dumps(params, sort_keys=True, default=str)
+        self.every = every
+        self.minutes = minutes
+        self._count = 0
+        self._saved = time.monotonic()
+
+    def tables_path(self, exp):
+        """Checkpoint of the contingency tables of an experiment."""
+        return self.path.with_name(f"{self.path.stem}_contingency_exp={exp}.npz")
+
+    def due(self):
+        """Count one valid time; True if a checkpoint is due."""
+        self._count += 1
+        elapsed = time.monotonic() - self._saved
+        return (0 < self.every <= self._count) or (0 < 60 * self.minutes <= elapsed)
+
+    def save(self, accs, done):
+        """Write the fractions and the valid times reduced so far.
+
+        Args:
+            accs (dict):    experiment -> FractionAccumulator
+            done (set):     valid times reduced (not those skipped, which are
+                            retried on resume)
+
+        """
+        arrays = {
+            "params": np.array(self.params),
+            "done": np.array(sorted(done), dtype="datetime64[ns]"),
+        }
+        for i, acc in enumerate(accs.values()):
+            arrays[f"fls_{i}"] = acc.fls
+            arrays[f"high_clouds_{i}"] = acc.high_clouds
+            arrays[f"fcst_{i}"] = acc.fcst
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.stem}.{os.getpid()}.tmp.npz")
+        with stage("save", written=[self.path]):
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, self.path)
+        self._count = 0
+        self._saved = time.monotonic()
+        logging.info(f"Checkpoint of {len(done)} valid times: {self.path}")
+
+    def load(self, accs):
+        """Restore the fractions of a previous run with the same params.
+
+        Args:
+            accs (dict):    experiment -> FractionAccumulator, filled in place
+
+        Returns:
+            set: valid times already reduced (empty without usable checkpoint)
+
+        """
+        if not self.path.is_file():
+            logging.warning(f"No checkpoint to resume: {self.path}")
+            return set()
+
+        with stage("open", read=[self.path]), np.load(self.path) as data:
+            if str(data["params"]) != self.params:
+                logging.warning(f"Ignoring checkpoint of other parameters: {self.path}")
+                return set()
+            for i, acc in enumerate(accs.values()):
+                acc.fls[:] = data[f"fls_{i}"]
+                acc.high_clouds[:] = data[f"high_clouds_{i}"]
+                acc.fcst[:] = data[f"fcst_{i}"]
+            done = set(pd.DatetimeIndex(data["done"]))
+
+        logging.warning(f"Resuming after {len(done)} valid times from {self.path}")
+        return done
+
+    def remove(self):
+        """Remove the checkpoint and its contingency tables."""
+        paths = [self.path]
+        paths += self.path.parent.glob(f"{self.path.stem}_contingency_exp=*.npz")
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -1,28 +1,64 @@
-"""Command line interface of fls_sat_verif."""
+"""Command line interface of fls_sat_verif.
+
+Modules depending on numpy, pandas, xarray, matplotlib or eccodes are
+imported by the stage which needs them: --help, --version and --dry-run
+respond without loading them.
+"""
 # Standard library
+import datetime as dt
+import itertools
 import logging
 import os
 import sys
-from email.policy import default
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
 
 # Third-party
 import click
-import pandas as pd
 
 # Local
 from . import __version__
-from .plot import plt_fraction_per_leadtime
-from .plot import plt_median_day_cycle
-from .plot import plt_timeseries
-from .utils import calc_fls_fractions
-from .utils import count_to_log_level
-from .utils import create_working_dirs
-from .utils import load_obs_fcst
-from .utils import retrieve_cosmo_files
+from .common import count_to_log_level
+from .common import create_working_dirs
+from .profiling import finish as finish_profile
+from .profiling import start as start_profile
 
 # from ipdb import set_trace
 
 
+def plot_selections(regions, lscl_thresholds, tqc_thresholds):
+    """Yield region, thresholds and plot file name suffix of each combination.
+
+    The suffix only contains options with several values.
+    """
+    for region, lscl_thr, tqc_thr in itertools.product(
+        regions, lscl_thresholds, tqc_thresholds
+    ):
+        suffix = ""
+        if len(regions) > 1:
+            suffix += f"_{region}"
+        if len(lscl_thresholds) > 1:
+            suffix += f"_lscl_{lscl_thr}"
+        if len(tqc_thresholds) > 1:
+            suffix += f"_tqc_{tqc_thr}"
+        yield region, lscl_thr, tqc_thr, suffix
+
+
+def parse_shard(ctx, param, value):
+    """Parse --shard i/N into (i, N)."""
+    if value is None:
+        return None
+    try:
+        shard, n_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("expected i/N, e.g. 0/10")
+    if not 0 <= shard < n_shards:
+        raise click.BadParameter(f"i must be in 0 to N - 1, not {shard}")
+    return shard, n_shards
+
+
 @click.command()
 @click.version_option(__version__, "--version", "-V", message="%(version)s")
 @click.option(
@@ -40,7 +76,13 @@ from .utils import retrieve_cosmo_files
     help="Increase verbosity (specify multiple times for more)",
 )
 @click.option("--wd", type=str, help="Working directory.", default="scratch")
-@click.option("--exp", type=str, help="Name of experiment.")
+@click.option(
+    "--exp",
+    type=str,
+    multiple=True,
+    help="Name of experiment. Calculating fractions and plotting accept several "
+    "experiments.",
+)
 @click.option(
     "--retrieve_cosmo",
     is_flag=True,
@@ -56,6 +98,32 @@ from .utils import retrieve_cosmo_files
     "--plot_fraction_per_leadtime", is_flag=True, help="Plot fraction per leadtime."
 )
 @click.option("--plot_timeseries", is_flag=True, help="Plot timeseries.")
+@click.option(
+    "--plot_jobs",
+    type=int,
+    default=1,
+    help="Number of processes for rendering plots. Default: 1",
+)
+@click.option(
+    "--contingency",
+    is_flag=True,
+    default=False,
+    help="With --calc_fractions: accumulate hits, misses, false alarms and "
+    "correct negatives per grid point and leadtime.",
+)
+@click.option(
+    "--coverage",
+    is_flag=True,
+    default=False,
+    help="Write available SAT and FCST files per valid time and leadtime to "
+    "<wd>/fls/coverage_<exp>.csv and <wd>/plots/coverage_<exp>.png without "
+    "reading any data.",
+)
+@click.option(
+    "--plot_contingency_maps",
+    is_flag=True,
+    help="Plot maps of frequency bias and hit rate per leadtime.",
+)
 @click.option(
     "--start",
     type=click.DateTime(formats=["%y%m%d%H"]),
@@ -94,8 +162,29 @@ from .utils import retrieve_cosmo_files
 @click.option(
     "--lscl_threshold",
     type=float,
-    default=0.7,
-    help="Low stratus confidence threshold. Default: 0.7",
+    multiple=True,
+    default=[0.7],
+    help="Low stratus confidence threshold, can be given multiple times. Default: 0.7",
+)
+@click.option(
+    "--tqc_threshold",
+    type=float,
+    multiple=True,
+    default=[0.0001],
+    help="TQC threshold in kg/m2, can be given multiple times. Default: 0.0001",
+)
+@click.option(
+    "--region_file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="GeoJSON file with verification regions (named by property 'name'). "
+    "Default: Swiss Plateau ('plateau').",
+)
+@click.option(
+    "--region",
+    type=str,
+    multiple=True,
+    default=["plateau"],
+    help="Region to plot, can be given multiple times. Default: plateau",
 )
 @click.option(
     "--high_cloud_threshold",
@@ -108,28 +197,188 @@ from .utils import retrieve_cosmo_files
     type=str,
     help="Model name. Currently supported: c1e; c2e",
 )
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes for calculating FLS fractions. Default: 1",
+)
+@click.option(
+    "--fx_jobs",
+    type=int,
+    default=1,
+    help="Number of concurrent fieldextra processes for --retrieve_cosmo.",
+)
+@click.option(
+    "--fx_retries",
+    type=int,
+    default=2,
+    help="Number of retries of failed fieldextra processes. Default: 2",
+)
+@click.option(
+    "--batch_fx",
+    is_flag=True,
+    default=False,
+    help=(
+        "Extract all leadtimes of a simulation into one file with one fieldextra "
+        "call."
+    ),
+)
+@click.option(
+    "--cache_inventory",
+    is_flag=True,
+    default=False,
+    help="Cache listings of the model archive in <wd>/cache for --retrieve_cosmo.",
+)
+@click.option(
+    "--obs_chunk",
+    type=int,
+    default=0,
+    help="Read SAT files as lazy cube in chunks of <obs_chunk> time steps.",
+)
+@click.option(
+    "--prefetch",
+    type=int,
+    default=0,
+    help="Read up to <prefetch> input files ahead in background threads while "
+    "reducing (with --workers 1). Default: 0 (off)",
+)
+@click.option(
+    "--prefetch_memory",
+    type=int,
+    default=1024,
+    help="Maximum memory of files read ahead in MB. Default: 1024",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="With --calc_fractions: continue an interrupted run with the same "
+    "options from its last checkpoint.",
+)
+@click.option(
+    "--checkpoint_every",
+    type=int,
+    default=24,
+    help="Checkpoint --calc_fractions after this many valid times (0: off). "
+    "Default: 24",
+)
+@click.option(
+    "--checkpoint_minutes",
+    type=float,
+    default=10,
+    help="Checkpoint --calc_fractions after this many minutes (0: off). Default: 10",
+)
+@click.option(
+    "--shard",
+    type=str,
+    callback=parse_shard,
+    help="With --calc_fractions: only calculate the i-th of N blocks of valid "
+    "times (0 <= i < N), e.g. in task i of an array job, into partial stores in "
+    "<wd>/fls/shards. Format: i/N",
+)
+@click.option(
+    "--merge_shards",
+    is_flag=True,
+    default=False,
+    help="Check the partial stores of all shards for overlaps and gaps and merge "
+    "them into the stores in <wd>/fls.",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="Reduce new SAT and TQC files as they arrive and append their fractions "
+    "to the store, until interrupted. With --start, files from <start> on "
+    "which are already present are reduced first.",
+)
+@click.option(
+    "--watch_interval",
+    type=float,
+    default=10,
+    help="Seconds between two listings of the input dirs with --watch. Default: 10",
+)
+@click.option(
+    "--migrate_pickles",
+    is_flag=True,
+    default=False,
+    help="Convert pickled obs and fcst dataframes in <wd>/fls to the fraction store.",
+)
+@click.option(
+    "--no_reduction_cache",
+    is_flag=True,
+    default=False,
+    help="Reduce all input files again instead of reusing results in <wd>/cache.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Write wall time, calls and bytes read per stage (retrieve, open, mask, "
+    "reduce, save, plot) to <wd>/profile_<time>.json.",
+)
+@click.option(
+    "--profile_cprofile",
+    is_flag=True,
+    default=False,
+    help="With --profile: also profile function calls (<wd>/profile_<time>.prof).",
+)
+@click.option(
+    "--profile_memory",
+    is_flag=True,
+    default=False,
+    help="With --profile: also trace memory allocations "
+    "(<wd>/profile_<time>.tracemalloc).",
+)
 def main(
     *,
     dry_run: bool,
     verbose: int,
     wd: str,
-    exp: str,
+    exp: Tuple[str],
     exp_model_dir: str,
     retrieve_cosmo: bool,
     calc_fractions: bool,
     plot_median_day_cycle: bool,
     plot_fraction_per_leadtime: bool,
     plot_timeseries: bool,
-    start: str,
-    end: str,
-    init: int,  # used for plotting specific or all leadtimes
+    contingency: bool,
+    plot_contingency_maps: bool,
+    coverage: bool,
+    plot_jobs: int,
+    start: dt.datetime,
+    end: dt.datetime,
+    init: Tuple[int, ...],  # used for plotting specific or all leadtimes
     interval: int,  # used for extracting tqc
     max_lt: int,
     extend_previous: bool,
     load_fractions: bool,
-    lscl_threshold: float,
+    lscl_threshold: Tuple[float],
+    tqc_threshold: Tuple[float],
+    region_file: str,
+    region: Tuple[str],
     high_cloud_threshold: float,
     model: str,
+    workers: int,
+    fx_jobs: int,
+    fx_retries: int,
+    batch_fx: bool,
+    cache_inventory: bool,
+    obs_chunk: int,
+    prefetch: int,
+    prefetch_memory: int,
+    resume: bool,
+    checkpoint_every: int,
+    checkpoint_minutes: float,
+    shard: Tuple[int, int],
+    merge_shards: bool,
+    watch: bool,
+    watch_interval: float,
+    migrate_pickles: bool,
+    no_reduction_cache: bool,
+    profile: bool,
+    profile_cprofile: bool,
+    profile_memory: bool,
 ) -> None:
 
     logging.basicConfig(level=count_to_log_level(verbose))
@@ -151,11 +400,15 @@ def main(
     print(f"Working directory: {wd}")
     print(f"-------------------------------\n")
 
-    if not exp:
+    if not exp and not (migrate_pickles or merge_shards):
         print(f"Please give a sensible input for the experiment identifier: --exp.")
         sys.exit(1)
 
-    if not load_fractions:
+    if len(exp) > 1 and (retrieve_cosmo or load_fractions):
+        print("Several --exp are only supported for calculating and plotting.")
+        sys.exit(1)
+
+    if not (load_fractions or migrate_pickles or merge_shards or watch):
         if not start:
             print("Please indicate --start: YYMMDDHH.")
             sys.exit(1)
@@ -164,15 +417,46 @@ def main(
             print("Please indicate --end: YYMMDDHH.")
             sys.exit(1)
 
-    sat_dir, tqc_dir, fls_dir, plot_dir = create_working_dirs(wd)
+    if shard is not None and calc_fractions:
+        # Local
+        from .shard import shard_valid_times
+
+        n_valid_times = (end - start) // dt.timedelta(hours=1) + max_lt + 1
+        try:
+            shard_valid_times(range(n_valid_times), *shard)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'--shard'")
+
+    sat_dir, tqc_dir, fls_dir, plot_dir, cache_dir = create_working_dirs(wd)
 
     if dry_run:
         click.echo("This is a dry run. Globi wishes you a good day.")
         return
 
+    if profile:
+        start_profile(cprofile=profile_cprofile, memory=profile_memory)
+        # report is written when the command exits (also via sys.exit)
+        ctx = click.get_current_context()
+        ctx.call_on_close(lambda: finish_profile(wd, info=ctx.params))
+
+    if migrate_pickles:
+        # Local
+        from .store import migrate_pickles as migrate_pickle_files
+
+        migrate_pickle_files(fls_dir)
+
     # useful for debugging: uncomment ipdb-line above and set_trace-line below.
     if load_fractions:
-        obs, fcst = load_obs_fcst(wd, exp)
+        # Local
+        from .utils import load_obs_fcst
+
+        obs, fcst = load_obs_fcst(
+            wd,
+            exp[0],
+            lscl_threshold=lscl_threshold[0],
+            tqc_threshold=tqc_threshold[0],
+            region=region[0],
+        )
         # set_trace()
         # debugging:
         # inspect dataframe with e.g.
@@ -180,6 +464,8 @@ def main(
         #  obs[obs.index.hour == 12]]
 
     if retrieve_cosmo:
+        # Local
+        from .utils import retrieve_cosmo_files
 
         retrieve_cosmo_files(
             start=start,
@@ -188,11 +474,27 @@ def main(
             max_lt=max_lt,
             tqc_dir=tqc_dir,
             exp_model_dir=exp_model_dir,
-            exp=exp,
+            exp=exp[0],
             model=model,
+            fx_jobs=fx_jobs,
+            fx_retries=fx_retries,
+            batch_fx=batch_fx,
+            cache_dir=cache_dir if cache_inventory else None,
+        )
+
+    coverages = {}
+    if coverage:
+        # Local
+        from .inventory import report_coverage
+
+        coverages = report_coverage(
+            start, end, sat_dir, tqc_dir, fls_dir, list(exp), max_lt, model
         )
 
     if calc_fractions:
+        # Local
+        from .utils import calc_fls_fractions
+
         obs, fcst = calc_fls_fractions(
             start,
             end,
@@ -200,52 +502,125 @@ def main(
             in_dir_obs=sat_dir,
             in_dir_model=tqc_dir,
             out_dir_fls=fls_dir,
-            exp=exp,
+            exp=list(exp),
             max_lt=max_lt,
             extend_previous=extend_previous,
-            threshold=lscl_threshold,
+            threshold=list(lscl_threshold),
             model=model,
+            cache_dir=cache_dir,
+            workers=workers,
+            obs_chunk=obs_chunk,
+            reduction_cache=not no_reduction_cache,
+            tqc_threshold=list(tqc_threshold),
+            region_file=region_file,
+            contingency=contingency,
+            prefetch=prefetch,
+            prefetch_memory=prefetch_memory,
+            shard=shard,
+            resume=resume,
+            checkpoint_every=checkpoint_every,
+            checkpoint_minutes=checkpoint_minutes,
         )
 
-    if plot_median_day_cycle:
+    if merge_shards:
+        # Local
+        from .shard import merge_shards as merge_shard_stores
 
-        if not init:
-            print("Specify --init : Day time hour(s) where forecasts are started.")
+        try:
+            merge_shard_stores(fls_dir, extend_previous=extend_previous)
+        except ValueError as e:
+            print(e)
             sys.exit(1)
 
-        # load dataframes
-        obs, fcst = load_obs_fcst(wd, exp)
-        crit = obs.high_clouds < high_cloud_threshold
+    if watch:
+        # Local
+        from .utils import DEFAULT_REGIONS
+        from .utils import read_regions
+        from .watch import watch as watch_files
+        from .watch import Watcher
 
-        # plotting
-        plt_median_day_cycle(
-            obs[crit].loc[start:end],
-            fcst[crit].loc[start:end],
-            plot_dir,
-            exp,
+        watcher = Watcher(
+            sat_dir,
+            tqc_dir,
+            fls_dir,
+            list(exp),
             max_lt,
-            init,
+            list(lscl_threshold),
+            model,
+            tqc_thresholds=list(tqc_threshold),
+            regions=DEFAULT_REGIONS
+            if region_file is None
+            else read_regions(region_file),
+            cache_dir=cache_dir,
+            reduction_cache=not no_reduction_cache,
+            start=start,
         )
+        watch_files(watcher, watch_interval)
 
+    # plots of all experiments and init hours are rendered as one batch
+    plot_types = []
+    if plot_median_day_cycle:
+        plot_types.append("median_day_cycle")
     if plot_fraction_per_leadtime:
+        plot_types.append("fraction_per_leadtime")
+
+    # (plot type, args, kwargs) of the functions in plot.PLOT_FUNCTIONS
+    jobs: List[Tuple[str, Tuple[Any, ...], Dict[str, Any]]] = []
+    if plot_types:
+        # Local
+        from .utils import load_obs_fcst
 
         if not init:
             print("Specify --init : Day time hour(s) where forecasts are started.")
             sys.exit(1)
 
-        # load dataframes
-        obs, fcst = load_obs_fcst(wd, exp)
-        crit = obs.high_clouds < high_cloud_threshold
+        for exp_name in exp:
+            for reg, lscl_thr, tqc_thr, suffix in plot_selections(
+                region, lscl_threshold, tqc_threshold
+            ):
 
-        # plotting
-        plt_fraction_per_leadtime(
-            obs[crit].loc[start:end],
-            fcst[crit].loc[start:end],
-            plot_dir,
-            exp,
-            max_lt,
-            init,
-        )
+                # load dataframes
+                obs, fcst = load_obs_fcst(
+                    wd, exp_name, start, end, range(max_lt + 1), lscl_thr, tqc_thr, reg
+                )
+                crit = obs.high_clouds < high_cloud_threshold
+
+                # one job per plot type: the hourly medians are aggregated once
+                # for all init hours
+                for plot_type in plot_types:
+                    args = (obs[crit], fcst[crit], plot_dir, exp_name, max_lt)
+                    kwargs = dict(suffix=suffix, region=reg)
+                    jobs.append((plot_type, args + (list(init),), kwargs))
+
+    if plot_contingency_maps:
+        # Local
+        from .contingency import contingency_path
+        from .contingency import ContingencyAccumulator
+
+        for exp_name in exp:
+            tables_path = contingency_path(fls_dir, exp_name)
+            if not tables_path.is_file():
+                print(f"No contingency tables: {tables_path}")
+                print("Calculate them with --calc_fractions --contingency.")
+                sys.exit(1)
+
+            tables = ContingencyAccumulator.load(tables_path)
+            lead_times = range(max_lt + 1)
+            jobs.append(
+                ("contingency_maps", (tables, plot_dir, exp_name, lead_times), {})
+            )
+
+    for exp_name, exp_coverage in coverages.items():
+        jobs.append(("coverage", (exp_coverage, plot_dir, exp_name), {}))
+
+    if jobs:
+        # Local
+        from .plot import render_plots
+
+        render_plots(jobs, plot_jobs)
 
     if plot_timeseries:  # work in progress
+        # Local
+        from .plot import plt_timeseries
+
         plt_timeseries(obs[crit], fcst[crit], plot_dir)
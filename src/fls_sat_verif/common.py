@@ -0,0 +1,49 @@
+"""Helpers without heavy dependencies, used before any stage of the CLI runs.
+
+Keep this module free of numpy, pandas, xarray, matplotlib and eccodes:
+it is imported at start-up of the command line interface.
+"""
+# Standard library
+import logging
+from pathlib import Path
+
+
+def count_to_log_level(count: int) -> int:
+    """Map occurrence of the command line option verbose to the log level."""
+    if count == 0:
+        return logging.ERROR
+    elif count == 1:
+        return logging.WARNING
+    elif count == 2:
+        return logging.INFO
+    else:
+        return logging.DEBUG
+
+
+def create_working_dirs(wd):
+    """Create working directory and required subfolders.
+
+    Args:
+        wd (str): Path to working directory.
+
+    Returns:
+        sat_dir: Directory for satellite data (LSCL).
+        tqc_dir: Directory for model data (TQC netcdf files.)
+        fls_dir: Directory for pandas dataframes for FLS fractions.
+        plot_dir: Directory for final plots.
+        cache_dir: Directory for cached intermediate results (e.g. masks).
+
+    """
+    sat_dir = Path(wd, "sat")
+    tqc_dir = Path(wd, "tqc")
+    fls_dir = Path(wd, "fls")
+    plot_dir = Path(wd, "plots")
+    cache_dir = Path(wd, "cache")
+
+    logging.info("Your working directories:")
+
+    for dir in [sat_dir, tqc_dir, fls_dir, plot_dir, cache_dir]:
+        Path(dir).mkdir(parents=True, exist_ok=True)
+        logging.info(f"   {dir}")
+
+    return sat_dir, tqc_dir, fls_dir, plot_dir, cache_dir
@@ -0,0 +1,171 @@
+"""Per grid point contingency tables of FLS events.
+
+For every leadtime and every grid point in the verification regions, the
+number of hits, misses, false alarms and correct negatives is accumulated
+valid time by valid time. Memory does not depend on the length of the
+period; the tables are checkpointed to a .npz-file and extended by later runs.
+
+OBS event: LSCL > threshold; FCST event: TQC > threshold. Grid points covered
+by high clouds are not counted.
+"""
+# Standard library
+import logging
+import os
+from pathlib import Path
+
+# Third-party
+import numpy as np
+import pandas as pd
+
+# Local
+from .profiling import stage
+
+CATEGORIES = ["hits", "misses", "false_alarms", "correct_negatives"]
+
+
+def contingency_path(fls_dir, exp):
+    """Checkpoint of the contingency tables of an experiment."""
+    return Path(fls_dir, "contingency", f"exp={exp}.npz")
+
+
+class ContingencyAccumulator:
+    """Counts of hits, misses, false alarms and correct negatives.
+
+    Args:
+        in_regions (array):     True at grid points in regions (window of grid)
+        window (tuple):         (rows, cols) slices of window in full grid
+        max_lt (int):           maximum leadtime
+        lscl_threshold (float): threshold for low stratus confidence level
+        tqc_threshold (float):  threshold for TQC
+
+    """
+
+    def __init__(self, in_regions, window, max_lt, lscl_threshold, tqc_threshold):
+        self.in_regions = np.asarray(in_regions, dtype=bool)
+        self.window = tuple(window)
+        self.max_lt = max_lt
+        self.lscl_threshold = float(lscl_threshold)
+        self.tqc_threshold = float(tqc_threshold)
+        n_points = int(np.sum(self.in_regions))
+        self.counts = np.zeros((max_lt + 1, len(CATEGORIES), n_points), np.int32)
+        self.valid_times = set()
+
+    def update(self, valid_time, valid, obs_event, fcst_events):
+        """Add the events of one valid time.
+
+        Valid times already contained in the tables are skipped.
+
+        Args:
+            valid_time (datetime):  valid time
+            valid (array):          True at grid points not covered by high clouds
+            obs_event (array):      True at grid points with observed FLS
+            fcst_events (dict):     leadtime -> True at grid points with FLS in FCST
+
+        """
+        valid_time = pd.Timestamp(valid_time)
+        if valid_time in self.valid_times:
+            logging.debug(f"Contingency tables already contain {valid_time}.")
+            return
+
+        obs_yes = obs_event & valid
+        obs_no = ~obs_event & valid
+        for lt, fcst_event in fcst_events.items():
+            counts = self.counts[lt]
+            counts[0] += obs_yes & fcst_event
+            counts[1] += obs_yes & ~fcst_event
+            counts[2] += obs_no & fcst_event
+            counts[3] += obs_no & ~fcst_event
+
+        self.valid_times.add(valid_time)
+
+    def compatible(self, other):
+        """Same grid points, leadtimes and thresholds."""
+        return (
+            self.window == other.window
+            and self.max_lt == other.max_lt
+            and self.lscl_threshold == other.lscl_threshold
+            and self.tqc_threshold == other.tqc_threshold
+            and np.array_equal(self.in_regions, other.in_regions)
+        )
+
+    def merge(self, other):
+        """Add the counts of tables of other valid times, e.g. of another shard.
+
+        Raises:
+            ValueError: if the tables are not compatible or share valid times
+
+        """
+        if not self.compatible(other):
+            raise ValueError("Contingency tables are not compatible.")
+        common = self.valid_times & other.valid_times
+        if common:
+            raise ValueError(
+                f"Contingency tables share {len(common)} valid times, "
+                f"e.g. {min(common)}."
+            )
+        self.counts += other.counts
+        self.valid_times |= other.valid_times
+
+    def save(self, path):
+        """Write checkpoint (atomic: a crash never leaves a partial file)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        with stage("save", written=[path]):
+            np.savez(
+                tmp_path,
+                counts=self.counts,
+                in_regions=self.in_regions,
+                window=np.array(
+                    [[s.start, s.stop] for s in self.window], dtype=np.int64
+                ),
+                thresholds=np.array([self.lscl_threshold, self.tqc_threshold]),
+                valid_times=np.array(sorted(self.valid_times), dtype="datetime64[ns]"),
+            )
+            os.replace(tmp_path, path)
+        logging.debug(f"Saved contingency tables to {path}")
+
+    @classmethod
+    def load(cls, path):
+        """Read checkpoint."""
+        with stage("open", read=[path]), np.load(path) as data:
+            window = tuple(slice(int(a), int(b)) for a, b in data["window"])
+            lscl_threshold, tqc_threshold = data["thresholds"]
+            acc = cls(
+                data["in_regions"],
+                window,
+                data["counts"].shape[0] - 1,
+                lscl_threshold,
+                tqc_threshold,
+            )
+            acc.counts[:] = data["counts"]
+            acc.valid_times = set(pd.DatetimeIndex(data["valid_times"]))
+        return acc
+
+    def maps(self):
+        """Counts per category as 2D maps of the window.
+
+        Returns:
+            dict: category -> array (leadtime, y, x), NaN outside regions
+
+        """
+        maps = {}
+        for i, category in enumerate(CATEGORIES):
+            field = np.full(
+                (self.max_lt + 1,) + self.in_regions.shape, np.nan, dtype=np.float32
+            )
+            field[:, self.in_regions] = self.counts[:, i]
+            maps[category] = field
+        return maps
+
+
+def frequency_bias(maps):
+    """(hits + false alarms) / (hits + misses); NaN without observed events."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (maps["hits"] + maps["false_alarms"]) / (maps["hits"] + maps["misses"])
+
+
+def hit_rate(maps):
+    """hits / (hits + misses); NaN without observed events."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return maps["hits"] / (maps["hits"] + maps["misses"])
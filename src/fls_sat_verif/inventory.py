@@ -0,0 +1,223 @@
+"""Inventory of the input files of calc_fls_fractions.
+
+The sat directory and the tqc directory of each experiment are listed once;
+afterwards the availability of OBS and FCST for any valid time and leadtime
+is known without probing the file system file by file.
+"""
+# Standard library
+import datetime as dt
+import functools
+import logging
+import os
+import re
+from pathlib import Path
+
+# Third-party
+import numpy as np
+import pandas as pd
+
+SAT_PATTERN = r"MSG_lscl-cosmo1eqc3km_(\d{{10}})_{model}\.nc"
+TQC_PATTERN = re.compile(r"tqc_(\d{8})_(\d{3})\.grb2")
+TQC_RUN_PATTERN = re.compile(r"tqc_(\d{8})\.grb2")
+
+
+def _ini_time(date_str):
+    return pd.Timestamp(dt.datetime.strptime(date_str, "%y%m%d%H"))
+
+
+@functools.lru_cache()
+def _sat_pattern(model):
+    return re.compile(SAT_PATTERN.format(model=re.escape(model)))
+
+
+def list_dir(path):
+    """Names of the entries of a directory (empty if it does not exist)."""
+    try:
+        return [entry.name for entry in os.scandir(path)]
+    except FileNotFoundError:
+        logging.warning(f"No such directory: {path}")
+        return []
+
+
+def sat_valid_time(name, model):
+    """Valid time of a sat file name (None if not a sat file of model)."""
+    match = _sat_pattern(model).fullmatch(name)
+    if match is None:
+        return None
+    # timestamp of sat images: valid time - 15min
+    obs_time = dt.datetime.strptime(match.group(1), "%y%m%d%H%M")
+    return pd.Timestamp(obs_time + dt.timedelta(minutes=15))
+
+
+def tqc_key(name):
+    """(init time, leadtime) of a tqc file name (None if not a tqc file).
+
+    The leadtime is None for files with all leadtimes (--batch_fx).
+    """
+    match = TQC_PATTERN.fullmatch(name)
+    if match:
+        return _ini_time(match.group(1)), int(match.group(2))
+    match = TQC_RUN_PATTERN.fullmatch(name)
+    if match:
+        return _ini_time(match.group(1)), None
+    return None
+
+
+class Inventory:
+    """Available sat and tqc files.
+
+    Args:
+        obs_files (dict):   valid time -> sat file
+        fcst_files (dict):  experiment -> (init time, leadtime) -> tqc file
+        run_files (dict):   experiment -> init time -> tqc file with all
+                            leadtimes (--batch_fx)
+
+    """
+
+    def __init__(self, obs_files, fcst_files, run_files):
+        self.obs_files = obs_files
+        self.fcst_files = fcst_files
+        self.run_files = run_files
+
+    @classmethod
+    def empty(cls, exps):
+        """Inventory without files, e.g. to be filled by add_obs_file/add_fcst_file."""
+        return cls({}, {exp: {} for exp in exps}, {exp: {} for exp in exps})
+
+    @classmethod
+    def scan(cls, in_dir_obs, in_dir_model, exps, model):
+        """List the sat directory and the tqc directories of the experiments.
+
+        Args:
+            in_dir_obs (str):       dir with sat data
+            in_dir_model (str):     dir with model data
+            exps (list):            experiment identifiers
+            model (str):            model name
+
+        """
+        inventory = cls.empty(exps)
+        for name in list_dir(in_dir_obs):
+            valid_time = sat_valid_time(name, model)
+            if valid_time is not None:
+                inventory.add_obs_file(valid_time, Path(in_dir_obs, name))
+
+        for exp in exps:
+            for name in list_dir(Path(in_dir_model, exp)):
+                key = tqc_key(name)
+                if key is not None:
+                    inventory.add_fcst_file(exp, key, Path(in_dir_model, exp, name))
+
+        logging.info(
+            f"Inventory: {len(inventory.obs_files)} sat files, "
+            + ", ".join(
+                f"{len(inventory.fcst_files[exp]) + len(inventory.run_files[exp])} "
+                f"tqc files of {exp}"
+                for exp in exps
+            )
+        )
+        return inventory
+
+    def add_obs_file(self, valid_time, path):
+        """Add a sat file (see sat_valid_time)."""
+        self.obs_files[pd.Timestamp(valid_time)] = path
+
+    def add_fcst_file(self, exp, key, path):
+        """Add a tqc file of an experiment (key: see tqc_key)."""
+        ini_time, lt = key
+        if lt is None:
+            self.run_files[exp][ini_time] = path
+        else:
+            self.fcst_files[exp][(ini_time, lt)] = path
+
+    def obs_file(self, valid_time):
+        """Sat file of a valid time or None."""
+        return self.obs_files.get(pd.Timestamp(valid_time))
+
+    def fcst_inputs(self, valid_time, exp, max_lt):
+        """Available FCST files for one valid time (see utils.fcst_inputs).
+
+        Returns:
+            list of (leadtime, tqc file, leadtime to select in file or None)
+
+        """
+        valid_time = pd.Timestamp(valid_time)
+        inputs = []
+        for lt in range(max_lt + 1):
+            ini_time = valid_time - pd.Timedelta(hours=lt)
+            fcst_file = self.fcst_files[exp].get((ini_time, lt))
+            if fcst_file is not None:
+                inputs.append((lt, fcst_file, None))
+            elif ini_time in self.run_files[exp]:
+                inputs.append((lt, self.run_files[exp][ini_time], lt))
+        return inputs
+
+    def coverage(self, valid_times, exp, max_lt):
+        """Availability of OBS and FCST per valid time and leadtime.
+
+        Args:
+            valid_times (DatetimeIndex):    valid times
+            exp (str):                      experiment identifier
+            max_lt (int):                   maximum leadtime
+
+        Returns:
+            pd.Dataframe: index valid time, columns "obs" and leadtimes;
+                          True if the file is available
+
+        """
+        matrix = np.zeros((len(valid_times), max_lt + 2), dtype=bool)
+        for i, valid_time in enumerate(valid_times):
+            matrix[i, 0] = self.obs_file(valid_time) is not None
+            for lt, _, _ in self.fcst_inputs(valid_time, exp, max_lt):
+                matrix[i, lt + 1] = True
+        return pd.DataFrame(
+            matrix,
+            index=pd.DatetimeIndex(valid_times, name="valid_time"),
+            columns=["obs", *range(max_lt + 1)],
+        )
+
+
+def coverage_path(fls_dir, exp):
+    """CSV file of the coverage of an experiment."""
+    return Path(fls_dir, f"coverage_{exp}.csv")
+
+
+def write_coverage(coverage, path):
+    """Write coverage as CSV (1: available, 0: missing)."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    coverage.astype(int).to_csv(path)
+    n_obs = int(coverage["obs"].sum())
+    fcst = coverage.drop(columns="obs")
+    logging.warning(
+        f"Coverage: {n_obs} of {len(coverage)} valid times with sat file, "
+        f"{int(fcst.values.sum())} FCST leadtimes available ({path})."
+    )
+
+
+def report_coverage(start, end, in_dir_obs, in_dir_model, fls_dir, exps, max_lt, model):
+    """Write the coverage of the valid times of calc_fls_fractions per experiment.
+
+    Only the input dirs are listed; no data is read.
+
+    Args:
+        start (datetime):       start
+        end (datetime):         end
+        in_dir_obs (str):       dir with sat data
+        in_dir_model (str):     dir with model data
+        fls_dir (str):          dir of the CSV files (see coverage_path)
+        exps (list):            experiment identifiers
+        max_lt (int):           maximum leadtime
+        model (str):            model name
+
+    Returns:
+        dict: experiment -> coverage (see Inventory.coverage)
+
+    """
+    valid_times = pd.date_range(
+        start=start, end=end + dt.timedelta(hours=max_lt), freq="1H"
+    )
+    inventory = Inventory.scan(in_dir_obs, in_dir_model, exps, model)
+    coverages = {}
+    for exp in exps:
+        coverages[exp] = inventory.coverage(valid_times, exp, max_lt)
+        write_coverage(coverages[exp], coverage_path(fls_dir, exp))
+    return coverages
@@ -4,6 +4,7 @@
 import datetime as dt
 import logging
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from re import I
 
@@ -12,13 +13,68 @@ import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from matplotlib.figure import Figure
 from matplotlib.lines import Line2D
 from matplotlib.patches import Patch
 
+# Local
+from .contingency import frequency_bias
+from .contingency import hit_rate
+from .profiling import collect
+from .profiling import init_worker as init_profiling
+from .profiling import is_enabled as is_profiling
+from .profiling import merge
+from .profiling import stage
+
 # from ipdb import set_trace
 
+# titles of regions which are not named after themselves
+REGION_TITLES = {"plateau": "on Swiss Plateau"}
+
+
+def region_title(region):
+    """Region as part of a title, e.g. "on Swiss Plateau"."""
+    return REGION_TITLES.get(region, f"in {region}")
+
+
+def hourly_medians(obs, fcst, max_lt):
+    """Median FLS fractions and number of values per hour of day.
+
+    One grouped aggregation over the valid hour, reused by all init hours.
+
+    Args:
+        obs (dataframe):    obs from satellite
+        fcst (dataframe):   tqc from model, one column per leadtime
+        max_lt (int):       maximum leadtime
+
+    Returns:
+        obs_stats (dataframe):      median and count of OBS, index: hour 0..23
+        fcst_median (dataframe):    median of FCST, index: hour 0..23,
+                                    columns: leadtime 0..max(23, max_lt)
+        fcst_count (dataframe):     number of FCST, same shape as fcst_median
+
+    """
+    hours = pd.RangeIndex(24, name="hour")
+    lead_times = pd.RangeIndex(max(24, max_lt + 1))
+
+    obs_stats = (
+        obs.fls_frac.groupby(obs.index.hour).agg(["median", "count"]).reindex(hours)
+    )
+    obs_stats["count"] = obs_stats["count"].fillna(0).astype(int)
 
-def plt_median_day_cycle(obs, fcst, plot_dir, exp, max_lt, init_hours):
+    fcst = fcst[fcst.columns[fcst.columns <= max_lt]]
+    by_hour = fcst.groupby(fcst.index.hour)
+    fcst_median = by_hour.median().reindex(index=hours, columns=lead_times)
+    fcst_count = (
+        by_hour.count().reindex(index=hours, columns=lead_times).fillna(0).astype(int)
+    )
+
+    return obs_stats, fcst_median, fcst_count
+
+
+def plt_median_day_cycle(
+    obs, fcst, plot_dir, exp, max_lt, init_hours, suffix="", region="plateau"
+):
     """Plot median FLS fraction.
 
     Args:
@@ -28,6 +84,8 @@ def plt_median_day_cycle(obs, fcst, plot_dir, exp, max_lt, init_hours):
         exp (str):          experiment identifier
         max_lt (int):       maximum leadtime - does not work properly yet! # TODO
         init_hours (list):  init hours of model simulations
+        suffix (str):       appended to file name, e.g. thresholds
+        region (str):       region of the fractions (title)
 
     """
     # define colors
@@ -37,47 +95,36 @@ def plt_median_day_cycle(obs, fcst, plot_dir, exp, max_lt, init_hours):
     # valid hours: daytime cycle
     day_hours = np.arange(0, 24, 1)
 
-    # calculate daily cycle median FLS fraction from OBS
-    obs_median = pd.Series(index=day_hours)
+    # median FLS fraction per hour of day (and leadtime)
+    obs_stats, fcst_median_all, fcst_count_all = hourly_medians(obs, fcst, max_lt)
+    obs_median = obs_stats["median"].values
     for day_hour in day_hours:
-        obs_day_hour = obs[obs.index.hour == day_hour]
-        obs_median[day_hour] = obs_day_hour.fls_frac.median()
-        logging.info(f"day time {day_hour}: {len(obs_day_hour)} observations")
+        logging.info(
+            f"day time {day_hour}: {obs_stats['count'][day_hour]} observations"
+        )
 
     # loop over init_hours
     for init_hour in init_hours:
 
-        _, ax = plt.subplots(figsize=(9, 4))
-
-        # calculate daily cycle median FLS fraction from FCST
-        fcst_median = pd.Series(index=day_hours)
+        fig = Figure(figsize=(9, 4))
+        ax = fig.subplots()
 
+        # daily cycle median FLS fraction from FCST
+        lt_hours = (day_hours + init_hour) % 24
+        fcst_median = fcst_median_all.values[day_hours, lt_hours]
+        fcst_count = fcst_count_all.values[day_hours, lt_hours]
         for day_hour in day_hours:
-            fcst_max_lt = fcst[fcst.columns[fcst.columns < (max_lt + 1)]]
-            lt_hour = (day_hour + init_hour) % 24
-            fcst_day_hour = fcst_max_lt[fcst_max_lt.index.hour == day_hour][lt_hour]
-            fcst_median[day_hour] = fcst_day_hour.median()
-            logging.info(f"day time {day_hour}: {len(fcst_day_hour)} forecasts")
-
-            ax.bar(
-                day_hour - 0.2,
-                obs_median[day_hour],
-                color=color_obs,
-                width=0.4,
-            )
-            ax.bar(
-                day_hour + 0.2,
-                fcst_median[day_hour],
-                color=color_fcst,
-                width=0.4,
-            )
+            logging.info(f"day time {day_hour}: {fcst_count[day_hour]} forecasts")
+
+        ax.bar(day_hours - 0.2, obs_median, color=color_obs, width=0.4)
+        ax.bar(day_hours + 0.2, fcst_median, color=color_fcst, width=0.4)
 
         # x-axis
         ax.set_xlabel("Hour of day")
         ax.set_xticks([0, 6, 12, 18])
 
         # title
-        ax.set_title(f"Median FLS fraction on Swiss Plateau")
+        ax.set_title(f"Median FLS fraction {region_title(region)}")
 
         # legend
         # add customised legend
@@ -90,14 +137,15 @@ def plt_median_day_cycle(obs, fcst, plot_dir, exp, max_lt, init_hours):
         ax.legend(handles=legend_elements)
 
         # save figure
-        file_name = f"median_day_cycle_{exp}_init_{init_hour}"
+        file_name = f"median_day_cycle_{exp}_init_{init_hour}{suffix}"
         out_name = Path(plot_dir, f"{file_name}.png")
-        plt.savefig(out_name, dpi=250)
-        print(f"Saved as:")
-        print(f"  {out_name}")
+        fig.savefig(out_name, dpi=250)
+        print(f"Saved as: {out_name}")
 
 
-def plt_fraction_per_leadtime(obs, fcst, plot_dir, exp, max_lt, init_hours):
+def plt_fraction_per_leadtime(
+    obs, fcst, plot_dir, exp, max_lt, init_hours, suffix="", region="plateau"
+):
     """Plot median FLS fraction.
 
     Args:
@@ -107,6 +155,8 @@ def plt_fraction_per_leadtime(obs, fcst, plot_dir, exp, max_lt, init_hours):
         exp (str):          experiment identifier
         max_lt (int):       maximum leadtime - does not work properly yet!
         init_hours (list):  init hours of model simulations
+        suffix (str):       appended to file name, e.g. thresholds
+        region (str):       region of the fractions (title)
 
     """
     # define colors
@@ -116,48 +166,38 @@ def plt_fraction_per_leadtime(obs, fcst, plot_dir, exp, max_lt, init_hours):
     # valid hours: daytime cycle
     lt_hours = np.arange(0, max_lt + 1, 1)
 
+    # median FLS fraction per hour of day and leadtime
+    obs_stats, fcst_median_all, fcst_count_all = hourly_medians(obs, fcst, max_lt)
+
     # loop over init_hours
     # (one figure per init_hour)
     for init_hour in init_hours:
 
-        _, ax = plt.subplots(figsize=(9, 4))
-
-        # calculate daily cycle median FLS fraction for specific *leadtime*
-        obs_median = pd.Series(index=lt_hours)
-        fcst_median = pd.Series(index=lt_hours)
-
-        for lt in lt_hours:
-            day_hour = (init_hour + lt) % 24
+        fig = Figure(figsize=(9, 4))
+        ax = fig.subplots()
 
-            # obs
-            obs_day_hour = obs[obs.index.hour == day_hour]
-            obs_median[lt] = obs_day_hour.fls_frac.median()
-            logging.info(f"day time {day_hour} UTC: {len(obs_day_hour)} observations")
-
-            # fcst
-            fcst_day_hour = fcst[fcst.index.hour == day_hour]
-            fcst_median[lt] = fcst_day_hour[lt].median()
-            logging.info(f"                       : {len(fcst_day_hour)} forecasts")
-
-            ax.bar(
-                lt - 0.2,
-                obs_median[lt],
-                color=color_obs,
-                width=0.4,
+        # daily cycle median FLS fraction for specific *leadtime*
+        day_hours = (init_hour + lt_hours) % 24
+        obs_median = obs_stats["median"].values[day_hours]
+        fcst_median = fcst_median_all.values[day_hours, lt_hours]
+        for lt, day_hour in zip(lt_hours, day_hours):
+            logging.info(
+                f"day time {day_hour} UTC: {obs_stats['count'][day_hour]} observations"
             )
-            ax.bar(
-                lt + 0.2,
-                fcst_median[lt],
-                color=color_fcst,
-                width=0.4,
+            logging.info(
+                f"                       : {fcst_count_all.values[day_hour, lt]} "
+                "forecasts"
             )
 
+        ax.bar(lt_hours - 0.2, obs_median, color=color_obs, width=0.4)
+        ax.bar(lt_hours + 0.2, fcst_median, color=color_fcst, width=0.4)
+
         # x-axis
         ax.set_xlabel("Leadtime [h]")
         # ax.set_xticks([0, 6, 12, 18])
 
         # title
-        ax.set_title(f"Median FLS fraction on Swiss Plateau")
+        ax.set_title(f"Median FLS fraction {region_title(region)}")
 
         # legend
         # add customised legend
@@ -170,11 +210,10 @@ def plt_fraction_per_leadtime(obs, fcst, plot_dir, exp, max_lt, init_hours):
         ax.legend(handles=legend_elements)
 
         # save figure
-        file_name = f"fraction_per_leadtime_{exp}_init_{init_hour}"
+        file_name = f"fraction_per_leadtime_{exp}_init_{init_hour}{suffix}"
         out_name = Path(plot_dir, f"{file_name}.png")
-        plt.savefig(out_name, dpi=250)
-        print(f"Saved as:")
-        print(f"  {out_name}")
+        fig.savefig(out_name, dpi=250)
+        print(f"Saved as: {out_name}")
 
 
 def plt_timeseries(obs, fcst, plot_dir):
@@ -204,3 +243,147 @@ def plt_timeseries(obs, fcst, plot_dir):
     plt.savefig(out_name)
     logging.info(f"Saved as:")
     logging.info(f"  {out_name}")
+
+
+def plt_contingency_maps(tables, plot_dir, exp, lead_times):
+    """Plot maps of frequency bias and hit rate per leadtime.
+
+    Args:
+        tables (ContingencyAccumulator): contingency tables per grid point
+        plot_dir (str):     output_path
+        exp (str):          experiment identifier
+        lead_times (list):  leadtimes, one panel each
+
+    """
+    maps = tables.maps()
+    scores = {
+        "frequency_bias": (frequency_bias(maps), "RdBu_r", dict(vmin=0, vmax=2)),
+        "hit_rate": (hit_rate(maps), "viridis", dict(vmin=0, vmax=1)),
+    }
+    lead_times = [lt for lt in lead_times if lt <= tables.max_lt]
+    n_cols = min(4, len(lead_times))
+    n_rows = int(np.ceil(len(lead_times) / n_cols))
+
+    for score, (values, cmap, limits) in scores.items():
+        fig = Figure(figsize=(4 * n_cols, 3 * n_rows))
+        axes = fig.subplots(
+            n_rows,
+            n_cols,
+            squeeze=False,
+            sharex=True,
+            sharey=True,
+        )
+        for ax, lt in zip(axes.flat, lead_times):
+            mesh = ax.pcolormesh(values[lt], cmap=cmap, **limits)
+            ax.set_title(f"+{lt}h")
+            ax.set_aspect("equal")
+        for ax in axes.flat[len(lead_times) :]:
+            ax.set_visible(False)
+        fig.colorbar(mesh, ax=axes, shrink=0.8, label=score.replace("_", " "))
+        fig.suptitle(
+            f"{exp.upper()}: {len(tables.valid_times)} valid times, "
+            f"LSCL > {tables.lscl_threshold}, TQC > {tables.tqc_threshold} kg/m2"
+        )
+
+        # save figure
+        file_name = f"{score}_map_{exp}"
+        out_name = Path(plot_dir, f"{file_name}.png")
+        fig.savefig(out_name, dpi=250)
+        print(f"Saved as: {out_name}")
+
+
+def plt_coverage(coverage, plot_dir, exp):
+    """Plot availability of OBS and FCST per valid time and leadtime.
+
+    Args:
+        coverage (dataframe):   see Inventory.coverage
+        plot_dir (str):         output_path
+        exp (str):              experiment identifier
+
+    """
+    fig = Figure(figsize=(9, 4))
+    ax = fig.subplots()
+    ax.pcolormesh(
+        np.arange(len(coverage) + 1),
+        np.arange(coverage.shape[1] + 1),
+        coverage.values.T.astype(float),
+        cmap="Greens",
+        vmin=0,
+        vmax=1.5,
+    )
+    ax.set_yticks(np.arange(coverage.shape[1]) + 0.5)
+    ax.set_yticklabels(["OBS"] + [f"+{lt}h" for lt in coverage.columns[1:]])
+    for label in ax.get_yticklabels()[2::2]:
+        label.set_visible(False)
+    x_ticks = np.linspace(0, len(coverage) - 1, min(8, len(coverage))).astype(int)
+    ax.set_xticks(x_ticks + 0.5)
+    ax.set_xticklabels(
+        [coverage.index[i].strftime("%d.%m. %H UTC") for i in x_ticks],
+        rotation=30,
+        ha="right",
+    )
+    ax.set_xlabel("Valid time")
+    ax.set_title(
+        f"{exp.upper()}: SAT files for {int(coverage['obs'].sum())} of "
+        f"{len(coverage)} valid times, "
+        f"{int(coverage.drop(columns='obs').values.sum())} FCST leadtimes available"
+    )
+    fig.tight_layout()
+
+    # save figure
+    out_name = Path(plot_dir, f"coverage_{exp}.png")
+    fig.savefig(out_name, dpi=250)
+    print(f"Saved as: {out_name}")
+
+
+# plot types of render_plots
+PLOT_FUNCTIONS = {
+    "median_day_cycle": plt_median_day_cycle,
+    "fraction_per_leadtime": plt_fraction_per_leadtime,
+    "contingency_maps": plt_contingency_maps,
+    "coverage": plt_coverage,
+}
+
+
+def _render(plot_type, args, kwargs):
+    """Render one plot in a worker process.
+
+    Returns the profile of the plot stage.
+    """
+    with stage("plot"):
+        PLOT_FUNCTIONS[plot_type](*args, **kwargs)
+    # worker processes may exit before flushing their output
+    sys.stdout.flush()
+    return collect()
+
+
+def render_plots(jobs, workers=1):
+    """Render a batch of plots, in parallel if workers > 1.
+
+    Figures are created without pyplot (matplotlib.figure.Figure) and rendered
+    by the non-interactive Agg canvas; they are freed once saved.
+    Each plot reports its file in one line, so the output of parallel workers
+    does not interleave within a message.
+
+    Args:
+        jobs (list):    (plot type, args, kwargs) of the functions in
+                        PLOT_FUNCTIONS
+        workers (int):  number of processes
+
+    """
+    logging.info(f"Rendering {len(jobs)} plots with {workers} processes.")
+    if workers <= 1:
+        for plot_type, args, kwargs in jobs:
+            with stage("plot"):
+                PLOT_FUNCTIONS[plot_type](*args, **kwargs)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_profiling,
+        initargs=(is_profiling(),),
+    ) as executor:
+        futures = [executor.submit(_render, *job) for job in jobs]
+        # re-raise errors of worker processes
+        for future in futures:
+            merge(future.result())
@@ -0,0 +1,125 @@
+"""Read input files in background threads ahead of the reduction.
+
+calc_fls_fractions reduces one valid time after the other. A Prefetcher reads
+and decodes the files of the next valid times in background threads while
+the main loop reduces the current one, so waiting for the file system
+overlaps with computing. The number of files read ahead and the memory of
+their decoded arrays are bounded.
+"""
+# Standard library
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# threads reading files ahead
+DEFAULT_THREADS = 2
+
+
+class Prefetcher:
+    """Read files ahead of their use.
+
+    Jobs are grouped, e.g. by valid time. Once a file of a later group is
+    requested, files of earlier groups which were read ahead but never
+    requested are dropped. Files not read ahead (yet) are read on request.
+
+    Args:
+        jobs (list):        (group, key, function, args, nbytes) in order of
+                            use; nbytes: size of the result of function(*args)
+        depth (int):        maximum number of files read ahead
+        max_bytes (int):    maximum memory of results read ahead (one file is
+                            always read ahead, even if larger)
+        threads (int):      number of reading threads
+
+    """
+
+    def __init__(self, jobs, depth, max_bytes, threads=DEFAULT_THREADS):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._jobs = list(jobs)
+        self._groups = {key: group for group, key, *_ in self._jobs}
+        self._cond = threading.Condition()
+        # key -> (future, nbytes, group) of files read ahead and not yet used
+        self._ahead = {}
+        self._bytes = 0
+        self._current = None
+        self._closed = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, threads), thread_name_prefix="prefetch"
+        )
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+
+    def _fits(self, nbytes):
+        if not self._ahead:
+            return True
+        return len(self._ahead) < self.depth and self._bytes + nbytes <= self.max_bytes
+
+    def _feed(self):
+        for group, key, function, args, nbytes in self._jobs:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._fits(nbytes))
+                if self._closed:
+                    return
+                if key not in self._groups:
+                    # already read on request
+                    continue
+                if self._current is not None and group < self._current:
+                    continue
+                future = self._executor.submit(function, *args)
+                self._ahead[key] = (future, nbytes, group)
+                self._bytes += nbytes
+
+    def _drop(self, key):
+        future, nbytes, _ = self._ahead.pop(key)
+        future.cancel()
+        self._bytes -= nbytes
+        self._cond.notify_all()
+
+    def get(self, key, function, *args):
+        """Result of function(*args), read ahead under key if possible.
+
+        Exceptions of function are raised here, as if it was called now.
+        """
+        with self._cond:
+            # every file is used once: never read it ahead afterwards
+            group = self._groups.pop(key, None)
+            if group is not None and (self._current is None or group > self._current):
+                self._current = group
+                for old in [k for k, v in self._ahead.items() if v[2] < group]:
+                    self._drop(old)
+            entry = self._ahead.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return function(*args)
+
+        self.hits += 1
+        try:
+            return entry[0].result()
+        finally:
+            with self._cond:
+                if key in self._ahead:
+                    self._drop(key)
+
+    def close(self):
+        """Stop reading ahead and wait for the reading threads."""
+        with self._cond:
+            self._closed = True
+            for key in list(self._ahead):
+                self._drop(key)
+            self._cond.notify_all()
+        self._feeder.join()
+        # files read ahead were cancelled by _drop
+        self._executor.shutdown(wait=True)
+        logging.info(
+            f"Prefetch: {self.hits} of {self.hits + self.misses} files read ahead."
+        )
+
+
+def fetch(prefetcher, key, function, *args):
+    """function(*args), read ahead by prefetcher if given (else None)."""
+    if prefetcher is None:
+        return function(*args)
+    return prefetcher.get(key, function, *args)
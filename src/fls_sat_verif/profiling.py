@@ -0,0 +1,227 @@
+"""Per stage profile of a run (--profile).
+
+Wall time, number of calls, bytes read and bytes written are recorded for
+each stage of the pipeline:
+
+    retrieve    fxfilter runs
+    open        reading satellite, model and store files
+    mask        region labels and their bounding box
+    reduce      counting FLS and high cloud grid points
+    save        writing stores and contingency tables
+    plot        rendering figures
+
+Bytes read are the bytes of the decoded arrays, e.g. of the window of a sat
+file, or the size of files read in full. Stages running in worker processes
+are recorded there and merged into the main process. Wall times of concurrent
+threads or processes add up, so the sum over the stages may exceed the wall
+time of the run.
+"""
+# Standard library
+import contextlib
+import datetime as dt
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+STAGES = ["retrieve", "open", "mask", "reduce", "save", "plot"]
+
+# number of entries in the summaries of cProfile and tracemalloc
+TOP_ENTRIES = 20
+
+_lock = threading.Lock()
+_state = {"enabled": False, "stages": {}}
+
+
+def enable(enabled=True):
+    """Switch recording of stages on (or off)."""
+    _state["enabled"] = enabled
+
+
+def is_enabled():
+    return _state["enabled"]
+
+
+def init_worker(enabled):
+    """Set up a worker process: discard statistics inherited from the parent."""
+    enable(enabled)
+    collect()
+
+
+def _size(paths):
+    size = 0
+    for path in paths:
+        try:
+            size += Path(path).stat().st_size
+        except OSError:
+            pass
+    return size
+
+
+@contextlib.contextmanager
+def stage(name, read=(), written=()):
+    """Record wall time and bytes of one call of a stage.
+
+    Yields a dict: add the nbytes of data decoded from partly read files to
+    its "bytes_read". Nothing is recorded unless profiling is enabled.
+
+    Args:
+        name (str):         stage, one of STAGES
+        read (list):        files read in full in this call
+        written (list):     files written in this call (size taken at exit)
+
+    """
+    counts = {"bytes_read": 0}
+    if not _state["enabled"]:
+        yield counts
+        return
+
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        wall_time = time.perf_counter() - start
+        merge(
+            {
+                name: {
+                    "wall_time": wall_time,
+                    "calls": 1,
+                    "bytes_read": counts["bytes_read"] + _size(read),
+                    "bytes_written": _size(written),
+                }
+            }
+        )
+
+
+def merge(stats):
+    """Add statistics of stages, e.g. from a worker process."""
+    with _lock:
+        for name, values in stats.items():
+            totals = _state["stages"].setdefault(
+                name,
+                {"wall_time": 0.0, "calls": 0, "bytes_read": 0, "bytes_written": 0},
+            )
+            for key, value in values.items():
+                totals[key] += value
+
+
+def collect():
+    """Statistics recorded since the last call (empty if not enabled)."""
+    with _lock:
+        stats = _state["stages"]
+        _state["stages"] = {}
+    return stats
+
+
+def merge_results(results):
+    """Yield results of worker functions returning (result, collect())."""
+    for result, stats in results:
+        merge(stats)
+        yield result
+
+
+def start(cprofile=False, memory=False):
+    """Start recording stages and, optionally, cProfile and tracemalloc.
+
+    Args:
+        cprofile (bool):    profile function calls with cProfile
+        memory (bool):      trace memory allocations with tracemalloc
+
+    """
+    collect()
+    enable()
+    _state["started"] = dt.datetime.now()
+    _state["start"] = time.perf_counter()
+    _state["cprofile"] = None
+    if cprofile:
+        # Standard library
+        import cProfile
+
+        _state["cprofile"] = cProfile.Profile()
+        _state["cprofile"].enable()
+    if memory:
+        tracemalloc.start()
+
+
+def finish(out_dir, info=None):
+    """Stop profiling and write the report.
+
+    Files (YYYYmmdd_HHMMSS: start of the run):
+        profile_<YYYYmmdd_HHMMSS>.json          stages and summaries
+        profile_<YYYYmmdd_HHMMSS>.prof          cProfile statistics (pstats)
+        profile_<YYYYmmdd_HHMMSS>.tracemalloc   tracemalloc snapshot
+
+    Args:
+        out_dir (str):  directory of the report, e.g. the working directory
+        info (dict):    added to the report, e.g. options of the run
+
+    Returns:
+        Path of the json report
+
+    """
+    wall_time = time.perf_counter() - _state["start"]
+    enable(False)
+    stem = Path(out_dir, f"profile_{_state['started']:%Y%m%d_%H%M%S}")
+
+    report = {
+        "command": sys.argv,
+        "started": _state["started"].isoformat(timespec="seconds"),
+        "wall_time": wall_time,
+        "info": info or {},
+        "stages": {
+            name: stats
+            for name, stats in sorted(
+                collect().items(), key=lambda item: -item[1]["wall_time"]
+            )
+        },
+    }
+
+    profiler = _state.pop("cprofile", None)
+    if profiler is not None:
+        profiler.disable()
+        prof_file = stem.with_suffix(".prof")
+        profiler.dump_stats(prof_file)
+        report["cprofile"] = {"file": str(prof_file), "top": _top_functions(profiler)}
+
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot_file = stem.with_suffix(".tracemalloc")
+        snapshot.dump(str(snapshot_file))
+        report["tracemalloc"] = {
+            "file": str(snapshot_file),
+            "peak_bytes": peak,
+            "top": [
+                {"location": str(stat.traceback), "bytes": stat.size}
+                for stat in snapshot.statistics("lineno")[:TOP_ENTRIES]
+            ],
+        }
+
+    report_file = stem.with_suffix(".json")
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    # info may contain dates and paths
+    report_file.write_text(json.dumps(report, indent=2, default=str))
+    logging.warning(f"Profile written to {report_file}")
+    return report_file
+
+
+def _top_functions(profiler):
+    """Functions with the largest cumulative time."""
+    # Standard library
+    import pstats
+
+    stats = pstats.Stats(profiler).stats
+    top = sorted(stats.items(), key=lambda item: -item[1][3])[:TOP_ENTRIES]
+    return [
+        {
+            "function": f"{file}:{line}({func})",
+            "calls": n_calls,
+            "tottime": tottime,
+            "cumtime": cumtime,
+        }
+        for (file, line, func), (_, n_calls, tottime, cumtime, _) in top
+    ]
@@ -0,0 +1,252 @@
+"""Split calc_fls_fractions into shards and merge their partial stores.
+
+With --shard i/N, the valid times from start to end + max_lt are split into
+N contiguous blocks and only block i (0 <= i < N) is calculated, e.g. by
+one task of an array job. Each shard writes its fractions to a partial
+store and, once complete, a manifest:
+
+    <fls_dir>/shards/shard=<i>-of-<N>/obs/...
+    <fls_dir>/shards/shard=<i>-of-<N>/fcst/exp=<exp>/...
+    <fls_dir>/shards/shard=<i>-of-<N>/contingency/exp=<exp>.npz
+    <fls_dir>/shards/shard=<i>-of-<N>/manifest.json
+
+--merge_shards checks that the manifests describe the same calculation and
+that their valid times neither overlap nor leave gaps, and combines the
+partial stores into the stores in <fls_dir>.
+"""
+# Standard library
+import datetime as dt
+import json
+import logging
+import os
+from pathlib import Path
+
+# Third-party
+import numpy as np
+import pandas as pd
+
+# Local
+from .contingency import contingency_path
+from .contingency import ContingencyAccumulator
+from .store import clear_store
+from .store import fcst_store_path
+from .store import obs_store_path
+from .store import read_store
+from .store import replace_store
+from .store import write_store
+
+MANIFEST_NAME = "manifest.json"
+
+# manifest entries which have to agree between shards
+SHARED_KEYS = [
+    "n_shards",
+    "start",
+    "end",
+    "max_lt",
+    "exps",
+    "lscl_thresholds",
+    "tqc_thresholds",
+    "regions",
+    "contingency",
+]
+
+
+def shard_dir(fls_dir, shard, n_shards):
+    """Dir of the partial stores of a shard."""
+    return Path(fls_dir, "shards", f"shard={shard}-of-{n_shards}")
+
+
+def shard_valid_times(valid_times, shard, n_shards):
+    """Contiguous block of valid times of a shard.
+
+    Args:
+        valid_times (DatetimeIndex):    all valid times
+        shard (int):                    shard index, 0 <= shard < n_shards
+        n_shards (int):                 number of shards
+
+    Returns:
+        DatetimeIndex
+
+    Raises:
+        ValueError: if shard is out of range or a shard would be empty
+
+    """
+    if not 0 <= shard < n_shards:
+        raise ValueError(f"Shard {shard} not in 0 to {n_shards - 1}.")
+    if n_shards > len(valid_times):
+        raise ValueError(f"{n_shards} shards for {len(valid_times)} valid times.")
+    bounds = np.linspace(0, len(valid_times), n_shards + 1).astype(int)
+    return valid_times[bounds[shard] : bounds[shard + 1]]
+
+
+def write_manifest(out_dir, manifest):
+    """Write the manifest of a complete shard (atomic)."""
+    path = Path(out_dir, MANIFEST_NAME)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    manifest = dict(manifest, created=dt.datetime.now().isoformat(timespec="seconds"))
+    tmp_path.write_text(json.dumps(manifest, indent=2, default=str))
+    os.replace(tmp_path, path)
+    logging.warning(f"Shard complete: {path}")
+
+
+def remove_manifest(out_dir):
+    """Mark a shard as incomplete, e.g. while it is (re)calculated."""
+    try:
+        Path(out_dir, MANIFEST_NAME).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def read_manifests(fls_dir):
+    """Manifests of the complete shards, by shard dir."""
+    manifests = {}
+    for path in sorted(Path(fls_dir, "shards").glob(f"shard=*/{MANIFEST_NAME}")):
+        manifests[path.parent] = json.loads(path.read_text())
+    return manifests
+
+
+def check_shards(manifests):
+    """Problems which prevent merging the shards.
+
+    Args:
+        manifests (dict):   shard dir -> manifest
+
+    Returns:
+        list of str (empty if the shards can be merged)
+
+    """
+    if not manifests:
+        return ["No complete shards."]
+
+    problems = []
+    first = next(iter(manifests.values()))
+    for out_dir, manifest in manifests.items():
+        for key in SHARED_KEYS:
+            if manifest.get(key) != first.get(key):
+                problems.append(
+                    f"{out_dir.name}: {key} = {manifest.get(key)}, "
+                    f"but {first.get(key)} in other shards."
+                )
+    if problems:
+        return problems
+
+    shards = sorted(manifests.values(), key=lambda m: m["first_valid_time"])
+    missing = sorted(set(range(first["n_shards"])) - {m["shard"] for m in shards})
+    if missing:
+        problems.append(f"Missing shards: {', '.join(map(str, missing))}.")
+
+    # consecutive valid times, no overlaps or gaps between the shards
+    step = pd.Timedelta(hours=1)
+    expected = pd.Timestamp(first["start"])
+    for manifest in shards:
+        begin = pd.Timestamp(manifest["first_valid_time"])
+        if begin < expected:
+            problems.append(
+                f"Shard {manifest['shard']} overlaps the previous shard from "
+                f"{begin} to {expected - step}."
+            )
+        elif begin > expected:
+            problems.append(f"Gap from {expected} to {begin - step}.")
+        expected = max(expected, pd.Timestamp(manifest["last_valid_time"]) + step)
+    end = pd.Timestamp(first["end"]) + dt.timedelta(hours=first["max_lt"])
+    if expected <= end:
+        problems.append(f"Gap from {expected} to {end}.")
+
+    return problems
+
+
+def merge_shards(fls_dir, extend_previous=False):
+    """Combine the partial stores of all shards into the stores in fls_dir.
+
+    Args:
+        fls_dir (str):          dir with fls fractions
+        extend_previous (bool): keep existing fractions in fls_dir (otherwise
+                                they are replaced)
+
+    Returns:
+        dict: manifest shared by the shards
+
+    Raises:
+        ValueError: if the shards are incomplete, inconsistent or overlap
+
+    """
+    manifests = read_manifests(fls_dir)
+    problems = check_shards(manifests)
+    if problems:
+        raise ValueError("Cannot merge shards:\n  " + "\n  ".join(problems))
+
+    shared = {key: next(iter(manifests.values()))[key] for key in SHARED_KEYS}
+    exps = shared["exps"]
+
+    # read all shards before the stores in fls_dir are touched
+    obs_parts = []
+    fcst_parts = {exp: [] for exp in exps}
+    n_obs = 0
+    tables = {}
+    for out_dir, manifest in manifests.items():
+        logging.info(f"Reading {out_dir}")
+        # valid times of the shard only, even if it was extended
+        first = pd.Timestamp(manifest["first_valid_time"])
+        last = pd.Timestamp(manifest["last_valid_time"])
+        obs = read_store(obs_store_path(out_dir), first, last)
+        if not obs.empty:
+            obs_parts.append(obs)
+            valid = obs["fls_frac"].notna().values
+            n_obs += obs.index.get_level_values(0)[valid].nunique()
+        for exp in exps:
+            fcst = read_store(fcst_store_path(out_dir, exp), first, last)
+            if not fcst.empty:
+                fcst_parts[exp].append(fcst)
+
+        if shared["contingency"]:
+            for exp in exps:
+                tables_path = contingency_path(out_dir, exp)
+                if not tables_path.is_file():
+                    # shard without sat files
+                    continue
+                shard_tables = ContingencyAccumulator.load(tables_path)
+                if exp in tables:
+                    tables[exp].merge(shard_tables)
+                else:
+                    tables[exp] = shard_tables
+
+    if extend_previous:
+        for exp, exp_tables in tables.items():
+            path = contingency_path(fls_dir, exp)
+            if path.is_file():
+                previous = ContingencyAccumulator.load(path)
+                previous.merge(exp_tables)
+                tables[exp] = previous
+
+    _save_parts(obs_parts, obs_store_path(fls_dir), extend_previous)
+    for exp, parts in fcst_parts.items():
+        _save_parts(parts, fcst_store_path(fls_dir, exp), extend_previous)
+    if shared["contingency"]:
+        for exp in exps:
+            path = contingency_path(fls_dir, exp)
+            if exp in tables:
+                tables[exp].save(path)
+            elif not extend_previous:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    n_times = sum(m["n_valid_times"] for m in manifests.values())
+    logging.warning(
+        f"Merged {len(manifests)} shards into {fls_dir}: "
+        f"OBS for {n_obs} of {n_times} valid times."
+    )
+    return shared
+
+
+def _save_parts(parts, store_dir, extend_previous):
+    """Append fractions of the shards to a store or replace it by them."""
+    if extend_previous:
+        if parts:
+            write_store(pd.concat(parts), store_dir)
+    elif parts:
+        replace_store(pd.concat(parts), store_dir)
+    else:
+        clear_store(store_dir)
@@ -0,0 +1,205 @@
+"""Columnar store for FLS fractions.
+
+Dataframes indexed by valid time (optionally followed by further index levels,
+e.g. thresholds) are stored as Parquet files, partitioned by month of the
+valid time:
+
+    <fls_dir>/obs/month=YYYY-MM/part.parquet
+    <fls_dir>/fcst/exp=<exp>/month=YYYY-MM/part.parquet
+
+Appending new valid times only rewrites the partitions of the affected months.
+"""
+# Standard library
+import logging
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+# Third-party
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Local
+from .profiling import stage
+
+PART_NAME = "part.parquet"
+
+
+def obs_store_path(fls_dir):
+    """Store of OBS fractions."""
+    return Path(fls_dir, "obs")
+
+
+def fcst_store_path(fls_dir, exp):
+    """Store of FCST fractions of an experiment."""
+    return Path(fls_dir, "fcst", f"exp={exp}")
+
+
+def _month_dir(store_dir, month):
+    return Path(store_dir, f"month={month}")
+
+
+def _to_parquet(df):
+    """Parquet requires string column names and typed columns."""
+    df = df.astype(np.float32)
+    df.index = df.index.set_names(["valid_time", *df.index.names[1:]])
+    df.columns = [str(col) for col in df.columns]
+    return df
+
+
+def _column_name(col):
+    """Restore integer column names (leadtimes)."""
+    return int(col) if col.isdigit() else col
+
+
+def _write_atomic(df, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_store(df, store_dir):
+    """Append dataframe to store.
+
+    Values of df take precedence over existing values, except where they
+    are NaN. Only the month partitions covered by df are rewritten.
+
+    Args:
+        df (pd.Dataframe):  fractions indexed by valid time (and thresholds)
+        store_dir (str):    store directory
+
+    """
+    df = _to_parquet(df)
+    months = df.index.get_level_values(0).strftime("%Y-%m")
+
+    for month, new in df.groupby(months):
+        path = Path(_month_dir(store_dir, month), PART_NAME)
+        if path.is_file():
+            # union of valid times; new values unless NaN
+            with stage("open") as io:
+                old = pd.read_parquet(path)
+                io["bytes_read"] += int(old.memory_usage().sum())
+            new = new.combine_first(old).astype(np.float32)
+        with stage("save", written=[path]):
+            _write_atomic(new.sort_index(), path)
+        logging.debug(f"Saved {path}")
+
+    logging.info(f"Saved {len(df)} valid times to {store_dir}")
+
+
+def read_store(store_dir, start=None, end=None, columns=None):
+    """Read dataframe from store.
+
+    Args:
+        store_dir (str):    store directory
+        start (datetime):   first valid time (optional)
+        end (datetime):     last valid time (optional)
+        columns (list):     columns to read, e.g. leadtimes (optional)
+
+    Returns:
+        pd.Dataframe: fractions indexed by valid time and further index levels
+                      of the store (empty if no data)
+
+    """
+    first = pd.Timestamp(start).strftime("%Y-%m") if start is not None else ""
+    last = pd.Timestamp(end).strftime("%Y-%m") if end is not None else "9999-99"
+
+    if columns is not None:
+        columns = [str(col) for col in columns]
+
+    parts = []
+    for path in sorted(Path(store_dir).glob(f"month=*/{PART_NAME}")):
+        month = path.parent.name.split("=")[1]
+        if not first <= month <= last:
+            continue
+        with stage("open") as io:
+            if columns is not None:
+                available = pq.read_schema(path).names
+                part = pd.read_parquet(
+                    path, columns=[c for c in columns if c in available]
+                )
+            else:
+                part = pd.read_parquet(path)
+            io["bytes_read"] += int(part.memory_usage().sum())
+        parts.append(part)
+
+    if not parts:
+        logging.warning(f"No data in {store_dir}")
+        columns = [_column_name(col) for col in columns or []]
+        return pd.DataFrame(columns=columns, dtype=np.float32)
+
+    df = pd.concat(parts).sort_index().loc[start:end]
+    if columns is not None:
+        df = df.reindex(columns=columns)
+    df.columns = [_column_name(col) for col in df.columns]
+    return df
+
+
+def clear_store(store_dir):
+    """Remove all data from a store."""
+    if Path(store_dir).is_dir():
+        shutil.rmtree(store_dir)
+        logging.info(f"Removed {store_dir}")
+
+
+def replace_store(df, store_dir):
+    """Replace all data of a store by dataframe.
+
+    df is written to a new store next to store_dir, which then takes the
+    place of the old store. If writing fails, the old store is kept.
+
+    Args:
+        df (pd.Dataframe):  fractions indexed by valid time (and thresholds)
+        store_dir (str):    store directory
+
+    """
+    store_dir = Path(store_dir)
+    tmp_dir = store_dir.with_name(f".{store_dir.name}.{os.getpid()}.tmp")
+    old_dir = store_dir.with_name(f".{store_dir.name}.{os.getpid()}.old")
+    clear_store(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    try:
+        write_store(df, tmp_dir)
+    except BaseException:
+        clear_store(tmp_dir)
+        raise
+
+    if store_dir.is_dir():
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    clear_store(old_dir)
+    logging.info(f"Replaced {store_dir}")
+
+
+def add_level(df, name, value):
+    """Append constant index level, e.g. the threshold of a single-threshold run."""
+    return df.set_index(pd.Index([value] * len(df), name=name), append=True)
+
+
+def migrate_pickles(fls_dir, lscl_threshold=0.7, tqc_threshold=0.0001):
+    """Convert pickled obs and fcst dataframes to the columnar store.
+
+    Args:
+        fls_dir (str):          dir with fls fractions (obs.p, fcst_<exp>.p)
+        lscl_threshold (float): LSCL threshold the pickles were computed with
+        tqc_threshold (float):  TQC threshold the pickles were computed with
+
+    """
+    obs_path = Path(fls_dir, "obs.p")
+    if obs_path.is_file():
+        with open(obs_path, "rb") as f:
+            obs = add_level(pickle.load(f), "region", "plateau")
+        obs = add_level(obs, "lscl_threshold", lscl_threshold)
+        write_store(obs, obs_store_path(fls_dir))
+        logging.warning(f"Migrated {obs_path}")
+
+    for fcst_path in sorted(Path(fls_dir).glob("fcst_*.p")):
+        exp = fcst_path.stem[len("fcst_") :]
+        with open(fcst_path, "rb") as f:
+            fcst = add_level(pickle.load(f), "region", "plateau")
+        fcst = add_level(fcst, "tqc_threshold", tqc_threshold)
+        write_store(fcst, fcst_store_path(fls_dir, exp))
+        logging.warning(f"Migrated {fcst_path}")
@@ -0,0 +1,169 @@
+"""Synthetic satellite and model input for the benchmarks and tests.
+
+Files are written with the names and layouts the pipeline expects:
+MSG_lscl-*.nc (LSCL, lat_1, lon_1 on y_1/x_1) for the OBS and one grib2
+message of TQC per init time and leadtime (tqc_*.grb2) for the FCST.
+"""
+# Standard library
+import datetime as dt
+from pathlib import Path
+
+# Third-party
+import eccodes
+import numpy as np
+import xarray as xr
+
+# Local
+from .utils import sat_file_path
+from .utils import tqc_file_path
+
+# lat/lon box around the COSMO-1E domain (contains the Swiss Plateau)
+LAT_RANGE = (42.0, 50.0)
+LON_RANGE = (0.0, 17.0)
+
+# 3 km satellite grid on the box above
+DEFAULT_GRID = (270, 440)
+
+
+def latlon_grid(shape=DEFAULT_GRID):
+    """Regular 2D latitudes and longitudes."""
+    lat = np.linspace(*LAT_RANGE, shape[0])
+    lon = np.linspace(*LON_RANGE, shape[1])
+    return np.meshgrid(lat, lon, indexing="ij")
+
+
+def write_sat_files(
+    in_dir_obs, valid_times, model, shape=DEFAULT_GRID, seed=0, lscl=None
+):
+    """Write one satellite file per valid time.
+
+    LSCL is uniform in [0, 1] with 10 % of grid points covered by high
+    clouds (NaN), unless a constant value is given.
+
+    Args:
+        in_dir_obs (str):           dir with sat data
+        valid_times (list):         valid times
+        model (str):                model name in file names
+        shape (tuple):              grid size (ny, nx)
+        seed (int):                 seed of random numbers
+        lscl (float):               constant LSCL without high clouds (optional)
+
+    """
+    rng = np.random.default_rng(seed)
+    lats, lons = latlon_grid(shape)
+    Path(in_dir_obs).mkdir(parents=True, exist_ok=True)
+    for valid_time in valid_times:
+        if lscl is None:
+            values = rng.random((1,) + shape, dtype=np.float32)
+            values[0, rng.random(shape) < 0.1] = np.nan
+        else:
+            values = np.full((1,) + shape, lscl, dtype=np.float32)
+        ds = xr.Dataset(
+            {
+                "LSCL": (("time", "y_1", "x_1"), values),
+                "lat_1": (("y_1", "x_1"), lats),
+                "lon_1": (("y_1", "x_1"), lons),
+            }
+        )
+        ds.to_netcdf(sat_file_path(in_dir_obs, valid_time, model))
+
+
+def write_tqc_file(path, fields, ini_time):
+    """Write TQC as grib2 on a regular lat/lon grid, one message per leadtime.
+
+    TQC is encoded with the DWD local tables used by COSMO. A file with one
+    leadtime is written per leadtime by fieldextra, one with all leadtimes of
+    a run with --batch_fx.
+
+    Args:
+        path (str):             tqc file
+        fields (dict):          leadtime -> TQC (ny, nx)
+        ini_time (datetime):    init time
+
+    """
+    with open(path, "wb") as f:
+        for lt, values in fields.items():
+            _write_tqc_message(f, values, ini_time, lt)
+
+
+def _write_tqc_message(f, values, ini_time, lt):
+    """Append the grib message of one leadtime to an open file."""
+    ny, nx = values.shape
+    gid = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib2")
+    try:
+        for key, value in [
+            ("Ni", nx),
+            ("Nj", ny),
+            ("latitudeOfFirstGridPointInDegrees", LAT_RANGE[0]),
+            ("latitudeOfLastGridPointInDegrees", LAT_RANGE[1]),
+            ("longitudeOfFirstGridPointInDegrees", LON_RANGE[0]),
+            ("longitudeOfLastGridPointInDegrees", LON_RANGE[1]),
+            ("jScansPositively", 1),
+            ("iDirectionIncrementInDegrees", np.diff(LON_RANGE)[0] / (nx - 1)),
+            ("jDirectionIncrementInDegrees", np.diff(LAT_RANGE)[0] / (ny - 1)),
+            ("dataDate", int(ini_time.strftime("%Y%m%d"))),
+            ("dataTime", ini_time.hour * 100),
+            ("stepUnits", 1),
+            ("endStep", lt),
+            ("centre", "edzw"),
+            ("localTablesVersion", 1),
+            ("discipline", 0),
+            ("parameterCategory", 1),
+            ("parameterNumber", 69),
+            ("bitsPerValue", 16),
+        ]:
+            eccodes.codes_set(gid, key, value)
+        eccodes.codes_set_values(gid, np.ravel(values).astype(np.float64))
+        eccodes.codes_write(gid, f)
+    finally:
+        eccodes.codes_release(gid)
+
+
+def write_tqc_files(in_dir_model, exp, ini_times, max_lt, shape=DEFAULT_GRID, seed=1):
+    """Write TQC files of all init times and leadtimes.
+
+    TQC is uniform in [0, 2e-4] kg/m2, i.e. about half of the grid points
+    exceed the default threshold.
+
+    Args:
+        in_dir_model (str):     dir with model data
+        exp (str):              experiment identifier
+        ini_times (list):       init times
+        max_lt (int):           maximum leadtime
+        shape (tuple):          grid size (ny, nx)
+        seed (int):             seed of random numbers
+
+    """
+    rng = np.random.default_rng(seed)
+    Path(in_dir_model, exp).mkdir(parents=True, exist_ok=True)
+    for ini_time in ini_times:
+        for lt in range(max_lt + 1):
+            values = rng.random(shape) * 2e-4
+            write_tqc_file(
+                tqc_file_path(in_dir_model, exp, ini_time, lt), {lt: values}, ini_time
+            )
+
+
+def create_fixtures(wd, start, hours, interval, max_lt, exp, model, shape=DEFAULT_GRID):
+    """Satellite and model input of a period in a working directory.
+
+    Args:
+        wd (Path):          working directory (sat/ and tqc/ are created)
+        start (datetime):   first init time (and first valid time)
+        hours (int):        length of the period of init times
+        interval (int):     hours between init times
+        max_lt (int):       maximum leadtime
+        exp (str):          experiment identifier
+        model (str):        model name
+        shape (tuple):      grid size (ny, nx)
+
+    Returns:
+        valid_times (list), ini_times (list)
+
+    """
+    # valid times up to the last leadtime of the last init time
+    valid_times = [start + dt.timedelta(hours=h) for h in range(hours + max_lt)]
+    ini_times = valid_times[:hours:interval]
+    write_sat_files(Path(wd, "sat"), valid_times, model, shape)
+    write_tqc_files(Path(wd, "tqc"), exp, ini_times, max_lt, shape)
+    return valid_times, ini_times
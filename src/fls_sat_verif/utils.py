@@ -1,92 +1,327 @@
 """Utils for the command line tool."""
 # Standard library
+import contextlib
 import datetime as dt
+import functools
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
-import pickle
-import sys
+import re
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
+from typing import Dict
 
 # Third-party
-import matplotlib.path as mpath
-import matplotlib.pyplot as plt
+import eccodes
 import numpy as np
 import pandas as pd
 import xarray as xr
 
-# from ipdb import set_trace
-
+# Local
+from .accumulator import FractionAccumulator
+from .cache import cache_path
+from .cache import file_key
+from .cache import ReductionCache
+from .checkpoint import Checkpoint
+from .checkpoint import CHECKPOINT_INTERVAL
+from .checkpoint import CHECKPOINT_MINUTES
+from .checkpoint import checkpoint_path
+from .common import count_to_log_level  # noqa: F401
+from .common import create_working_dirs  # noqa: F401
+from .contingency import contingency_path
+from .contingency import ContingencyAccumulator
+from .inventory import Inventory
+from .prefetch import fetch
+from .prefetch import Prefetcher
+from .profiling import collect
+from .profiling import init_worker as init_profiling
+from .profiling import is_enabled as is_profiling
+from .profiling import merge_results
+from .profiling import stage
+from .shard import remove_manifest
+from .shard import shard_dir
+from .shard import shard_valid_times
+from .shard import write_manifest
+from .store import clear_store
+from .store import fcst_store_path
+from .store import obs_store_path
+from .store import read_store
+from .store import replace_store
+from .store import write_store
 
-def count_to_log_level(count: int) -> int:
-    """Map occurrence of the command line option verbose to the log level."""
-    if count == 0:
-        return logging.ERROR
-    elif count == 1:
-        return logging.WARNING
-    elif count == 2:
-        return logging.INFO
-    else:
-        return logging.DEBUG
+# from ipdb import set_trace
 
+# polygon of Swiss Plateau (Mittelland): (lat, lon)
+ML_POLYGON = (
+    (46.12, 5.89),
+    (46.06, 6.10),
+    (46.33, 6.78),
+    (46.55, 7.01),
+    (46.64, 7.31),
+    (46.65, 7.65),
+    (46.62, 7.79),
+    (46.81, 8.33),
+    (47.09, 9.78),
+    (47.82, 10.02),
+    (47.81, 8.34),
+    (47.38, 7.87),
+    (47.29, 7.68),
+    (47.25, 7.45),
+    (47.13, 7.06),
+    (47.07, 6.87),
+    (46.73, 6.36),
+    (46.59, 6.30),
+    (46.18, 5.86),
+)
+
+# regions: name -> polygons -> rings of (lat, lon) vertices
+DEFAULT_REGIONS = {"plateau": [[ML_POLYGON]]}
+
+# netCDF-C and HDF5 are not thread-safe: one netCDF file is read at a time
+# (prefetch threads read sat files while the main thread reads others)
+_netcdf_lock = threading.Lock()
+
+# errors of eccodes decoding a truncated or malformed grib message
+GRIB_DECODE_ERRORS = (
+    eccodes.PrematureEndOfFileError,
+    eccodes.MessageEndNotFoundError,
+    eccodes.MessageInvalidError,
+    eccodes.MessageMalformedError,
+    eccodes.InvalidGribError,
+    eccodes.UnsupportedEditionError,
+    eccodes.WrongLengthError,
+    eccodes.WrongBitmapSizeError,
+    eccodes.DecodingError,
+)
+
+
+class CorruptFileError(Exception):
+    """An input file is truncated or cannot be decoded."""
+
+
+@contextlib.contextmanager
+def _decoding():
+    """Raise CorruptFileError for errors of decoding netCDF or grib data.
+
+    netCDF-C reports its errors (e.g. "HDF error" of a truncated file) as
+    OSError with negative errno. OSErrors of the file system (missing file,
+    permissions, I/O) and all other errors propagate.
+    """
+    try:
+        yield
+    except OSError as e:
+        if e.errno is None or e.errno >= 0:
+            raise
+        raise CorruptFileError(e) from e
+    except GRIB_DECODE_ERRORS as e:
+        raise CorruptFileError(e) from e
+
+
+def _open_netcdf(path):
+    """Open a netCDF file as Dataset (CorruptFileError if not recognised)."""
+    try:
+        return xr.open_dataset(path)
+    except ValueError as e:
+        # no backend recognises the file, e.g. if it is empty
+        raise CorruptFileError(e) from e
+
+
+def extract_tqc(grib_file, out_dir, date_str, lt, retries=2):
+    """Extract tqc from model file using fieldextra.
 
-def create_working_dirs(wd):
-    """Create working directory and required subfolders.
+    fxfilter writes to a temporary file which is renamed once fxfilter
+    succeeded. Hence, an existing output file is always complete.
 
     Args:
-        wd (str): Path to working directory.
+        grib_file (str): Grib file
+        out_dir (str): Output directory
+        date_str (str): date YYMMDDHH
+        lt (int): leadtime
+        retries (int): number of retries if fxfilter fails
 
     Returns:
-        sat_dir: Directory for satellite data (LSCL).
-        tqc_dir: Directory for model data (TQC netcdf files.)
-        fls_dir: Directory for pandas dataframes for FLS fractions.
-        plot_dir: Directory for final plots.
+        bool: True if output file is available
 
     """
-    sat_dir = Path(wd, "sat")
-    tqc_dir = Path(wd, "tqc")
-    fls_dir = Path(wd, "fls")
-    plot_dir = Path(wd, "plots")
+    logging.debug(f"Apply fxfilter to: {grib_file}.")
+
+    # new filename
+    new_name = Path(out_dir, f"tqc_{date_str}_{lt:03}.grb2")
+    logging.info(f"Creating: {str(new_name)}.")
 
-    logging.info("Your working directories:")
+    # check whether filtered file already exists
+    if new_name.is_file():
+        logging.info(f"  ...exists already!")
+        return True
 
-    for dir in [sat_dir, tqc_dir, fls_dir, plot_dir]:
-        Path(dir).mkdir(parents=True, exist_ok=True)
-        logging.info(f"   {dir}")
+    return run_fxfilter([grib_file], new_name, retries)
 
-    return sat_dir, tqc_dir, fls_dir, plot_dir
 
+def extract_tqc_run(grib_files, out_dir, date_str, retries=2):
+    """Extract tqc from all leadtimes of a simulation with one fieldextra call.
 
-def extract_tqc(grib_file, out_dir, date_str, lt):
-    """Extract tqc from model file using fieldextra.
+    The output file contains one grib message per leadtime.
 
     Args:
-        grib_file (str): Grib file
+        grib_files (list): Grib files of all leadtimes
         out_dir (str): Output directory
         date_str (str): date YYMMDDHH
-        lt (int): leadtime
+        retries (int): number of retries if fxfilter fails
+
+    Returns:
+        bool: True if output file is available
 
     """
-    logging.debug(f"Apply fxfilter to: {grib_file}.")
+    logging.debug(f"Apply fxfilter to {len(grib_files)} files of {date_str}.")
 
     # new filename
-    new_name = Path(out_dir, f"tqc_{date_str}_{lt:03}.grb2")
+    new_name = Path(out_dir, f"tqc_{date_str}.grb2")
     logging.info(f"Creating: {str(new_name)}.")
 
     # check whether filtered file already exists
     if new_name.is_file():
-        logging.info(f"  ...exists already!")
-        return
+        logging.info("  ...exists already!")
+        return True
+
+    return run_fxfilter(grib_files, new_name, retries)
+
+
+def run_fxfilter(grib_files, new_name, retries=2):
+    """Run fxfilter and move its output atomically to new_name.
+
+    Args:
+        grib_files (list): Grib files
+        new_name (Path): Output file
+        retries (int): number of retries if fxfilter fails
+
+    Returns:
+        bool: True if output file was created
+
+    """
+    tmp_name = new_name.with_name(f"{new_name.name}.part")
+    cmd = ["fxfilter", "-o", str(tmp_name), "-s", "TQC"] + [str(f) for f in grib_files]
+
+    for attempt in range(retries + 1):
+        logging.debug(f"Will run: {' '.join(cmd)}")
+        try:
+            with stage("retrieve", read=grib_files):
+                proc = subprocess.run(cmd, capture_output=True, text=True)
+            returncode, stderr = proc.returncode, proc.stderr
+        except OSError as e:
+            returncode, stderr = None, str(e)
+
+        if returncode == 0 and tmp_name.is_file():
+            os.replace(tmp_name, new_name)
+            return True
+
+        try:
+            tmp_name.unlink()
+        except FileNotFoundError:
+            pass
+        logging.warning(
+            f"fxfilter failed for {new_name.name} "
+            f"(attempt {attempt + 1}/{retries + 1}, exit code {returncode}):"
+        )
+        logging.warning(f"  {stderr.strip()}")
+
+    return False
+
+
+def scan_model_archive(exp_model_dir, model, dates, cache_file=None):
+    """Index grib files of the model archive in a single pass.
+
+    Each FCST<YY> directory is listed once, and only the grib directories of
+    the requested simulations are listed afterwards. Listings of simulations
+    can be cached in a json file; they are reused as long as the modification
+    time of the grib directory is unchanged.
+
+    Args:
+        exp_model_dir (str): path to model (cosmo) output
+        model (str):        model name
+        dates (DatetimeIndex): init dates of simulations
+        cache_file (str):   json file for cached listings (optional)
+
+    Returns:
+        dict: (YYMMDDHH, leadtime) -> list of grib files
+
+    """
+    pattern = re.compile(rf"{re.escape(model)}ffsurf(\d{{3}})_000")
+
+    cache = {}
+    if cache_file is not None and Path(cache_file).is_file():
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    date_strs = {date.strftime("%y%m%d%H") for date in dates}
+    years = sorted({date.strftime("%y") for date in dates})
+
+    index = {}
+    n_scanned = 0
+    for year in years:
+        year_dir = Path(exp_model_dir, f"FCST{year}")
+        try:
+            run_dirs = [
+                entry.name
+                for entry in os.scandir(year_dir)
+                if entry.name[:8] in date_strs
+                and re.fullmatch(r"\d{8}_...", entry.name)
+            ]
+        except FileNotFoundError:
+            logging.warning(f"No such directory: {year_dir}")
+            continue
+
+        for run_dir in run_dirs:
+            grib_dir = Path(year_dir, run_dir, "grib")
+            try:
+                mtime = grib_dir.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+            cached = cache.get(str(grib_dir))
+            if cached is not None and cached["mtime"] == mtime:
+                names = cached["files"]
+            else:
+                names = [entry.name for entry in os.scandir(grib_dir)]
+                cache[str(grib_dir)] = {"mtime": mtime, "files": names}
+                n_scanned += 1
+
+            for name in names:
+                match = pattern.fullmatch(name)
+                if match:
+                    key = (run_dir[:8], int(match.group(1)))
+                    index.setdefault(key, []).append(Path(grib_dir, name))
 
-    # apply fxfilter
-    cmd = f"fxfilter -o {new_name} -s TQC {grib_file}"
-    logging.debug(f"Will run: {cmd}")
-    os.system(cmd)
+    logging.info(f"Listed {n_scanned} grib directories, {len(index)} entries found.")
 
-    return
+    if cache_file is not None and n_scanned > 0:
+        Path(cache_file).parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = Path(f"{cache_file}.{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+
+    return index
 
 
 def retrieve_cosmo_files(
-    start, end, interval, max_lt, tqc_dir, exp_model_dir, exp, model
+    start,
+    end,
+    interval,
+    max_lt,
+    tqc_dir,
+    exp_model_dir,
+    exp,
+    model,
+    fx_jobs=1,
+    fx_retries=2,
+    batch_fx=False,
+    cache_dir=None,
 ):
     """Retrieve COSMO files.
 
@@ -99,6 +334,10 @@ def retrieve_cosmo_files(
         exp_model_dir (str): path to model (cosmo) output
         exp (str):          experiment identifier
         model (str):         model name
+        fx_jobs (int):      number of concurrent fxfilter processes
+        fx_retries (int):   number of retries of failed fxfilter processes
+        batch_fx (bool):    one fxfilter process and output file per simulation
+        cache_dir (str):    dir for caching the index of the model archive
 
     """
     logging.info(f"Retrieving {model}-files from {exp_model_dir}")
@@ -117,28 +356,71 @@ def retrieve_cosmo_files(
     logging.info(f"   and put tqc here:")
     logging.info(f"   {out_dir}")
 
-    # loop over simulations
+    # index of model archive: (init, leadtime) -> grib files
+    cache_file = None
+    if cache_dir is not None:
+        key = hashlib.sha1(f"{Path(exp_model_dir).resolve()}:{model}".encode())
+        cache_file = Path(cache_dir, f"archive_index_{key.hexdigest()[:16]}.json")
+    index = scan_model_archive(exp_model_dir, model, dates, cache_file)
+
+    # collect extraction jobs: (description, function, arguments)
+    jobs = []
+    missing = []
+    ambiguous = []
     for date in dates:
 
         # string of date for directories
         date_str = date.strftime("%y%m%d%H")
 
         # collect grib files
+        run_files = []
         for lt in range(0, max_lt + 1, 1):
-            model_file = list(
-                Path(exp_model_dir, f"FCST{date.strftime('%y')}").glob(
-                    f"{date_str}_???/grib/{model}ffsurf{lt:03}_000"
-                )
-            )
-            print(exp_model_dir, f"{date_str}_???/grib/{model}ffsurf{lt:03}_000")
+            model_file = index.get((date_str, lt), [])
             if len(model_file) == 0:
-                logging.warning(f"No file found for {date_str}: +{lt}h.")
+                missing.append(f"{date_str} +{lt}h")
             elif len(model_file) > 1:
-                print(f"Model file description ambiguous.")
-                sys.exit(1)
+                ambiguous.append(f"{date_str} +{lt}h: {sorted(map(str, model_file))}")
+            elif batch_fx:
+                run_files.append(model_file[0])
             else:
-                # apply fxfilter
-                extract_tqc(model_file[0], out_dir, date_str, lt)
+                jobs.append(
+                    (
+                        f"{date_str} +{lt}h",
+                        extract_tqc,
+                        (model_file[0], out_dir, date_str, lt),
+                    )
+                )
+
+        if run_files:
+            jobs.append(
+                (
+                    f"{date_str} (all leadtimes)",
+                    extract_tqc_run,
+                    (run_files, out_dir, date_str),
+                )
+            )
+
+    if missing:
+        logging.warning(f"No model file found for {len(missing)} (init, leadtime):")
+        for description in missing:
+            logging.warning(f"  {description}")
+    if ambiguous:
+        logging.error(f"Model file description ambiguous for {len(ambiguous)}:")
+        for description in ambiguous:
+            logging.error(f"  {description}")
+
+    # apply fxfilter: bounded number of concurrent fieldextra processes
+    with ThreadPoolExecutor(max_workers=max(1, fx_jobs)) as executor:
+        futures = [
+            executor.submit(func, *args, retries=fx_retries) for _, func, args in jobs
+        ]
+        failed = [job[0] for job, f in zip(jobs, futures) if not f.result()]
+
+    logging.info(f"Extracted TQC for {len(jobs) - len(failed)} of {len(jobs)} jobs.")
+    if failed:
+        logging.error(f"fxfilter failed for {len(failed)} jobs:")
+        for description in failed:
+            logging.error(f"  {description}")
 
 
 def get_fls_fractions(in_dir):
@@ -151,297 +433,1671 @@ def get_fls_fractions(in_dir):
     pass
 
 
-def get_ml_mask(lats, lons):
+def points_in_polygon(lats, lons, polygon):
+    """Check which grid points lie within a polygon.
+
+    Even-odd ray casting evaluated on the full arrays at once. Points outside
+    the bounding box of the polygon are discarded before the edge tests.
+
+    Args:
+        lats (array):       latitudes
+        lons (array):       longitudes
+        polygon (sequence): (lat, lon) vertices of the polygon
+
+    Returns:
+        mask (array with True and False, same shape as lats)
+
+    """
+    lats = np.asarray(lats)
+    lons = np.asarray(lons)
+    poly = np.asarray(polygon, dtype=np.float64)
+    poly_lats = poly[:, 0]
+    poly_lons = poly[:, 1]
+
+    mask = np.zeros(lats.shape, dtype=bool)
+
+    # prefilter: only points in the bounding box of the polygon are tested
+    in_bbox = (
+        (lats >= poly_lats.min())
+        & (lats <= poly_lats.max())
+        & (lons >= poly_lons.min())
+        & (lons <= poly_lons.max())
+    )
+    lat = lats[in_bbox]
+    lon = lons[in_bbox]
+
+    # count crossings of a ray in +lon direction with each polygon edge
+    inside = np.zeros(lat.shape, dtype=bool)
+    n_verts = len(poly)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i in range(n_verts):
+            lat1, lon1 = poly[i]
+            lat2, lon2 = poly[i - 1]
+            crosses = (lat1 > lat) != (lat2 > lat)
+            lon_cross = (lon2 - lon1) * (lat - lat1) / (lat2 - lat1) + lon1
+            inside ^= crosses & (lon < lon_cross)
+
+    mask[in_bbox] = inside
+
+    return mask
+
+
+def grid_hash(lats, lons, polygon):
+    """Identify a combination of grid and polygon.
+
+    Args:
+        lats (array):       latitudes
+        lons (array):       longitudes
+        polygon (sequence): (lat, lon) vertices of the polygon
+
+    Returns:
+        str: hex digest
+
+    """
+    sha = hashlib.sha1()
+    for arr in [lats, lons, polygon]:
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        sha.update(str(arr.shape).encode())
+        sha.update(arr.tobytes())
+    return sha.hexdigest()
+
+
+def get_ml_mask(lats, lons, cache_dir=None):
     """Retrieve mask of Swiss Plateau (Mittelland).
 
+    The mask is the default region of get_region_labels (and shares its
+    cache).
+
     Args:
-        lats (array): latitudes
-        lons (array): longitudes
+        lats (array):       latitudes
+        lons (array):       longitudes
+        cache_dir (str):    directory for cached label grids (optional)
 
     Returns:
     mask (array with True and False)
 
     """
-    # polygon points
-    ll_corner = (46.12, 5.89)
-    p1 = (46.06, 6.10)
-    p2 = (46.33, 6.78)
-    p3 = (46.55, 7.01)
-    p4 = (46.64, 7.31)
-    p5 = (46.65, 7.65)
-    p6 = (46.62, 7.79)
-    p7 = (46.81, 8.33)
-    p8 = (47.09, 9.78)
-    p9 = (47.82, 10.02)
-    p10 = (47.81, 8.34)
-    p11 = (47.38, 7.87)
-    p12 = (47.29, 7.68)
-    p13 = (47.25, 7.45)
-    p14 = (47.13, 7.06)
-    p15 = (47.07, 6.87)
-    p16 = (46.73, 6.36)
-    p17 = (46.59, 6.30)
-    p18 = (46.18, 5.86)
-
-    # create polygon
-    Path = mpath.Path
-    path_data = [
-        (Path.MOVETO, ll_corner),
-        (Path.LINETO, p1),
-        (Path.LINETO, p2),
-        (Path.LINETO, p3),
-        (Path.LINETO, p4),
-        (Path.LINETO, p5),
-        (Path.LINETO, p6),
-        (Path.LINETO, p7),
-        (Path.LINETO, p8),
-        (Path.LINETO, p9),
-        (Path.LINETO, p10),
-        (Path.LINETO, p11),
-        (Path.LINETO, p12),
-        (Path.LINETO, p13),
-        (Path.LINETO, p14),
-        (Path.LINETO, p15),
-        (Path.LINETO, p16),
-        (Path.LINETO, p17),
-        (Path.LINETO, p18),
-        (Path.CLOSEPOLY, ll_corner),
-    ]
-    codes, verts = zip(*path_data)
-    path = mpath.Path(verts, codes)
+    return get_region_labels(lats, lons, DEFAULT_REGIONS, cache_dir) > 0
 
-    # store original shape
-    shape = lats.shape
 
-    # path.contains_points checks whether points are within polygon
-    # however, this function can only handle vectors
-    # -> ravel and unravel
-    latlon = [[lat, lon] for lat, lon in zip(lats.ravel(), lons.ravel())]
-    mask = np.reshape(path.contains_points(latlon), shape)
+def read_regions(region_file):
+    """Read verification regions from a GeoJSON file.
 
-    return mask
+    Every feature with a Polygon or MultiPolygon geometry is one region,
+    named by its property "name".
+
+    Args:
+        region_file (str):  GeoJSON file (FeatureCollection)
+
+    Returns:
+        dict: name -> list of polygons, each a list of rings of (lat, lon)
+
+    """
+    with open(region_file) as f:
+        features = json.load(f)["features"]
+
+    regions = {}
+    for i, feature in enumerate(features):
+        name = feature.get("properties", {}).get("name", f"region_{i}")
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            logging.warning(f"Skipping {name}: unsupported {geometry['type']}.")
+            continue
+        # GeoJSON: (lon, lat)
+        regions[name] = [
+            [[(lat, lon) for lon, lat, *_ in ring] for ring in polygon]
+            for polygon in polygons
+        ]
+
+    logging.info(f"Read {len(regions)} regions from {region_file}")
+    return regions
+
+
+def get_region_labels(lats, lons, regions, cache_dir=None):
+    """Rasterise regions into a label grid.
+
+    Grid points are labelled with the position of their region in regions
+    plus 1, grid points outside all regions with 0. Overlapping parts are
+    assigned to the first region. If a cache directory is given, the label grid
+    is stored there as .npy-file keyed by a hash of the grid and the regions,
+    and reused on later calls.
+
+    Args:
+        lats (array):       latitudes
+        lons (array):       longitudes
+        regions (dict):     name -> polygons -> rings of (lat, lon)
+        cache_dir (str):    directory for cached label grids (optional)
 
+    Returns:
+        labels (array of int16, same shape as lats)
 
-def save_as_pickle(obj, path):
-    """Save object as pickled object.
+    """
+    cache_file = None
+    if cache_dir is not None:
+        sha = hashlib.sha1(grid_hash(lats, lons, []).encode())
+        sha.update(json.dumps(regions).encode())
+        cache_file = Path(cache_dir, f"region_labels_{sha.hexdigest()}.npy")
+        if cache_file.is_file():
+            logging.debug(f"Loading region labels from {cache_file}")
+            return np.load(cache_file)
+
+    labels = np.zeros(np.shape(lats), dtype=np.int16)
+    for label, (name, polygons) in enumerate(regions.items(), start=1):
+        inside = np.zeros(labels.shape, dtype=bool)
+        for rings in polygons:
+            # holes: even-odd rule over all rings of the polygon
+            in_polygon = np.zeros(labels.shape, dtype=bool)
+            for ring in rings:
+                in_polygon ^= points_in_polygon(lats, lons, ring)
+            inside |= in_polygon
+
+        n_overlap = np.sum(inside & (labels > 0))
+        if n_overlap:
+            logging.warning(f"{n_overlap} grid points of {name} in previous region.")
+        labels[inside & (labels == 0)] = label
+        logging.debug(f"{np.sum(labels == label)} grid points in {name}.")
+
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f"{cache_file.stem}.{os.getpid()}.tmp.npy")
+        np.save(tmp_file, labels)
+        os.replace(tmp_file, cache_file)
+        logging.debug(f"Cached region labels in {cache_file}")
+
+    return labels
+
+
+def mask_window(mask):
+    """Determine the row/column bounding box of a mask.
 
     Args:
-        obj (python object): usually dataframe
-        path (str): full path
+        mask (array): 2D mask with True and False
+
+    Returns:
+        tuple of slices: (rows, cols) covering all True-points
 
     """
-    # create parent if not existing yet
-    path.parents[0].mkdir(parents=True, exist_ok=True)
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return slice(0, 0), slice(0, 0)
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
 
-    # dump object
-    pickle.dump(obj, open(path, "wb"))
-    logging.info(f"Saved {path}")
 
-    return
+def _crop(da, window):
+    """Select window of the two trailing (horizontal) dimensions of a DataArray."""
+    if window is None:
+        return da
+    ydim, xdim = da.dims[-2:]
+    return da.isel({ydim: window[0], xdim: window[1]})
 
 
-def extend_dataframe(df, new_ind):
-    """Extend existing dataframe with rows for new valid times.
+def read_latlon(obs_file, window=None):
+    """Read latitudes and longitudes from a satellite file.
 
     Args:
-        df (pd.Dataframe):          Existing dataframe
-        new_ind (DatetimeIndex):    List of valid times from start to end.
-                                    (Might overlap with existing indeces.)
+        obs_file (str):     satellite file (MSG_lscl-*.nc)
+        window (tuple):     (rows, cols) slices to read (optional)
 
     Returns:
-        pd.Dataframe: df extended with nan-rows for truly new dates.
+        lats, lons (arrays)
+
+    Raises:
+        CorruptFileError: if file is truncated or cannot be decoded
 
     """
-    # extract list of new indices which don't appear yet in dataframe
-    old_ind = df.index
-    only_new_ind = []
-    for ind in new_ind:
-        if ind in old_ind:
-            pass
-        else:
-            only_new_ind.append(ind)
+    with stage("open") as io, _netcdf_lock, _decoding(), _open_netcdf(obs_file) as ds:
+        ds = ds.squeeze()
+        lats = _crop(ds.lat_1, window).values
+        lons = _crop(ds.lon_1, window).values
+        io["bytes_read"] += lats.nbytes + lons.nbytes
+    return lats, lons
 
-    # create new df
-    only_new_df = pd.DataFrame(index=only_new_ind)
 
-    # combine existing and truly new dataset
-    combined_df = pd.concat([df, only_new_df]).sort_index()
+def read_lscl(obs_file, window=None):
+    """Read low stratus confidence level from a satellite file.
 
-    return combined_df
+    Only the hyperslab given by window is read from disk.
 
+    Args:
+        obs_file (str):     satellite file (MSG_lscl-*.nc)
+        window (tuple):     (rows, cols) slices to read (optional)
 
-def calc_fls_fractions(
-    start,
-    end,
-    interval,
+    Returns:
+        lscl (float32 array)
+
+    Raises:
+        CorruptFileError: if file is truncated or cannot be decoded
+
+    """
+    with stage("open") as io, _netcdf_lock, _decoding(), _open_netcdf(obs_file) as ds:
+        lscl = _crop(ds.LSCL.squeeze(), window).values
+        io["bytes_read"] += lscl.nbytes
+    return lscl.astype(np.float32, copy=False)
+
+
+def read_tqc(fcst_file, window=None, lt=None):
+    """Read TQC from a grib file filtered by fieldextra.
+
+    The grib message is decoded with eccodes directly, without building an
+    index file or an xarray Dataset.
+
+    Args:
+        fcst_file (str):    grib file (tqc_*.grb2)
+        window (tuple):     (rows, cols) slices to read (optional)
+        lt (int):           leadtime to select in files with all leadtimes
+
+    Returns:
+        tqc (float32 array)
+
+    Raises:
+        KeyError: if file does not contain leadtime lt
+        CorruptFileError: if file is empty, truncated or cannot be decoded
+
+    """
+    # grib messages are decoded in full, also if only a window is returned
+    with stage("open") as io, open(fcst_file, "rb") as f, _decoding():
+        if lt is not None:
+            offsets = _leadtime_offsets(fcst_file)
+            if offsets and lt not in offsets:
+                raise KeyError(lt)
+            f.seek(offsets.get(lt, 0))
+        gid = eccodes.codes_grib_new_from_file(f)
+        if gid is None:
+            # e.g. empty or cut off before the first message
+            raise CorruptFileError(f"No grib message in {fcst_file}")
+        try:
+            if eccodes.codes_get(gid, "shortName") != "TQC":
+                # in case fxfilter did not write out variable name
+                logging.warning("Assuming that unknown variable in file is TQC.")
+            tqc = _decode_values(gid)
+            io["bytes_read"] += tqc.nbytes
+        finally:
+            eccodes.codes_release(gid)
+
+    if window is not None:
+        # copy: do not keep the full field alive
+        tqc = tqc[window].copy()
+    return tqc
+
+
+def _leadtime_offsets(fcst_file):
+    """Byte offset of the grib message of each leadtime in a file.
+
+    A file with all leadtimes of a run (--batch_fx) is read once per leadtime.
+    Its headers are scanned once per process, then every read only decodes
+    its own message.
+    """
+    return _scan_leadtimes(*file_key(fcst_file))
+
+
+@functools.lru_cache(maxsize=256)
+def _scan_leadtimes(path, size, mtime_ns):
+    """Leadtime in hours -> byte offset of the grib messages in path."""
+    offsets = {}
+    with open(path, "rb") as f:
+        while True:
+            gid = eccodes.codes_grib_new_from_file(f, headers_only=True)
+            if gid is None:
+                break
+            try:
+                eccodes.codes_set(gid, "stepUnits", 1)
+                offsets.setdefault(
+                    eccodes.codes_get(gid, "endStep"),
+                    eccodes.codes_get_message_offset(gid),
+                )
+            finally:
+                eccodes.codes_release(gid)
+    return offsets
+
+
+def _decode_values(gid):
+    """Decode values of a grib message to a 2D float32 array (NaN if missing)."""
+    ni = eccodes.codes_get(gid, "Ni")
+    nj = eccodes.codes_get(gid, "Nj")
+    values = eccodes.codes_get_values(gid).astype(np.float32)
+    if eccodes.codes_get(gid, "bitmapPresent"):
+        values[values == eccodes.codes_get(gid, "missingValue")] = np.nan
+    return values.reshape(nj, ni)
+
+
+def select_level(df, level, value):
+    """Select value of an index level, e.g. one threshold.
+
+    Args:
+        df (pd.Dataframe):  dataframe indexed by valid time (and further levels)
+        level (str):        name of index level
+        value:              value to select
+
+    Returns:
+        pd.Dataframe: indexed by valid time
+
+    """
+    if level not in df.index.names:
+        return df
+    values = df.index.get_level_values(level)
+    if value not in values:
+        raise KeyError(f"{level}={value} not available: {sorted(set(values))}")
+    return df.xs(value, level=level)
+
+
+def sat_file_path(in_dir_obs, valid_time, model):
+    """Path of satellite file for a valid time.
+
+    Args:
+        in_dir_obs (str):       dir with sat data
+        valid_time (datetime):  valid time
+        model (str):            model name
+
+    Returns:
+        Path
+
+    """
+    # timestamp from sat images: -15min
+    obs_timestamp = (valid_time - dt.timedelta(minutes=15)).strftime("%y%m%d%H%M")
+    return Path(in_dir_obs, f"MSG_lscl-cosmo1eqc3km_{obs_timestamp}_{model}.nc")
+
+
+def tqc_file_path(in_dir_model, exp, ini_time, lt):
+    """Path of TQC file for an init time and leadtime.
+
+    Args:
+        in_dir_model (str):     dir with model data
+        exp (str):              experiment identifier
+        ini_time (datetime):    init time of simulation
+        lt (int):               leadtime
+
+    Returns:
+        Path
+
+    """
+    ini_time_str = ini_time.strftime("%y%m%d%H")
+    return Path(in_dir_model, exp, f"tqc_{ini_time_str}_{lt:03}.grb2")
+
+
+def tqc_run_file_path(in_dir_model, exp, ini_time):
+    """Path of TQC file containing all leadtimes of a simulation (--batch_fx).
+
+    Args:
+        in_dir_model (str):     dir with model data
+        exp (str):              experiment identifier
+        ini_time (datetime):    init time of simulation
+
+    Returns:
+        Path
+
+    """
+    ini_time_str = ini_time.strftime("%y%m%d%H")
+    return Path(in_dir_model, exp, f"tqc_{ini_time_str}.grb2")
+
+
+def mask_hash(labels, window):
+    """Identify a cropped mask (or label grid) and its position in the full grid."""
+    sha = hashlib.sha1(np.ascontiguousarray(labels).tobytes())
+    sha.update(str([labels.shape, labels.dtype.str, window]).encode())
+    return sha.hexdigest()
+
+
+def find_region_labels(
+    valid_times, in_dir_obs, model, regions=DEFAULT_REGIONS, cache_dir=None
+):
+    """Determine region labels from the first available satellite file.
+
+    Args:
+        valid_times (DatetimeIndex):    valid times
+        in_dir_obs (str):               dir with sat data
+        model (str):                    model name
+        regions (dict):                 name -> polygons -> rings of (lat, lon)
+        cache_dir (str):                dir for cached label grids (optional)
+
+    Returns:
+        labels (array):     labels cropped to bounding box of all regions
+                            (None if no sat file)
+        window (tuple):     (rows, cols) slices of bounding box in full grid
+
+    """
+    for valid_time in valid_times:
+        obs_file = sat_file_path(in_dir_obs, valid_time, model)
+        try:
+            lats, lons = read_latlon(obs_file)
+        except FileNotFoundError:
+            continue
+        except CorruptFileError as e:
+            logging.error(f"Skipping corrupt {obs_file}: {e}")
+            continue
+        with stage("mask"):
+            labels = get_region_labels(lats, lons, regions, cache_dir)
+            window = mask_window(labels > 0)
+        logging.debug(f"Reading window {window} of {labels.shape} grid.")
+        return labels[window], window
+
+    return None, None
+
+
+def region_points(labels, n_regions):
+    """Grid points in any region, their region index and the region sizes.
+
+    Args:
+        labels (array):     region labels (0: outside)
+        n_regions (int):    number of regions
+
+    Returns:
+        in_regions (array): True at grid points in any region
+        groups (array):     region index (label - 1) of these grid points
+        sizes (array):      number of grid points per region
+
+    """
+    in_regions = labels > 0
+    groups = labels[in_regions].astype(np.intp) - 1
+    sizes = np.bincount(groups, minlength=n_regions)
+    return in_regions, groups, sizes
+
+
+def open_sat_cube(obs_files, window=None, chunk_size=24):
+    """Open satellite files lazily as one time-stacked LSCL cube.
+
+    Args:
+        obs_files (list):   satellite files (MSG_lscl-*.nc), sorted by time
+        window (tuple):     (rows, cols) slices to read (optional)
+        chunk_size (int):   number of time steps per dask chunk
+
+    Returns:
+        DataArray with dimensions (valid_time, y, x)
+
+    Raises:
+        CorruptFileError: if a file cannot be decoded or combined with the
+                          others (read them one by one instead)
+
+    """
+    # lazy: data is read (and counted) chunk by chunk
+    with stage("open"), _decoding():
+        try:
+            cube = xr.open_mfdataset(
+                obs_files,
+                combine="nested",
+                concat_dim="valid_time",
+                preprocess=functools.partial(_preprocess_sat, window=window),
+                data_vars="all",
+                coords="minimal",
+                compat="override",
+            ).LSCL
+        except ValueError as e:
+            raise CorruptFileError(e) from e
+    return cube.chunk({"valid_time": chunk_size})
+
+
+def _preprocess_sat(ds, window):
+    """Reduce satellite file to cropped 2D LSCL field (for open_mfdataset)."""
+    lscl = ds.LSCL.squeeze(drop=True)
+    return _crop(lscl, window).reset_coords(drop=True).to_dataset()
+
+
+def count_exceedances(values, thresholds, groups=None, n_groups=1):
+    """Count values above each threshold and NaN-values in a single pass.
+
+    Each value is assigned to the bin of the number of thresholds it exceeds
+    (NaN to an extra bin), so any number of thresholds and groups (regions)
+    costs one histogram.
+
+    Args:
+        values (array):     values, counted along the last dimension
+        thresholds (list):  thresholds
+        groups (array):     group index of each value along the last dimension
+                            (optional)
+        n_groups (int):     number of groups
+
+    Returns:
+        counts (array):     number of values > threshold,
+                            shape (..., thresholds) or (..., groups, thresholds)
+        n_nan (array):      number of NaN-values, shape (...) or (..., groups)
+
+    """
+    values = np.asarray(values)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    order = np.argsort(thresholds)
+    n_thr = len(thresholds)
+    n_bins = n_thr + 2
+
+    rows = values.reshape(-1, values.shape[-1])
+
+    # bin = number of thresholds below value, NaN -> last bin
+    bins = np.searchsorted(thresholds[order], rows, side="left")
+    bins[np.isnan(rows)] = n_thr + 1
+
+    # one histogram per row and group
+    if groups is not None:
+        bins += n_bins * np.asarray(groups)
+    n_cells = n_groups * n_bins
+    bins += n_cells * np.arange(len(rows))[:, np.newaxis]
+    hist = np.bincount(bins.ravel(), minlength=n_cells * len(rows))
+    hist = hist.reshape(len(rows), n_groups, n_bins)
+
+    # value > j-th (sorted) threshold <=> bin > j
+    exceed = np.cumsum(hist[..., n_thr:0:-1], axis=-1)[..., ::-1]
+    counts = np.empty_like(exceed)
+    counts[..., order] = exceed
+
+    shape = values.shape[:-1]
+    if groups is None:
+        return counts.reshape(shape + (n_thr,)), hist[:, 0, -1].reshape(shape)
+    return (
+        counts.reshape(shape + (n_groups, n_thr)),
+        hist[..., -1].reshape(shape + (n_groups,)),
+    )
+
+
+def reduce_obs(lscl_ml, thresholds, groups, n_regions):
+    """Count FLS and high cloud grid points per region.
+
+    Args:
+        lscl_ml (array):    LSCL at grid points in regions, optionally with
+                            leading time dimension
+        thresholds (list):  thresholds for low stratus confidence level
+        groups (array):     region index of the grid points
+        n_regions (int):    number of regions
+
+    Returns:
+        n_fls (array):          FLS grid points per region and threshold
+        n_high_clouds (array):  grid points covered by high clouds (NaN) per
+                                region
+
+    """
+    with stage("reduce"):
+        return count_exceedances(lscl_ml, thresholds, groups, n_regions)
+
+
+def fcst_inputs(valid_time, in_dir_model, exp, max_lt):
+    """Collect available FCST files for one valid time.
+
+    Args:
+        valid_time (datetime):  valid time
+        in_dir_model (str):     dir with model data
+        exp (str):              experiment identifier
+        max_lt (int):           maximum leadtime
+
+    Returns:
+        list of (leadtime, tqc file, leadtime to select in file or None)
+
+    """
+    inputs = []
+    for lt in range(max_lt + 1):
+        ini_time = valid_time - dt.timedelta(hours=lt)
+        fcst_file = tqc_file_path(in_dir_model, exp, ini_time, lt)
+        run_file = tqc_run_file_path(in_dir_model, exp, ini_time)
+
+        if fcst_file.is_file():
+            inputs.append((lt, fcst_file, None))
+        elif run_file.is_file():
+            inputs.append((lt, run_file, lt))
+        # else:
+        #     logging.debug(f"  but no {fcst_file}")
+
+    return inputs
+
+
+def _exp_inputs(inventory, valid_time, exps, max_lt):
+    """Experiment -> available FCST files from inventory (None: probe files)."""
+    if inventory is None:
+        return None
+    return {exp: inventory.fcst_inputs(valid_time, exp, max_lt) for exp in exps}
+
+
+def _fractions(counts, sizes):
+    """Divide counts (regions, ...) by region sizes; NaN for empty regions."""
+    counts = np.asarray(counts, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    sizes = sizes.reshape(sizes.shape + (1,) * (counts.ndim - sizes.ndim))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return counts / sizes
+
+
+def _obs_cache_key(cache, obs_id, thresholds):
+    return cache.key("obs", obs_id, thresholds)
+
+
+def _fcst_cache_key(cache, fcst_file, lt_in_file, obs_id, tqc_thresholds):
+    return cache.key("fcst", file_key(fcst_file), lt_in_file, obs_id, tqc_thresholds)
+
+
+def prefetch_jobs(
+    valid_times,
+    window,
     in_dir_obs,
     in_dir_model,
-    out_dir_fls,
+    exps,
+    max_lt,
+    thresholds,
+    model,
+    tqc_thresholds=(0.0001,),
+    cache=None,
+    events=False,
+    obs=True,
+    inventory=None,
+):
+    """Files read by the reduction of valid times, in order of use.
+
+    Files whose results are in the reduction cache are left out. Arguments
+    as for reduce_valid_time.
+
+    Args:
+        obs (bool):             include sat files (False: read as cube)
+        inventory (Inventory):  available files (None: probe files)
+
+    Returns:
+        list of (valid time, key, read function, args, nbytes) for Prefetcher
+
+    """
+    rows, cols = window
+    nbytes = (rows.stop - rows.start) * (cols.stop - cols.start) * 4
+
+    jobs = []
+    for valid_time in valid_times:
+        obs_file = sat_file_path(in_dir_obs, valid_time, model)
+        try:
+            obs_id = file_key(obs_file)
+        except FileNotFoundError:
+            continue
+
+        inputs = _exp_inputs(inventory, valid_time, exps, max_lt)
+        fcst_jobs = []
+        for exp in exps:
+            if inputs is None:
+                exp_inputs = fcst_inputs(valid_time, in_dir_model, exp, max_lt)
+            else:
+                exp_inputs = inputs[exp]
+            for _, fcst_file, lt_in_file in exp_inputs:
+                key = ("tqc", fcst_file, lt_in_file)
+                args = (fcst_file, window, lt_in_file)
+                if (
+                    events
+                    or cache is None
+                    or not cache.contains(
+                        _fcst_cache_key(
+                            cache, fcst_file, lt_in_file, obs_id, tqc_thresholds
+                        )
+                    )
+                ):
+                    fcst_jobs.append((valid_time, key, read_tqc, args, nbytes))
+
+        # sat file also provides the high clouds for the FCST
+        if obs and (
+            fcst_jobs
+            or events
+            or cache is None
+            or not cache.contains(_obs_cache_key(cache, obs_id, thresholds))
+        ):
+            jobs.append(
+                (valid_time, ("lscl", obs_file), read_lscl, (obs_file, window), nbytes)
+            )
+        jobs.extend(fcst_jobs)
+
+    return jobs
+
+
+def reduce_fcst(
+    valid_time,
+    high_clouds_ml,
+    points,
+    window,
+    in_dir_model,
     exp,
     max_lt,
-    extend_previous,
-    threshold,
+    tqc_thresholds=(0.0001,),
+    cache=None,
+    obs_id=None,
+    events=False,
+    prefetch=None,
+    inputs=None,
+):
+    """Calculate FLS fractions of all available FCST for one valid time.
+
+    Args:
+        valid_time (datetime):  valid time
+        high_clouds_ml (array): True at region grid points covered by high
+                                clouds (or function returning it, called only
+                                if a FCST file has to be reduced)
+        points (tuple):         grid points in regions (see region_points)
+        window (tuple):         (rows, cols) slices of window in full grid
+        in_dir_model (str):     dir with model data
+        exp (str):              experiment identifier
+        max_lt (int):           maximum leadtime
+        tqc_thresholds (list):  thresholds for TQC in kg/m2
+        cache (ReductionCache): cache of per-file results (optional)
+        obs_id (list):          identity of sat file providing high_clouds_ml
+        events (bool):          also return FLS events at the region grid points
+                                (first threshold); all files are read
+        prefetch (Prefetcher):  files read ahead (optional)
+        inputs (list):          available FCST files (see fcst_inputs);
+                                probed if None
+
+    Returns:
+        fcst_fracs (dict):      FLS fractions per region and threshold per
+                                leadtime
+        fcst_events (dict):     FLS events per leadtime (only if events)
+
+    """
+    in_regions, groups, sizes = points
+
+    if inputs is None:
+        inputs = fcst_inputs(valid_time, in_dir_model, exp, max_lt)
+
+    fcst_fracs = {}
+    fcst_events = {}
+    for lt, fcst_file, lt_in_file in inputs:
+
+        if cache is not None:
+            key = _fcst_cache_key(cache, fcst_file, lt_in_file, obs_id, tqc_thresholds)
+            cached = None if events else cache.get(key)
+            if cached is not None:
+                if cached[0] is not None:
+                    fcst_fracs[lt] = _fractions(cached[0], cached[1])
+                continue
+
+        logging.info(f"Loading +{lt}h from {fcst_file}")
+        try:
+            tqc = fetch(
+                prefetch,
+                ("tqc", fcst_file, lt_in_file),
+                read_tqc,
+                fcst_file,
+                window,
+                lt_in_file,
+            )
+        except KeyError:
+            logging.debug(f"  but no +{lt}h in {fcst_file}")
+            if cache is not None:
+                cache.put(key, [None, sizes.tolist()])
+            continue
+        except CorruptFileError as e:
+            logging.error(f"Skipping corrupt {fcst_file}: {e}")
+            continue
+
+        if callable(high_clouds_ml):
+            high_clouds_ml = high_clouds_ml()
+
+        with stage("reduce"):
+            # mask regions
+            tqc_ml = tqc[in_regions]
+
+            # overwrite grid points covered by high clouds with nan
+            tqc_ml[high_clouds_ml] = np.nan
+
+            # count grid points with liquid water path > threshold (0.1 g/m2)
+            n_fls, _ = count_exceedances(tqc_ml, tqc_thresholds, groups, len(sizes))
+
+            fcst_fracs[lt] = _fractions(n_fls, sizes)
+        if cache is not None:
+            cache.put(key, [n_fls.tolist(), sizes.tolist()])
+
+        if events:
+            fcst_events[lt] = tqc_ml > tqc_thresholds[0]
+
+    if events:
+        return fcst_fracs, fcst_events
+
+    return fcst_fracs
+
+
+def reduce_fcst_exps(
+    valid_time,
+    high_clouds_ml,
+    points,
+    window,
+    in_dir_model,
+    exps,
+    max_lt,
+    events=False,
+    inputs=None,
+    **kwargs,
+):
+    """Calculate FLS fractions of all available FCST of several experiments.
+
+    All experiments are compared to the same OBS: the high cloud mask is
+    determined at most once.
+
+    Args:
+        valid_time (datetime):  valid time
+        high_clouds_ml (array): see reduce_fcst
+        points (tuple):         grid points in regions (see region_points)
+        window (tuple):         (rows, cols) slices of window in full grid
+        in_dir_model (str):     dir with model data
+        exps (list):            experiment identifiers
+        max_lt (int):           maximum leadtime
+        events (bool):          also return FLS events (see reduce_fcst)
+        inputs (dict):          experiment -> available FCST files (see
+                                fcst_inputs); probed if None
+        **kwargs:               passed to reduce_fcst
+
+    Returns:
+        fcst_fracs (dict):      experiment -> FLS fractions per leadtime
+        fcst_events (dict):     experiment -> FLS events per leadtime
+                                (only if events)
+
+    """
+    if callable(high_clouds_ml):
+        high_clouds_ml = functools.lru_cache(maxsize=None)(high_clouds_ml)
+
+    fcst_fracs = {}
+    fcst_events = {}
+    for exp in exps:
+        result = reduce_fcst(
+            valid_time,
+            high_clouds_ml,
+            points,
+            window,
+            in_dir_model,
+            exp,
+            max_lt,
+            events=events,
+            inputs=None if inputs is None else inputs[exp],
+            **kwargs,
+        )
+        if events:
+            fcst_fracs[exp], fcst_events[exp] = result
+        else:
+            fcst_fracs[exp] = result
+
+    if events:
+        return fcst_fracs, fcst_events
+    return fcst_fracs
+
+
+def reduce_valid_time(
+    valid_time,
+    points,
+    window,
+    in_dir_obs,
+    in_dir_model,
+    exps,
+    max_lt,
+    thresholds,
     model,
+    tqc_thresholds=(0.0001,),
+    cache=None,
+    events=False,
+    prefetch=None,
+    inputs=None,
 ):
-    """Calculate FLS fractions in Swiss Plateau for OBS and FCST.
+    """Calculate FLS fractions of OBS and all available FCST for one valid time.
 
     Args:
-        start (datetime):       start
-        end (datetime):         end
-        interval (int):         interval between simulations in hours
+        valid_time (datetime):  valid time
+        points (tuple):         grid points in regions (see region_points)
+        window (tuple):         (rows, cols) slices of window in full grid
         in_dir_obs (str):       dir with sat data
         in_dir_model (str):     dir with model data
-        out_dir_fls (str):      dir with fls fractions
-        exp (str):              experiment identifier
+        exps (list):            experiment identifiers
         max_lt (int):           maximum leadtime
-        extend_previous (bool): load previous obs and fcst dataframes
-        threshold (float):      threshold for low stratus confidence level
+        thresholds (list):      thresholds for low stratus confidence level
         model (str):            model name
-
+        tqc_thresholds (list):  thresholds for TQC in kg/m2
+        cache (ReductionCache): cache of per-file results (optional)
+        events (bool):          also return FLS events at the region grid points
+        prefetch (Prefetcher):  files read ahead (optional)
+        inputs (dict):          experiment -> available FCST files (see
+                                fcst_inputs); probed if None
 
     Returns:
-        obs (dataframe)
-        fcst (dataframe)
+        None if no sat file is available, otherwise
+        obs_fracs (tuple):      FLS fractions per region and threshold,
+                                high cloud fraction per region
+        fcst_fracs (dict):      experiment -> FLS fractions per region and
+                                threshold per leadtime
+        events (tuple):         only if events: grid points without high
+                                clouds, OBS events, FCST events per
+                                experiment and leadtime
 
     """
-    # determine init and valid timestamps
-    ini_times = pd.date_range(start=start, end=end, freq=f"{interval}H")
-    valid_times = pd.date_range(
-        start=start, end=end + dt.timedelta(hours=max_lt), freq="1H"
+    # A) extract FLS fraction from OBS
+    ##################################
+
+    # obs filename
+    obs_file = sat_file_path(in_dir_obs, valid_time, model)
+    logging.warning(f"SAT file: {obs_file}")
+
+    try:
+        obs_id = file_key(obs_file)
+    except FileNotFoundError:
+        logging.warning(f"No sat file for {valid_time}.")
+        logging.debug(f" -> {obs_file}")
+        return None
+
+    try:
+        return _reduce_valid_time(
+            valid_time,
+            obs_file,
+            obs_id,
+            points,
+            window,
+            in_dir_model,
+            exps,
+            max_lt,
+            thresholds,
+            tqc_thresholds=tqc_thresholds,
+            cache=cache,
+            events=events,
+            prefetch=prefetch,
+            inputs=inputs,
+        )
+    except CorruptFileError as e:
+        # errors of FCST files are handled in reduce_fcst
+        logging.error(f"Skipping corrupt {obs_file}: {e}")
+        return None
+
+
+def _reduce_valid_time(
+    valid_time,
+    obs_file,
+    obs_id,
+    points,
+    window,
+    in_dir_model,
+    exps,
+    max_lt,
+    thresholds,
+    tqc_thresholds,
+    cache,
+    events,
+    prefetch,
+    inputs,
+):
+    """reduce_valid_time once the sat file is known to exist."""
+    in_regions, groups, sizes = points
+
+    # sat file is read at most once, and only if needed
+    @functools.lru_cache(maxsize=None)
+    def load_lscl_ml():
+        # lscl = low stratus confidence level (diagnosed)
+        lscl = fetch(prefetch, ("lscl", obs_file), read_lscl, obs_file, window)
+        return lscl[in_regions]
+
+    obs_counts = None
+    if cache is not None:
+        obs_key = _obs_cache_key(cache, obs_id, thresholds)
+        obs_counts = cache.get(obs_key)
+
+    if obs_counts is None:
+        n_fls, n_high_clouds = reduce_obs(
+            load_lscl_ml(), thresholds, groups, len(sizes)
+        )
+        obs_counts = [n_fls.tolist(), n_high_clouds.tolist(), sizes.tolist()]
+        if cache is not None:
+            cache.put(obs_key, obs_counts)
+
+    n_fls, n_high_clouds, sizes = obs_counts
+    obs_fracs = (_fractions(n_fls, sizes), _fractions(n_high_clouds, sizes))
+
+    # B) extract FLS fraction from FCST
+    ###################################
+
+    fcst_result = reduce_fcst_exps(
+        valid_time,
+        lambda: np.isnan(load_lscl_ml()),
+        points,
+        window,
+        in_dir_model,
+        exps,
+        max_lt,
+        tqc_thresholds=tqc_thresholds,
+        cache=cache,
+        obs_id=obs_id,
+        events=events,
+        prefetch=prefetch,
+        inputs=inputs,
     )
-    first_date = valid_times[0].strftime("%b %d, %Y, %H UTC")
-    last_date = valid_times[-1].strftime("%b %d, %Y, %H UTC")
-    logging.info("Calculating FLS fractions ")
-    logging.info(f"   for {first_date} to {last_date}.")
 
-    # retrieve OBS dataframe
-    obs_path = Path(out_dir_fls, "obs.p")
-    if obs_path.is_file() and extend_previous:
-        existing_obs = pickle.load(open(obs_path, "rb"))
-        obs = extend_dataframe(existing_obs, valid_times)
-        logging.warning(f"Loaded obs from pickled object:")
-        logging.warning(f"  {obs_path}")
-    else:
-        # create dataframe
-        obs = pd.DataFrame(columns=["fls_frac", "high_clouds"], index=valid_times)
-        logging.warning("Created new obs dataframe:")
-        logging.warning(f"  {obs_path}")
-
-    # retrieve FCST dataframe
-    fcst_path = Path(out_dir_fls, f"fcst_{exp}.p")
-    if fcst_path.is_file() and extend_previous:
-        existing_fcst = pickle.load(open(fcst_path, "rb"))
-        fcst = extend_dataframe(existing_fcst, valid_times)
-        logging.warning("Loaded fcst from pickled object:")
-        logging.warning(f"  {fcst_path}")
-    else:
-        # create dataframe
-        fcst = pd.DataFrame(columns=np.arange(max_lt + 1), index=valid_times)
-        logging.warning("Created new fcst dataframe:")
-        logging.warning(f"  {fcst_path}")
+    if events:
+        fcst_fracs, fcst_events = fcst_result
+        lscl_ml = load_lscl_ml()
+        obs_events = (~np.isnan(lscl_ml), lscl_ml > thresholds[0], fcst_events)
+        return obs_fracs, fcst_fracs, obs_events
 
-    # initiate variables
-    ml_mask = None
-    ml_size = None
+    return obs_fracs, fcst_result
 
-    for valid_time in valid_times:
 
-        valid_time_str = valid_time.strftime("%y%m%d%H")
+def _iter_valid_times(
+    valid_times,
+    points,
+    window,
+    executor,
+    chunksize,
+    cache=None,
+    inventory=None,
+    **kwargs,
+):
+    """Yield (valid_time, result of reduce_valid_time) in order of valid_times."""
+    inputs = [
+        _exp_inputs(inventory, vt, kwargs["exps"], kwargs["max_lt"])
+        for vt in valid_times
+    ]
+    if executor is None:
+        for valid_time, vt_inputs in zip(valid_times, inputs):
+            yield valid_time, reduce_valid_time(
+                valid_time, points, window, cache=cache, inputs=vt_inputs, **kwargs
+            )
+        return
 
-        # A) extract FLS fraction from OBS
-        ##################################
+    # map returns results in order of valid_times -> deterministic merge
+    results = executor.map(
+        functools.partial(_reduce_valid_time_worker, **kwargs),
+        valid_times,
+        inputs,
+        chunksize=chunksize,
+    )
+    yield from zip(valid_times, merge_results(results))
 
-        # timestamp from sat images: -15min
-        obs_timestamp = (valid_time - dt.timedelta(minutes=15)).strftime("%y%m%d%H%M")
-        logging.debug(f"SAT timestamp: {obs_timestamp}")
 
-        # obs filename
-        obs_file = Path(in_dir_obs, f"MSG_lscl-cosmo1eqc3km_{obs_timestamp}_{model}.nc")
-        logging.warning(f"SAT file: {obs_file}")
+def _iter_sat_cube(
+    valid_times,
+    points,
+    window,
+    executor,
+    chunk_size,
+    in_dir_obs,
+    thresholds,
+    model,
+    cache=None,
+    events=False,
+    inventory=None,
+    **kwargs,
+):
+    """Yield (valid_time, result) with OBS reduced chunk-wise from a lazy cube.
 
-        # load obs file
+    The reduction cache is only used for FCST files: the SAT files are read as
+    cube anyway. Chunks containing a corrupt SAT file are reduced file by file.
+    """
+    in_regions, groups, sizes = points
+
+    def file_by_file(times):
+        return _iter_valid_times(
+            times,
+            points,
+            window,
+            executor,
+            1,
+            cache=cache,
+            inventory=inventory,
+            in_dir_obs=in_dir_obs,
+            thresholds=thresholds,
+            model=model,
+            events=events,
+            **kwargs,
+        )
+
+    obs_times = []
+    obs_files = []
+    for valid_time in valid_times:
+        if inventory is None:
+            obs_file = sat_file_path(in_dir_obs, valid_time, model)
+            if not obs_file.is_file():
+                obs_file = None
+        else:
+            obs_file = inventory.obs_file(valid_time)
+        if obs_file is not None:
+            obs_times.append(valid_time)
+            obs_files.append(obs_file)
+        else:
+            logging.warning(f"No sat file for {valid_time}.")
+    if not obs_files:
+        return
+
+    try:
+        cube = open_sat_cube(obs_files, window, chunk_size)
+    except CorruptFileError as e:
+        logging.error(f"Cannot open SAT files as cube: {e}")
+        yield from file_by_file(obs_times)
+        return
+
+    for i0 in range(0, len(obs_files), chunk_size):
+        times = obs_times[i0 : i0 + chunk_size]
+        logging.info(f"Reducing SAT chunk {times[0]} to {times[-1]}.")
+
+        # one masked reduction over the time axis of the chunk
         try:
-            ds = xr.open_dataset(obs_file).squeeze()
-        except FileNotFoundError:
-            logging.warning(f"No sat file for {obs_timestamp}.")
-            logging.debug(f" -> {obs_file}")
+            with stage("open") as io, _decoding():
+                lscl = cube[i0 : i0 + chunk_size].values
+                io["bytes_read"] += lscl.nbytes
+                lscl_ml = lscl[:, in_regions]
+        except CorruptFileError as e:
+            logging.error(f"Cannot read SAT chunk: {e}")
+            yield from file_by_file(times)
             continue
+        n_fls, n_high_clouds = reduce_obs(lscl_ml, thresholds, groups, len(sizes))
+        high_clouds_ml = np.isnan(lscl_ml)
+
+        obs_ids = [file_key(f) for f in obs_files[i0 : i0 + chunk_size]]
+        inputs = [
+            _exp_inputs(inventory, vt, kwargs["exps"], kwargs["max_lt"]) for vt in times
+        ]
+
+        if executor is None:
+            fcst_results = (
+                reduce_fcst_exps(
+                    vt,
+                    high,
+                    points,
+                    window,
+                    cache=cache,
+                    obs_id=obs_id,
+                    events=events,
+                    inputs=vt_inputs,
+                    **kwargs,
+                )
+                for vt, high, obs_id, vt_inputs in zip(
+                    times, high_clouds_ml, obs_ids, inputs
+                )
+            )
+        else:
+            fcst_results = merge_results(
+                executor.map(
+                    functools.partial(_reduce_fcst_worker, events=events, **kwargs),
+                    times,
+                    high_clouds_ml,
+                    obs_ids,
+                    inputs,
+                )
+            )
 
-        if ml_mask is None:
-            ml_mask = get_ml_mask(ds.lat_1.values, ds.lon_1.values)
-            ml_size = np.sum(ml_mask)
-            logging.debug(f"{ml_size} grid points in ML.")
+        for i, fcst_result in enumerate(fcst_results):
+            obs_fracs = (
+                _fractions(n_fls[i], sizes),
+                _fractions(n_high_clouds[i], sizes),
+            )
+            if events:
+                fcst_fracs, fcst_events = fcst_result
+                obs_events = (
+                    ~high_clouds_ml[i],
+                    lscl_ml[i] > thresholds[0],
+                    fcst_events,
+                )
+                yield times[i], (obs_fracs, fcst_fracs, obs_events)
+            else:
+                yield times[i], (obs_fracs, fcst_result)
 
-        # lscl = low stratus confidence level (diagnosed)
-        lscl = ds.LSCL.values
-        lscl_ml = lscl[ml_mask]
 
-        # count nan-values (=high clouds)
-        n_high_clouds = np.sum(np.isnan(lscl_ml))
+# state of worker processes, set once per process by _init_worker
+_worker_state: Dict[str, Any] = {}
 
-        # count values larger than threshold (=FLS)
-        n_fls = np.sum(lscl_ml > threshold)
 
-        # fill into dataframe
-        obs.loc[valid_time]["fls_frac"] = n_fls / ml_size
-        obs.loc[valid_time]["high_clouds"] = n_high_clouds / ml_size
+class _CancellablePool(ProcessPoolExecutor):
+    """Process pool which can cancel the work not yet started.
 
-        # B) extract FLS fraction from FCST
-        ###################################
+    shutdown(cancel_futures=True) needs Python 3.9.
+    """
 
-        for lt in range(max_lt + 1):
-            ini_time = valid_time - dt.timedelta(hours=lt)
-            ini_time_str = ini_time.strftime("%y%m%d%H")
-            fcst_file = Path(in_dir_model, exp, f"tqc_{ini_time_str}_{lt:03}.grb2")
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._futures = []
 
-            if fcst_file.is_file():
-                logging.info(f"Loading {fcst_file}")
-                ds2 = xr.open_dataset(fcst_file, engine="cfgrib").squeeze()
+    def submit(self, *args, **kwargs):
+        future = super().submit(*args, **kwargs)
+        self._futures.append(future)
+        return future
 
-            else:
-                # logging.debug(f"  but no {fcst_file}")
-                continue
+    def cancel_pending(self):
+        """Cancel all submitted work which has not started yet."""
+        for future in self._futures:
+            future.cancel()
 
-            try:
-                tqc = ds2.TQC.values
-            except AttributeError:
-                # in case fxfilter did not write out variable name
-                logging.warning("Assuming that unknown variable in file is TQC.")
-                tqc = ds2.unknown.values
 
-            # overwrite grid points covered by high clouds with nan
-            tqc[np.isnan(lscl)] = np.nan
+def _init_worker(points, window, log_level, cache_args=None, profile=False):
+    """Receive region grid points and open reduction cache once per process."""
+    logging.basicConfig(level=log_level)
+    init_profiling(profile)
+    _worker_state["points"] = points
+    _worker_state["window"] = window
+    _worker_state["cache"] = None
+    if cache_args is not None:
+        _worker_state["cache"] = ReductionCache(*cache_args)
 
-            # mask swiss plateau
-            tqc_ml = tqc[ml_mask]
 
-            # count grid points with liquid water path > 0.1 g/m2
-            n_fls = np.sum(tqc_ml > 0.0001)
+def _reduce_valid_time_worker(valid_time, inputs, **kwargs):
+    """Call reduce_valid_time with the state of the worker process.
 
-            # fill into dataframe
-            fcst.loc[valid_time][lt] = n_fls / ml_size
+    Returns the result and the profile of the stages of this call.
+    """
+    result = reduce_valid_time(
+        valid_time,
+        _worker_state["points"],
+        _worker_state["window"],
+        cache=_worker_state["cache"],
+        inputs=inputs,
+        **kwargs,
+    )
+    return result, collect()
+
+
+def _reduce_fcst_worker(valid_time, high_clouds_ml, obs_id, inputs, **kwargs):
+    """Call reduce_fcst_exps with the state of the worker process.
+
+    Returns the result and the profile of the stages of this call.
+    """
+    result = reduce_fcst_exps(
+        valid_time,
+        high_clouds_ml,
+        _worker_state["points"],
+        _worker_state["window"],
+        cache=_worker_state["cache"],
+        obs_id=obs_id,
+        inputs=inputs,
+        **kwargs,
+    )
+    return result, collect()
 
-    save_as_pickle(obs, obs_path)
-    save_as_pickle(fcst, fcst_path)
 
+def _combine_exps(frames, exp):
+    """OBS and FCST dataframes; FCST with experiment level if exp is a list."""
+    obs = next(iter(frames.values()))[0]
+    if isinstance(exp, str):
+        return obs, frames[exp][1]
+    fcst = pd.concat({e: f[1] for e, f in frames.items()}, names=["exp"])
     return obs, fcst
 
+
+def calc_fls_fractions(
+    start,
+    end,
+    interval,
+    in_dir_obs,
+    in_dir_model,
+    out_dir_fls,
+    exp,
+    max_lt,
+    extend_previous,
+    threshold,
+    model,
+    cache_dir=None,
+    workers=1,
+    obs_chunk=0,
+    reduction_cache=True,
+    tqc_threshold=0.0001,
+    region_file=None,
+    contingency=False,
+    prefetch=0,
+    prefetch_memory=1024,
+    shard=None,
+    resume=False,
+    checkpoint_every=CHECKPOINT_INTERVAL,
+    checkpoint_minutes=CHECKPOINT_MINUTES,
+):
+    """Calculate FLS fractions in Swiss Plateau (or other regions) for OBS and FCST.
+
+    Args:
+        start (datetime):       start
+        end (datetime):         end
+        interval (int):         interval between simulations in hours
+        in_dir_obs (str):       dir with sat data
+        in_dir_model (str):     dir with model data
+        out_dir_fls (str):      dir with fls fractions
+        exp (str or list):      experiment identifier(s); several experiments
+                                share each read of the sat files
+        max_lt (int):           maximum leadtime
+        extend_previous (bool): load previous obs and fcst dataframes
+        threshold (float):      threshold(s) for low stratus confidence level
+        model (str):            model name
+        cache_dir (str):        dir for cached masks (optional)
+        workers (int):          number of processes for valid times
+        obs_chunk (int):        read sat files as lazy cube in chunks of
+                                obs_chunk time steps (0: file by file)
+        reduction_cache (bool): reuse per-file results cached in cache_dir
+        tqc_threshold (float):  threshold(s) for TQC in kg/m2
+        region_file (str):      GeoJSON file with regions (default: Swiss Plateau)
+        contingency (bool):     accumulate contingency tables per grid point
+                                (first LSCL and TQC threshold)
+        prefetch (int):         read up to prefetch files ahead in background
+                                threads (0: off; only with workers=1)
+        prefetch_memory (int):  maximum memory of files read ahead in MB
+        shard (tuple):          (i, N): only calculate the i-th of N blocks of
+                                valid times, into the partial stores of the
+                                shard in out_dir_fls (see shard.py)
+        resume (bool):          continue from the checkpoint of an interrupted
+                                run with the same parameters
+        checkpoint_every (int): checkpoint after this many valid times (0: off)
+        checkpoint_minutes (float): checkpoint after this many minutes (0: off)
+
+    Returns:
+        obs (dataframe)
+        fcst (dataframe)
+
+    """
+    # determine init and valid timestamps
+    ini_times = pd.date_range(start=start, end=end, freq=f"{interval}H")
+    valid_times = pd.date_range(
+        start=start, end=end + dt.timedelta(hours=max_lt), freq="1H"
+    )
+    if shard is not None:
+        valid_times = shard_valid_times(valid_times, *shard)
+        out_dir_fls = shard_dir(out_dir_fls, *shard)
+        logging.info(f"Shard {shard[0]} of {shard[1]} shards.")
+    first_date = valid_times[0].strftime("%b %d, %Y, %H UTC")
+    last_date = valid_times[-1].strftime("%b %d, %Y, %H UTC")
+    logging.info("Calculating FLS fractions ")
+    logging.info(f"   for {first_date} to {last_date}.")
+
+    # thresholds as tuples of floats (part of the cache keys)
+    lscl_thresholds = tuple(float(thr) for thr in np.atleast_1d(threshold))
+    tqc_thresholds = tuple(float(thr) for thr in np.atleast_1d(tqc_threshold))
+    logging.info(f"LSCL thresholds: {lscl_thresholds}")
+    logging.info(f"TQC thresholds: {tqc_thresholds}")
+
+    regions = DEFAULT_REGIONS if region_file is None else read_regions(region_file)
+    logging.info(f"Regions: {list(regions)}")
+
+    exps = [exp] if isinstance(exp, str) else list(exp)
+    logging.info(f"Experiments: {exps}")
+
+    # written once the partial stores of the shard are complete
+    manifest = None
+    if shard is not None:
+        manifest = dict(
+            shard=shard[0],
+            n_shards=shard[1],
+            start=pd.Timestamp(start).isoformat(),
+            end=pd.Timestamp(end).isoformat(),
+            first_valid_time=valid_times[0].isoformat(),
+            last_valid_time=valid_times[-1].isoformat(),
+            n_valid_times=len(valid_times),
+            max_lt=max_lt,
+            exps=exps,
+            lscl_thresholds=list(lscl_thresholds),
+            tqc_thresholds=list(tqc_thresholds),
+            regions=list(regions),
+            contingency=contingency,
+        )
+        remove_manifest(out_dir_fls)
+
+    # OBS and FCST fractions for this period (one accumulator per experiment)
+    accs = {
+        exp_name: FractionAccumulator(
+            valid_times, max_lt, lscl_thresholds, tqc_thresholds, list(regions)
+        )
+        for exp_name in exps
+    }
+
+    # without extend_previous, existing fractions are replaced once the new
+    # ones are complete
+    obs_store = obs_store_path(out_dir_fls)
+    fcst_stores = {e: fcst_store_path(out_dir_fls, e) for e in exps}
+    if extend_previous:
+        logging.warning("Extending existing fractions in:")
+    else:
+        logging.warning("Creating new fractions in:")
+    logging.warning(f"  {obs_store}")
+    for fcst_store in fcst_stores.values():
+        logging.warning(f"  {fcst_store}")
+
+    tables_paths = {e: contingency_path(out_dir_fls, e) for e in exps}
+
+    # one scan of the input dirs instead of probing every file
+    inventory = Inventory.scan(in_dir_obs, in_dir_model, exps, model)
+    obs_times = [vt for vt in valid_times if inventory.obs_file(vt) is not None]
+    if len(obs_times) < len(valid_times):
+        logging.warning(
+            f"No sat file for {len(valid_times) - len(obs_times)} of "
+            f"{len(valid_times)} valid times."
+        )
+        for valid_time in valid_times.difference(obs_times):
+            logging.debug(f"  No sat file for {valid_time}.")
+
+    # region labels and their bounding box from first available sat file
+    labels, window = find_region_labels(
+        obs_times, in_dir_obs, model, regions, cache_dir
+    )
+    if labels is None:
+        logging.warning("No sat files found. Nothing to calculate.")
+        if manifest is not None:
+            if not extend_previous:
+                # no fractions of this shard to merge
+                clear_store(obs_store)
+                for fcst_store in fcst_stores.values():
+                    clear_store(fcst_store)
+            write_manifest(out_dir_fls, manifest)
+        else:
+            logging.warning("Existing fractions are kept.")
+        frames = {exp_name: acc.to_dataframes() for exp_name, acc in accs.items()}
+        return _combine_exps(frames, exp)
+    points = region_points(labels, len(regions))
+    for name, size in zip(regions, points[2]):
+        logging.debug(f"{size} grid points in {name}.")
+        if size == 0:
+            logging.warning(f"No grid points in region {name}.")
+
+    # fractions reduced so far, saved periodically
+    checkpoint = Checkpoint(
+        checkpoint_path(out_dir_fls),
+        dict(
+            valid_times=[valid_times[0], valid_times[-1], len(valid_times)],
+            max_lt=max_lt,
+            exps=exps,
+            lscl_thresholds=lscl_thresholds,
+            tqc_thresholds=tqc_thresholds,
+            regions=list(regions),
+            mask=mask_hash(labels, window),
+            contingency=contingency,
+        ),
+        every=checkpoint_every,
+        minutes=checkpoint_minutes,
+    )
+    done = checkpoint.load(accs) if resume else set()
+    obs_times = [vt for vt in obs_times if vt not in done]
+
+    obs_kwargs = dict(in_dir_obs=in_dir_obs, thresholds=lscl_thresholds, model=model)
+    fcst_kwargs = dict(
+        in_dir_model=in_dir_model,
+        exps=exps,
+        max_lt=max_lt,
+        tqc_thresholds=tqc_thresholds,
+        events=contingency,
+    )
+
+    # contingency tables per grid point, extended if compatible (or resumed:
+    # they are checkpointed with the fractions)
+    tables = {}
+    if contingency:
+        for exp_name in exps:
+            tables[exp_name] = ContingencyAccumulator(
+                points[0], window, max_lt, lscl_thresholds[0], tqc_thresholds[0]
+            )
+            if done:
+                tables_path = checkpoint.tables_path(exp_name)
+            else:
+                tables_path = tables_paths[exp_name]
+            if (extend_previous or done) and tables_path.is_file():
+                previous = ContingencyAccumulator.load(tables_path)
+                if previous.compatible(tables[exp_name]):
+                    tables[exp_name] = previous
+                    logging.info(
+                        f"Extending contingency tables of "
+                        f"{len(previous.valid_times)} valid times in {tables_path}"
+                    )
+                else:
+                    logging.warning(f"Replacing incompatible {tables_path}")
+
+    # cache of per-file results, shared by all processes
+    cache = None
+    cache_args = None
+    if cache_dir is not None and reduction_cache:
+        cache_args = (
+            cache_path(cache_dir, shard),
+            mask_hash(labels, window),
+            multiprocessing.Array("q", 2),
+        )
+        cache = ReductionCache(*cache_args)
+
+    executor = None
+    if workers > 1:
+        logging.info(f"Distributing valid times over {workers} processes.")
+        executor = _CancellablePool(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(
+                points,
+                window,
+                logging.getLogger().level,
+                cache_args,
+                is_profiling(),
+            ),
+        )
+
+    # read files of the next valid times while reducing the current one
+    prefetcher = None
+    if prefetch and executor is None:
+        jobs = prefetch_jobs(
+            obs_times,
+            window,
+            cache=cache,
+            obs=not obs_chunk,
+            inventory=inventory,
+            **obs_kwargs,
+            **fcst_kwargs,
+        )
+        logging.info(
+            f"Prefetching up to {prefetch} of {len(jobs)} files "
+            f"({prefetch_memory} MB)."
+        )
+        prefetcher = Prefetcher(jobs, prefetch, prefetch_memory * 2**20)
+    elif prefetch:
+        logging.info("No prefetching with several processes.")
+    fcst_kwargs["prefetch"] = prefetcher
+
+    if obs_chunk:
+        logging.info(f"Reading SAT files as cube in chunks of {obs_chunk}.")
+        results = _iter_sat_cube(
+            obs_times,
+            points,
+            window,
+            executor,
+            obs_chunk,
+            cache=cache,
+            inventory=inventory,
+            **obs_kwargs,
+            **fcst_kwargs,
+        )
+    else:
+        results = _iter_valid_times(
+            obs_times,
+            points,
+            window,
+            executor,
+            max(1, len(obs_times) // (4 * workers)),
+            cache=cache,
+            inventory=inventory,
+            **obs_kwargs,
+            **fcst_kwargs,
+        )
+
+    # the tables in out_dir_fls are only replaced together with the stores
+    def save_checkpoint():
+        for exp_name, exp_tables in tables.items():
+            exp_tables.save(checkpoint.tables_path(exp_name))
+        checkpoint.save(accs, done)
+
+    # valid times without result (e.g. corrupt sat file) are not checkpointed:
+    # --resume retries them
+    skipped = []
+    try:
+        for valid_time, result in results:
+            if result is None:
+                skipped.append(valid_time)
+            else:
+                obs_fracs, fcst_fracs = result[:2]
+                for exp_name, acc in accs.items():
+                    acc.add(valid_time, obs_fracs, fcst_fracs[exp_name])
+                if tables:
+                    valid, obs_event, fcst_events = result[2]
+                    for exp_name, exp_tables in tables.items():
+                        exp_tables.update(
+                            valid_time, valid, obs_event, fcst_events[exp_name]
+                        )
+                done.add(valid_time)
+            if checkpoint.due():
+                save_checkpoint()
+    except BaseException:
+        if executor is not None:
+            # do not start the valid times still queued
+            executor.cancel_pending()
+        # e.g. interrupted: keep the valid times reduced so far for --resume
+        if done:
+            save_checkpoint()
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if prefetcher is not None:
+            prefetcher.close()
+
+    if skipped:
+        logging.warning(
+            f"Skipped {len(skipped)} valid times with unreadable sat file: "
+            + ", ".join(str(vt) for vt in skipped)
+        )
+
+    if cache is not None:
+        logging.warning(
+            f"Reduction cache: {cache.hits} hits, {cache.misses} misses "
+            f"({cache.path})."
+        )
+        cache.close()
+
+    frames = {exp_name: acc.to_dataframes() for exp_name, acc in accs.items()}
+    save = write_store if extend_previous else replace_store
+    save(frames[exps[0]][0], obs_store)
+    for exp_name, (_, fcst) in frames.items():
+        save(fcst, fcst_stores[exp_name])
+    for exp_name, exp_tables in tables.items():
+        exp_tables.save(tables_paths[exp_name])
+        logging.warning(f"Saved contingency tables to {tables_paths[exp_name]}")
+    checkpoint.remove()
+    if manifest is not None:
+        write_manifest(out_dir_fls, manifest)
+
+    return _combine_exps(frames, exp)
+
     # plot mask
     # plt.pcolormesh(ml_mask)
     # plt.savefig("/scratch/swester/tmp/ml_mask.png")
 
 
-def load_obs_fcst(wd, exp):
-    """Load obs and fcst from existing pickled dataframes.
+def load_obs_fcst(
+    wd,
+    exp,
+    start=None,
+    end=None,
+    lead_times=None,
+    lscl_threshold=0.7,
+    tqc_threshold=0.0001,
+    region="plateau",
+):
+    """Load obs and fcst from the store of FLS fractions.
 
     Args:
         wd (PATH): obs
         exp (str): experiment identifier
+        start (datetime): first valid time (optional)
+        end (datetime): last valid time (optional)
+        lead_times (list): leadtimes to load (optional)
+        lscl_threshold (float): select OBS of this LSCL threshold
+        tqc_threshold (float): select FCST of this TQC threshold
+        region (str): select this region
 
     Returns:
         2 dataframes: obs, fcst
 
     """
-    obs = pickle.load(open(Path(wd, "fls", "obs.p"), "rb"))
-    fcst = pickle.load(open(Path(wd, "fls", f"fcst_{exp}.p"), "rb"))
+    fls_dir = Path(wd, "fls")
+    obs = read_store(obs_store_path(fls_dir), start, end)
+    fcst = read_store(fcst_store_path(fls_dir, exp), start, end, lead_times)
+
+    obs = select_level(obs, "region", region)
+    fcst = select_level(fcst, "region", region)
+    obs = select_level(obs, "lscl_threshold", lscl_threshold)
+    fcst = select_level(fcst, "tqc_threshold", tqc_threshold)
+
+    # same valid times in both dataframes
+    fcst = fcst.reindex(obs.index)
+
     return obs, fcst
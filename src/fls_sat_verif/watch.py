@@ -0,0 +1,297 @@
+"""Reduce input files as they arrive (--watch).
+
+The sat directory and the tqc directories of the experiments are listed at
+a fixed interval. Each new sat or tqc file is reduced as soon as it is
+complete, and the fractions of the valid times it affects are written to
+the fraction store right away. Files are recognised by name: only entries
+not seen before are inspected, so the cost of a poll does not grow with the
+archive, and a file replaced under the same name is not reduced again.
+Earlier valid times are neither rescanned nor rewritten, except for the
+month partition of the store they share with the new rows.
+"""
+# Standard library
+import logging
+import os
+import time
+from pathlib import Path
+
+# Third-party
+import pandas as pd
+
+# Local
+from .accumulator import FractionAccumulator
+from .cache import cache_path
+from .cache import ReductionCache
+from .inventory import Inventory
+from .inventory import list_dir
+from .inventory import sat_valid_time
+from .inventory import tqc_key
+from .store import fcst_store_path
+from .store import obs_store_path
+from .store import write_store
+from .utils import DEFAULT_REGIONS
+from .utils import find_region_labels
+from .utils import mask_hash
+from .utils import reduce_valid_time
+from .utils import region_points
+
+# seconds between two listings of the input dirs
+POLL_INTERVAL = 10
+
+# files modified less than SETTLE_TIME seconds ago may still be written
+SETTLE_TIME = 1.0
+
+
+def _mtime(path):
+    """Modification time of a file, None if it vanished."""
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+class Watcher:
+    """Reduce new input files and append their fractions to the store.
+
+    Args:
+        in_dir_obs (str):       dir with sat data
+        in_dir_model (str):     dir with model data
+        out_dir_fls (str):      dir with fls fractions
+        exps (list):            experiment identifiers
+        max_lt (int):           maximum leadtime
+        thresholds (list):      thresholds for low stratus confidence level
+        model (str):            model name
+        tqc_thresholds (list):  thresholds for TQC in kg/m2
+        regions (dict):         name -> polygons -> rings of (lat, lon)
+        cache_dir (str):        dir for cached masks (optional)
+        reduction_cache (bool): reuse per-file results cached in cache_dir
+        start (datetime):       files of earlier valid times are ignored; if
+                                None, files present at the first poll are
+                                ignored (only new files are reduced)
+        settle (float):         seconds without modification before a file
+                                is reduced
+
+    """
+
+    def __init__(
+        self,
+        in_dir_obs,
+        in_dir_model,
+        out_dir_fls,
+        exps,
+        max_lt,
+        thresholds,
+        model,
+        tqc_thresholds=(0.0001,),
+        regions=DEFAULT_REGIONS,
+        cache_dir=None,
+        reduction_cache=True,
+        start=None,
+        settle=SETTLE_TIME,
+    ):
+        self.in_dir_obs = in_dir_obs
+        self.in_dir_model = in_dir_model
+        self.exps = list(exps)
+        self.max_lt = max_lt
+        self.thresholds = tuple(float(thr) for thr in thresholds)
+        self.model = model
+        self.tqc_thresholds = tuple(float(thr) for thr in tqc_thresholds)
+        self.regions = regions
+        self.cache_dir = cache_dir
+        self.reduction_cache = reduction_cache
+        self.start = None if start is None else pd.Timestamp(start)
+        self.settle = settle
+        self.obs_store = obs_store_path(out_dir_fls)
+        self.fcst_stores = {e: fcst_store_path(out_dir_fls, e) for e in self.exps}
+
+        # names of the entries already added to the inventory (or ignored)
+        self.seen = {Path(in_dir_obs): set()}
+        self.seen.update({Path(in_dir_model, exp): set() for exp in self.exps})
+        self.inventory = Inventory.empty(self.exps)
+        self.polls = 0
+        self.points = None
+        self.window = None
+        self.cache = None
+
+    def _new_entries(self):
+        """Yield (dir, name, exp) of the entries not seen before (exp None: sat)."""
+        dirs = [(Path(self.in_dir_obs), None)]
+        dirs += [(Path(self.in_dir_model, exp), exp) for exp in self.exps]
+        for in_dir, exp in dirs:
+            seen = self.seen[in_dir]
+            for name in list_dir(in_dir):
+                if name not in seen:
+                    yield in_dir, name, exp
+
+    def _add(self, path, exp):
+        """Add a file to the inventory.
+
+        Returns:
+            list: valid times affected by the file (None if not an input file)
+
+        """
+        if exp is None:
+            valid_time = sat_valid_time(path.name, self.model)
+            if valid_time is None:
+                return None
+            self.inventory.add_obs_file(valid_time, path)
+            return [valid_time]
+
+        key = tqc_key(path.name)
+        if key is None:
+            return None
+        self.inventory.add_fcst_file(exp, key, path)
+        ini_time, lt = key
+        lts = range(self.max_lt + 1) if lt is None else [lt]
+        return [ini_time + pd.Timedelta(hours=lt) for lt in lts]
+
+    def _new_files(self):
+        """Add the complete files not seen before to the inventory.
+
+        Returns:
+            valid_times (set):  valid times affected by the new files
+            arrival (float):    earliest modification time of the new files
+
+        """
+        now = time.time()
+        valid_times = set()
+        arrival = None
+        for in_dir, name, exp in self._new_entries():
+            path = Path(in_dir, name)
+            mtime = _mtime(path)
+            if mtime is None or now - mtime < self.settle:
+                # vanished or still being written: next poll
+                continue
+            self.seen[in_dir].add(name)
+            times = self._add(path, exp)
+
+            if times is None or (self.start is None and self.polls == 0):
+                continue
+            times = [vt for vt in times if self.start is None or vt >= self.start]
+            if times:
+                valid_times.update(times)
+                arrival = mtime if arrival is None else min(arrival, mtime)
+        return valid_times, arrival
+
+    def _init_regions(self, valid_times):
+        """Region grid points and reduction cache from the first sat file."""
+        labels, self.window = find_region_labels(
+            valid_times, self.in_dir_obs, self.model, self.regions, self.cache_dir
+        )
+        if labels is None:
+            return
+        self.points = region_points(labels, len(self.regions))
+        if self.cache_dir is not None and self.reduction_cache:
+            self.cache = ReductionCache(
+                cache_path(self.cache_dir),
+                mask_hash(labels, self.window),
+            )
+
+    def poll(self):
+        """Reduce the files which arrived since the last poll.
+
+        Returns:
+            list: valid times updated in the store
+
+        """
+        inventory = self.inventory
+        valid_times, arrival = self._new_files()
+        self.polls += 1
+
+        # without sat file, a valid time is reduced once the sat file arrives
+        valid_times = sorted(
+            vt for vt in valid_times if inventory.obs_file(vt) is not None
+        )
+        if not valid_times:
+            return []
+        if self.points is None:
+            self._init_regions(valid_times)
+            if self.points is None:
+                return []
+
+        # only the rows of updated valid times are written
+        accs = {
+            exp: FractionAccumulator(
+                pd.date_range(valid_times[0], valid_times[-1], freq="1H"),
+                self.max_lt,
+                self.thresholds,
+                self.tqc_thresholds,
+                list(self.regions),
+            )
+            for exp in self.exps
+        }
+
+        updated = []
+        for valid_time in valid_times:
+            result = reduce_valid_time(
+                valid_time,
+                self.points,
+                self.window,
+                self.in_dir_obs,
+                self.in_dir_model,
+                self.exps,
+                self.max_lt,
+                self.thresholds,
+                self.model,
+                tqc_thresholds=self.tqc_thresholds,
+                cache=self.cache,
+                inputs={
+                    exp: inventory.fcst_inputs(valid_time, exp, self.max_lt)
+                    for exp in self.exps
+                },
+            )
+            if result is None:
+                continue
+            obs_fracs, fcst_fracs = result
+            for exp, exp_acc in accs.items():
+                exp_acc.add(valid_time, obs_fracs, fcst_fracs[exp])
+            updated.append(valid_time)
+
+        if not updated:
+            return []
+
+        frames = {exp: exp_acc.to_dataframes() for exp, exp_acc in accs.items()}
+        obs = frames[self.exps[0]][0]
+        write_store(_rows(obs, updated), self.obs_store)
+        for exp, (_, fcst) in frames.items():
+            write_store(_rows(fcst, updated), self.fcst_stores[exp])
+
+        logging.warning(
+            f"Updated {len(updated)} valid times ({updated[0]} to {updated[-1]}) "
+            f"{time.time() - arrival:.1f}s after arrival of the input files."
+        )
+        return updated
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _rows(df, valid_times):
+    """Rows of the given valid times (first index level)."""
+    return df[df.index.get_level_values(0).isin(valid_times)]
+
+
+def watch(watcher, interval=POLL_INTERVAL, max_polls=None):
+    """Poll until interrupted (or max_polls polls).
+
+    Args:
+        watcher (Watcher):  reduces new files
+        interval (float):   seconds between two polls
+        max_polls (int):    stop after max_polls polls (optional)
+
+    """
+    logging.warning(
+        f"Watching {watcher.in_dir_obs} and {watcher.in_dir_model} "
+        f"every {interval}s (stop with Ctrl-C)."
+    )
+    try:
+        while max_polls is None or watcher.polls < max_polls:
+            started = time.monotonic()
+            watcher.poll()
+            if max_polls is None or watcher.polls < max_polls:
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        logging.warning("Stopped watching.")
+    finally:
+        watcher.close()
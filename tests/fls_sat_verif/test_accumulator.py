@@ -0,0 +1,40 @@
+"""Test module ``fls_sat_verif/accumulator.py``."""
+# Third-party
+import numpy as np
+import pandas as pd
+
+# First-party
+from fls_sat_verif.accumulator import FractionAccumulator
+
+
+def test_fraction_accumulator():
+    valid_times = pd.date_range("2021-11-01 00:00", periods=4, freq="1H")
+    acc = FractionAccumulator(valid_times, max_lt=3)
+    acc.add(valid_times[2], (0.5, 0.1), {0: 0.4, 3: 0.2})
+
+    obs, fcst = acc.to_dataframes()
+    assert (obs.dtypes == np.float32).all() and (fcst.dtypes == np.float32).all()
+    assert list(fcst.columns) == [0, 1, 2, 3]
+    assert obs.loc[(valid_times[2], "plateau", 0.7), "fls_frac"] == np.float32(0.5)
+    assert fcst.loc[(valid_times[2], "plateau", 0.0001), 3] == np.float32(0.2)
+    assert fcst.notna().sum().sum() == 2
+    assert obs.notna().sum().sum() == 2
+
+
+def test_fraction_accumulator_regions_thresholds():
+    valid_times = pd.date_range("2021-11-01 00:00", periods=2, freq="1H")
+    acc = FractionAccumulator(
+        valid_times, 1, [0.5, 0.7], [0.0001, 0.001], ["plateau", "po"]
+    )
+    fls = np.array([[0.6, 0.4], [0.3, 0.2]])
+    fcst_fracs = {1: np.array([[0.3, 0.2], [0.1, 0.0]])}
+    acc.add(valid_times[1], (fls, np.array([0.1, 0.5])), fcst_fracs)
+
+    obs, fcst = acc.to_dataframes()
+    assert list(obs.index.names) == ["valid_time", "region", "lscl_threshold"]
+    assert obs.loc[(valid_times[1], "plateau", 0.5), "fls_frac"] == np.float32(0.6)
+    assert obs.loc[(valid_times[1], "po", 0.7), "fls_frac"] == np.float32(0.2)
+    assert obs.loc[(valid_times[1], "po", 0.5), "high_clouds"] == np.float32(0.5)
+    assert fcst.loc[(valid_times[1], "plateau", 0.001), 1] == np.float32(0.2)
+    assert fcst.loc[(valid_times[1], "po", 0.0001), 1] == np.float32(0.1)
+    assert fcst.notna().sum().sum() == 4
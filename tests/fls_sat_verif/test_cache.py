@@ -0,0 +1,27 @@
+"""Test module ``fls_sat_verif/cache.py``."""
+# Standard library
+import os
+
+# First-party
+from fls_sat_verif.cache import file_key
+from fls_sat_verif.cache import ReductionCache
+
+
+def test_reduction_cache(tmp_path):
+    input_file = tmp_path / "input.nc"
+    input_file.write_text("data")
+
+    cache = ReductionCache(tmp_path / "cache.sqlite", namespace="mask")
+    key = cache.key("obs", file_key(input_file), 0.7)
+    assert cache.get(key) is None
+    cache.put(key, [3, 1, 10])
+    assert cache.get(key) == [3, 1, 10]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # other namespace, parameters or a modified file give other keys
+    assert (
+        ReductionCache(cache.path, "other").key("obs", file_key(input_file), 0.7) != key
+    )
+    assert cache.key("obs", file_key(input_file), 0.8) != key
+    os.utime(input_file, ns=(0, 0))
+    assert cache.key("obs", file_key(input_file), 0.7) != key
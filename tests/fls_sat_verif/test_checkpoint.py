@@ -0,0 +1,40 @@
+"""Test module ``fls_sat_verif/checkpoint.py``."""
+# Third-party
+import numpy as np
+import pandas as pd
+
+# First-party
+from fls_sat_verif.accumulator import FractionAccumulator
+from fls_sat_verif.checkpoint import Checkpoint
+
+
+def test_checkpoint(tmp_path):
+    valid_times = pd.date_range("2021-11-01", periods=4, freq="1H")
+    accs = {exp: FractionAccumulator(valid_times, 1) for exp in ["e1", "e2"]}
+    accs["e1"].add(valid_times[1], (0.5, 0.1), {0: 0.25})
+    accs["e2"].add(valid_times[1], (0.5, 0.1), {1: 0.75})
+    done = set(valid_times[:2])
+
+    checkpoint = Checkpoint(tmp_path / "checkpoint.npz", {"max_lt": 1}, every=2)
+    assert not checkpoint.due()
+    assert checkpoint.due()
+    checkpoint.save(accs, done)
+    assert not checkpoint.due()
+
+    restored = {exp: FractionAccumulator(valid_times, 1) for exp in ["e1", "e2"]}
+    assert checkpoint.load(restored) == done
+    for exp, acc in accs.items():
+        obs, fcst = acc.to_dataframes()
+        pd.testing.assert_frame_equal(restored[exp].to_dataframes()[0], obs)
+        pd.testing.assert_frame_equal(restored[exp].to_dataframes()[1], fcst)
+
+    # run with other parameters starts over
+    other = Checkpoint(tmp_path / "checkpoint.npz", {"max_lt": 2})
+    restored = {"e1": FractionAccumulator(valid_times, 1)}
+    assert other.load(restored) == set()
+    assert np.isnan(restored["e1"].fls).all()
+
+    # contingency tables are removed with the checkpoint
+    checkpoint.tables_path("e1").write_bytes(b"")
+    checkpoint.remove()
+    assert list(tmp_path.iterdir()) == []
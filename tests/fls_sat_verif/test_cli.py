@@ -1,10 +1,21 @@
 """Test module ``fls_sat_verif``."""
+# Standard library
+import os
+import subprocess
+import sys
+
 # Third-party
 from click.testing import CliRunner
 
 # First-party
 from fls_sat_verif import cli
 
+# import of the CLI module in a fresh interpreter, in seconds (measured: 0.04)
+IMPORT_TIME_BUDGET = 0.3
+
+# loaded by the stages which need them, not at start-up
+HEAVY_MODULES = ["numpy", "pandas", "xarray", "matplotlib", "eccodes", "pyarrow"]
+
 
 class TestCLI:
     """Test the command line interface."""
@@ -13,10 +24,10 @@ class TestCLI:
         runner = CliRunner()
         return runner.invoke(cli.main, args)
 
-    def test_default(self):
-        result = self.call()
-        assert result.exit_code == 0
-        assert "test_cli_project.cli.main" in result.output
+    def test_default(self, tmp_path):
+        result = self.call(["--wd", str(tmp_path)])
+        assert result.exit_code == 1
+        assert "--exp" in result.output
 
     def test_help(self):
         result = self.call(["--help"])
@@ -28,7 +39,41 @@ class TestCLI:
         assert result.exit_code == 0
         assert cli.__version__ in result.output
 
-    def test_dry_run(self):
-        result = self.call(["-n"])
+    def test_dry_run(self, tmp_path):
+        result = self.call(
+            ["-n", "--wd", str(tmp_path), "--exp", "exp"]
+            + ["--start", "21110100", "--end", "21110112"]
+        )
         assert result.exit_code == 0
-        assert "Is dry run" in result.output
+        assert "This is a dry run" in result.output
+
+    def test_shard(self, tmp_path):
+        args = ["-n", "--wd", str(tmp_path), "--exp", "exp", "--calc_fractions"]
+        args += ["--start", "21110100", "--end", "21110112", "--max_lt", "12"]
+        assert self.call(args + ["--shard", "3/25"]).exit_code == 0
+        for shard in ["3/x", "3/3", "3/26"]:
+            result = self.call(args + ["--shard", shard])
+            assert result.exit_code == 2
+            assert "Invalid value for '--shard'" in result.output
+
+    def test_import_time(self):
+        code = (
+            "import sys, fls_sat_verif.cli; "
+            f"print(*[m for m in {HEAVY_MODULES} if m in sys.modules])"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        )
+        assert proc.stdout.split() == []
+
+        # -X importtime: "import time: self [us] | cumulative [us] | module"
+        line = next(
+            line
+            for line in proc.stderr.splitlines()
+            if line.endswith("| fls_sat_verif.cli")
+        )
+        assert int(line.split("|")[1]) / 1e6 < IMPORT_TIME_BUDGET
@@ -0,0 +1,60 @@
+"""Test module ``fls_sat_verif/contingency.py``."""
+# Third-party
+import numpy as np
+import pandas as pd
+import pytest
+
+# First-party
+from fls_sat_verif.contingency import ContingencyAccumulator
+from fls_sat_verif.contingency import frequency_bias
+from fls_sat_verif.contingency import hit_rate
+
+
+def test_contingency_accumulator(tmp_path):
+    in_regions = np.array([[True, True, False], [True, True, True]])
+    window = (slice(2, 4), slice(5, 8))
+    tables = ContingencyAccumulator(in_regions, window, 1, 0.7, 0.0001)
+
+    valid = np.array([True, True, True, True, False])
+    obs = np.array([True, True, False, False, True])
+    fcst = np.array([True, False, True, False, True])
+    valid_time = pd.Timestamp("2021-11-01 06:00")
+    tables.update(valid_time, valid, obs, {1: fcst})
+    # same valid time is not counted twice
+    tables.update(valid_time, valid, obs, {1: fcst})
+
+    assert tables.counts[0].sum() == 0
+    assert list(tables.counts[1, :, 4]) == [0, 0, 0, 0]
+    assert list(tables.counts[1].sum(axis=1)) == [1, 1, 1, 1]
+
+    path = tmp_path / "exp=test.npz"
+    tables.save(path)
+    loaded = ContingencyAccumulator.load(path)
+    assert loaded.compatible(tables)
+    assert loaded.valid_times == {valid_time}
+    assert np.array_equal(loaded.counts, tables.counts)
+
+    maps = loaded.maps()
+    assert maps["hits"].shape == (2, 2, 3)
+    assert np.isnan(maps["hits"][1, 0, 2])
+    assert frequency_bias(maps)[1, 0, 0] == 1.0
+    assert hit_rate(maps)[1, 0, 1] == 0.0
+    assert np.isnan(hit_rate(maps)[1, 1, 0])
+
+
+def test_merge():
+    in_regions = np.array([[True, False], [True, True]])
+    window = (slice(0, 2), slice(0, 2))
+    valid = np.ones(3, dtype=bool)
+    event = np.array([True, False, True])
+    shards = []
+    for hour in (0, 1):
+        tables = ContingencyAccumulator(in_regions, window, 0, 0.7, 0.0001)
+        tables.update(pd.Timestamp(2021, 11, 1, hour), valid, event, {0: event})
+        shards.append(tables)
+
+    shards[0].merge(shards[1])
+    assert len(shards[0].valid_times) == 2
+    assert list(shards[0].counts[0].sum(axis=1)) == [4, 0, 0, 2]
+    with pytest.raises(ValueError, match="share 1 valid times"):
+        shards[0].merge(shards[1])
@@ -0,0 +1,55 @@
+"""Test module ``fls_sat_verif/inventory.py``."""
+# Standard library
+import datetime as dt
+
+# Third-party
+import pandas as pd
+
+# First-party
+from fls_sat_verif.inventory import coverage_path
+from fls_sat_verif.inventory import Inventory
+from fls_sat_verif.inventory import write_coverage
+from fls_sat_verif.utils import fcst_inputs
+from fls_sat_verif.utils import sat_file_path
+from fls_sat_verif.utils import tqc_file_path
+from fls_sat_verif.utils import tqc_run_file_path
+
+
+def test_inventory(tmp_path):
+    in_dir_obs = tmp_path / "sat"
+    in_dir_model = tmp_path / "tqc"
+    (in_dir_model / "e1").mkdir(parents=True)
+    in_dir_obs.mkdir()
+
+    ini_time = dt.datetime(2021, 11, 1, 0)
+    valid_times = pd.date_range(ini_time, periods=4, freq="1H")
+    for valid_time in valid_times[[0, 1, 3]]:
+        sat_file_path(in_dir_obs, valid_time, "c1e").touch()
+    # other model
+    sat_file_path(in_dir_obs, valid_times[2], "c2e").touch()
+    for lt in (0, 2):
+        tqc_file_path(in_dir_model, "e1", ini_time, lt).touch()
+    # all leadtimes of the next run in one file
+    tqc_run_file_path(in_dir_model, "e1", valid_times[1]).touch()
+
+    inventory = Inventory.scan(in_dir_obs, in_dir_model, ["e1"], "c1e")
+
+    assert inventory.obs_file(valid_times[2]) is None
+    assert inventory.obs_file(valid_times[3]) == sat_file_path(
+        in_dir_obs, valid_times[3], "c1e"
+    )
+    for valid_time in valid_times:
+        assert inventory.fcst_inputs(valid_time, "e1", 3) == fcst_inputs(
+            valid_time, in_dir_model, "e1", 3
+        )
+
+    coverage = inventory.coverage(valid_times, "e1", 3)
+    assert list(coverage.columns) == ["obs", 0, 1, 2, 3]
+    assert coverage["obs"].tolist() == [True, True, False, True]
+    assert coverage.values[:, 1:].sum() == 2 + 3
+
+    path = coverage_path(tmp_path / "fls", "e1")
+    write_coverage(coverage, path)
+    csv = pd.read_csv(path, index_col=0, parse_dates=True)
+    assert (csv.values == coverage.values.astype(int)).all()
+    assert (csv.index == valid_times).all()
@@ -0,0 +1,67 @@
+"""Test module ``fls_sat_verif/plot.py``."""
+# Third-party
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+# First-party
+from fls_sat_verif import plot
+from fls_sat_verif.plot import hourly_medians
+from fls_sat_verif.plot import render_plots
+
+
+def test_hourly_medians():
+    index = pd.date_range("2021-11-01 00:00", periods=72, freq="1H")
+    rng = np.random.default_rng(0)
+    obs = pd.DataFrame({"fls_frac": rng.random(72)}, index=index)
+    fcst = pd.DataFrame(rng.random((72, 4)), index=index, columns=range(4))
+    fcst.iloc[5, 2] = np.nan
+
+    obs_stats, fcst_median, fcst_count = hourly_medians(obs, fcst, max_lt=2)
+
+    hour_5 = index.hour == 5
+    assert obs_stats.loc[5, "median"] == obs.fls_frac[hour_5].median()
+    assert obs_stats.loc[5, "count"] == 3
+    assert fcst_median.shape == (24, 24)
+    assert fcst_median.loc[5, 2] == fcst[2][hour_5].median()
+    assert fcst_count.loc[5, 2] == 2
+    # leadtimes > max_lt are not aggregated
+    assert fcst_median[3].isna().all() and (fcst_count[3] == 0).all()
+
+
+def test_render_plots(tmp_path):
+    index = pd.date_range("2021-11-01 00:00", periods=48, freq="1H")
+    obs = pd.DataFrame({"fls_frac": np.linspace(0, 1, 48)}, index=index)
+    fcst = pd.DataFrame(np.full((48, 4), 0.5), index=index, columns=range(4))
+    jobs = [
+        (plot_type, (obs, fcst, tmp_path, "e1", 3, [0, 12]), {})
+        for plot_type in ["median_day_cycle", "fraction_per_leadtime"]
+    ]
+    coverage = pd.DataFrame(
+        np.eye(48, 5, dtype=bool), index=index, columns=["obs", *range(4)]
+    )
+    jobs.append(("coverage", (coverage, tmp_path, "e1"), {}))
+    render_plots(jobs)
+
+    assert len(list(tmp_path.glob("*.png"))) == 5
+    # figures are not registered with pyplot
+    assert plt.get_fignums() == []
+
+
+def test_plot_title_region(tmp_path, monkeypatch):
+    index = pd.date_range("2021-11-01 00:00", periods=24, freq="1H")
+    obs = pd.DataFrame({"fls_frac": np.linspace(0, 1, 24)}, index=index)
+    fcst = pd.DataFrame(np.full((24, 2), 0.5), index=index, columns=range(2))
+    titles = []
+
+    def savefig(fig, *args, **kwargs):
+        titles.append(fig.axes[0].get_title())
+
+    monkeypatch.setattr(plot.Figure, "savefig", savefig)
+
+    plot.plt_median_day_cycle(obs, fcst, tmp_path, "e1", 1, [0])
+    plot.plt_fraction_per_leadtime(obs, fcst, tmp_path, "e1", 1, [0], region="po")
+    assert titles == [
+        "Median FLS fraction on Swiss Plateau",
+        "Median FLS fraction in po",
+    ]
@@ -0,0 +1,47 @@
+"""Test module ``fls_sat_verif/prefetch.py``."""
+# Standard library
+import threading
+import time
+
+# Third-party
+import numpy as np
+import pytest
+
+# First-party
+from fls_sat_verif.prefetch import fetch
+from fls_sat_verif.prefetch import Prefetcher
+
+
+def test_prefetcher():
+    lock = threading.Lock()
+    reads = []
+
+    def read(i):
+        with lock:
+            reads.append(i)
+        time.sleep(0.01)
+        if i == 3:
+            raise KeyError(i)
+        return np.full(10, i)
+
+    # valid time (group) i // 2, 10 values of 8 bytes
+    jobs = [(i // 2, i, read, (i,), 80) for i in range(8)]
+    prefetcher = Prefetcher(jobs, depth=3, max_bytes=160)
+    try:
+        assert fetch(prefetcher, 0, read, 0)[0] == 0
+        # file 1 of the same group is skipped, file 2 read ahead
+        assert fetch(prefetcher, 2, read, 2)[0] == 2
+        with pytest.raises(KeyError):
+            fetch(prefetcher, 3, read, 3)
+        # unknown key: read now
+        assert fetch(prefetcher, 99, read, 99)[0] == 99
+        # at most max_bytes read ahead
+        assert prefetcher._bytes <= 160
+        assert fetch(prefetcher, 7, read, 7)[0] == 7
+    finally:
+        prefetcher.close()
+
+    assert prefetcher.hits + prefetcher.misses == 5
+    # no file is read twice
+    assert all(reads.count(i) == 1 for i in set(reads))
+    assert fetch(None, 5, read, 5)[0] == 5
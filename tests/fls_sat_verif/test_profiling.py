@@ -0,0 +1,41 @@
+"""Test module ``fls_sat_verif/profiling.py``."""
+# Standard library
+import json
+
+# First-party
+from fls_sat_verif import profiling
+
+
+def test_stage(tmp_path):
+    input_file = tmp_path / "input.nc"
+    input_file.write_bytes(b"x" * 100)
+
+    # not recorded unless enabled
+    with profiling.stage("open", read=[input_file]):
+        pass
+    assert profiling.collect() == {}
+
+    profiling.start(memory=True)
+    for _ in range(2):
+        with profiling.stage("open", read=[input_file]):
+            pass
+    # window decoded from a file read in part
+    with profiling.stage("open") as io:
+        io["bytes_read"] += 30
+    with profiling.stage("save", written=[tmp_path / "output.parquet"]):
+        (tmp_path / "output.parquet").write_bytes(b"x" * 10)
+    # statistics of a worker process
+    profiling.merge({"reduce": {"wall_time": 1.0, "calls": 3}})
+    report_file = profiling.finish(tmp_path, info={"exp": ["e1"]})
+
+    report = json.loads(report_file.read_text())
+    assert report_file.parent == tmp_path
+    assert report["info"] == {"exp": ["e1"]}
+    assert report["stages"]["open"]["calls"] == 3
+    assert report["stages"]["open"]["bytes_read"] == 230
+    assert report["stages"]["save"]["bytes_written"] == 10
+    assert report["stages"]["reduce"]["calls"] == 3
+    assert list(report["stages"])[0] == "reduce"
+    assert report["tracemalloc"]["peak_bytes"] > 0
+    assert "cprofile" not in report
+    assert not profiling.is_enabled()
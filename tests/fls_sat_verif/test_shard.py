@@ -0,0 +1,80 @@
+"""Test module ``fls_sat_verif/shard.py``."""
+# Third-party
+import numpy as np
+import pandas as pd
+import pytest
+
+# First-party
+from fls_sat_verif.shard import merge_shards
+from fls_sat_verif.shard import shard_dir
+from fls_sat_verif.shard import shard_valid_times
+from fls_sat_verif.shard import write_manifest
+from fls_sat_verif.store import obs_store_path
+from fls_sat_verif.store import read_store
+from fls_sat_verif.store import write_store
+
+
+def test_shard_valid_times():
+    valid_times = pd.date_range("2021-11-01", periods=10, freq="1H")
+    shards = [shard_valid_times(valid_times, i, 3) for i in range(3)]
+    assert [len(times) for times in shards] == [3, 3, 4]
+    assert shards[0].append(shards[1:]).equals(valid_times)
+    with pytest.raises(ValueError):
+        shard_valid_times(valid_times, 3, 3)
+    with pytest.raises(ValueError):
+        shard_valid_times(valid_times, 0, 11)
+
+
+def _write_shard(fls_dir, shard, n_shards, valid_times, **kwargs):
+    out_dir = shard_dir(fls_dir, shard, n_shards)
+    obs = pd.DataFrame(
+        {"fls_frac": np.arange(len(valid_times)), "high_clouds": 0.0},
+        index=pd.Index(valid_times, name="valid_time"),
+    )
+    write_store(obs, obs_store_path(out_dir))
+    manifest = dict(
+        shard=shard,
+        n_shards=n_shards,
+        start="2021-11-01T00:00:00",
+        end="2021-11-01T06:00:00",
+        first_valid_time=valid_times[0].isoformat(),
+        last_valid_time=valid_times[-1].isoformat(),
+        n_valid_times=len(valid_times),
+        max_lt=3,
+        exps=[],
+        lscl_thresholds=[0.7],
+        tqc_thresholds=[0.0001],
+        regions=["plateau"],
+        contingency=False,
+    )
+    write_manifest(out_dir, dict(manifest, **kwargs))
+
+
+def test_merge_shards(tmp_path):
+    valid_times = pd.date_range("2021-11-01", periods=10, freq="1H")
+    _write_shard(tmp_path, 0, 2, valid_times[:5])
+    with pytest.raises(ValueError, match="Missing shards: 1"):
+        merge_shards(tmp_path)
+
+    # overlap with shard 0
+    _write_shard(tmp_path, 1, 2, valid_times[4:])
+    with pytest.raises(ValueError, match="overlaps"):
+        merge_shards(tmp_path)
+
+    # other calculation
+    _write_shard(tmp_path, 1, 2, valid_times[5:], max_lt=6)
+    with pytest.raises(ValueError, match="max_lt"):
+        merge_shards(tmp_path)
+
+    _write_shard(tmp_path, 1, 2, valid_times[5:])
+    merge_shards(tmp_path)
+    obs = read_store(obs_store_path(tmp_path))
+    assert obs.index.equals(pd.Index(valid_times, name="valid_time"))
+    assert obs["fls_frac"].tolist() == [0, 1, 2, 3, 4, 0, 1, 2, 3, 4]
+
+    # unreadable shard: previous fractions kept
+    part = next(obs_store_path(shard_dir(tmp_path, 1, 2)).glob("month=*/*.parquet"))
+    part.write_bytes(b"truncated")
+    with pytest.raises(ValueError):
+        merge_shards(tmp_path)
+    pd.testing.assert_frame_equal(read_store(obs_store_path(tmp_path)), obs)
@@ -0,0 +1,71 @@
+"""Test module ``fls_sat_verif/store.py``."""
+# Third-party
+import numpy as np
+import pandas as pd
+import pytest
+
+# First-party
+from fls_sat_verif.store import read_store
+from fls_sat_verif.store import replace_store
+from fls_sat_verif.store import write_store
+
+
+def test_write_read_store(tmp_path):
+    index = pd.date_range("2021-11-30 22:00", "2021-12-01 02:00", freq="1H")
+    df = pd.DataFrame(np.arange(10).reshape(5, 2) / 10, index=index, columns=[0, 1])
+    write_store(df, tmp_path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "month=2021-11",
+        "month=2021-12",
+    ]
+
+    # append: new values win, NaN keeps existing values
+    update = pd.DataFrame({0: [np.nan, 5.0], 1: [7.0, 8.0]}, index=index[-2:])
+    write_store(update, tmp_path)
+
+    full = read_store(tmp_path)
+    assert list(full.columns) == [0, 1]
+    assert (full.dtypes == np.float32).all()
+    assert full.loc[index[-2], 0] == np.float32(0.6)
+    assert full.loc[index[-1], 0] == 5.0
+
+    part = read_store(tmp_path, start=index[3], columns=[1])
+    assert list(part.columns) == [1]
+    assert list(part[1]) == [7.0, 8.0]
+
+
+def test_store_threshold_level(tmp_path):
+    index = pd.MultiIndex.from_product(
+        [pd.date_range("2021-11-01", periods=3, freq="1H"), [0.5, 0.7]],
+        names=["valid_time", "lscl_threshold"],
+    )
+    df = pd.DataFrame({"fls_frac": np.arange(6) / 10}, index=index)
+    write_store(df, tmp_path)
+
+    full = read_store(tmp_path, start=index[2][0])
+    assert list(full.index.names) == ["valid_time", "lscl_threshold"]
+    assert len(full) == 4
+    assert full.loc[(index[5][0], 0.7), "fls_frac"] == np.float32(0.5)
+
+
+def test_replace_store(tmp_path, monkeypatch):
+    store_dir = tmp_path / "obs"
+    index = pd.DatetimeIndex(["2021-10-31", "2021-11-01"], name="valid_time")
+    old = pd.DataFrame({0: [0.1, 0.2]}, index=index, dtype=np.float32)
+    write_store(old, store_dir)
+    new = pd.DataFrame({0: [0.5]}, index=index[1:], dtype=np.float32)
+
+    # failed write: old store kept, no temporary store left
+    def to_parquet(*args, **kwargs):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(pd.DataFrame, "to_parquet", to_parquet)
+        with pytest.raises(OSError):
+            replace_store(new, store_dir)
+    pd.testing.assert_frame_equal(read_store(store_dir), old)
+    assert [p.name for p in tmp_path.iterdir()] == ["obs"]
+
+    replace_store(new, store_dir)
+    pd.testing.assert_frame_equal(read_store(store_dir), new)
+    assert [p.name for p in tmp_path.iterdir()] == ["obs"]
@@ -1,9 +1,48 @@
 """Test module ``fls_sat_verif/utils.py``."""
 # Standard library
+import datetime as dt
+import errno
+import json
 import logging
+import os
+
+# Third-party
+import eccodes
+import matplotlib.path as mpath
+import numpy as np
+import pandas as pd
+import pytest
 
 # First-party
+from fls_sat_verif import utils
+from fls_sat_verif.cache import ReductionCache
+from fls_sat_verif.contingency import contingency_path
+from fls_sat_verif.contingency import ContingencyAccumulator
+from fls_sat_verif.store import obs_store_path
+from fls_sat_verif.store import read_store
+from fls_sat_verif.synthetic import create_fixtures
+from fls_sat_verif.synthetic import write_sat_files
+from fls_sat_verif.synthetic import write_tqc_file
+from fls_sat_verif.utils import calc_fls_fractions
+from fls_sat_verif.utils import count_exceedances
 from fls_sat_verif.utils import count_to_log_level
+from fls_sat_verif.utils import get_ml_mask
+from fls_sat_verif.utils import get_region_labels
+from fls_sat_verif.utils import mask_window
+from fls_sat_verif.utils import ML_POLYGON
+from fls_sat_verif.utils import points_in_polygon
+from fls_sat_verif.utils import read_latlon
+from fls_sat_verif.utils import read_lscl
+from fls_sat_verif.utils import read_regions
+from fls_sat_verif.utils import read_tqc
+from fls_sat_verif.utils import reduce_fcst
+from fls_sat_verif.utils import reduce_fcst_exps
+from fls_sat_verif.utils import region_points
+from fls_sat_verif.utils import retrieve_cosmo_files
+from fls_sat_verif.utils import sat_file_path
+from fls_sat_verif.utils import scan_model_archive
+
+BENCH_START = dt.datetime(2021, 11, 1, 0)
 
 
 def test_count_to_log_level():
@@ -11,3 +50,502 @@ def test_count_to_log_level():
     assert count_to_log_level(1) == logging.WARNING
     assert count_to_log_level(2) == logging.INFO
     assert count_to_log_level(3) == logging.DEBUG
+
+
+def test_count_exceedances():
+    values = np.array([[0.1, np.nan, 0.5, 0.9, 0.7], [np.nan, np.nan, 0.0, 1.0, 0.3]])
+    thresholds = [0.7, 0.2, 0.95]
+    counts, n_nan = count_exceedances(values, thresholds)
+
+    expected = np.stack([np.sum(values > thr, axis=-1) for thr in thresholds], -1)
+    assert np.array_equal(counts, expected)
+    assert list(n_nan) == [1, 2]
+
+
+def test_count_exceedances_groups():
+    rng = np.random.default_rng(0)
+    values = rng.random((3, 50))
+    values[values < 0.1] = np.nan
+    groups = rng.integers(0, 4, 50)
+    counts, n_nan = count_exceedances(values, [0.5, 0.2], groups, 4)
+
+    assert counts.shape == (3, 4, 2) and n_nan.shape == (3, 4)
+    for g in range(4):
+        in_group = values[:, groups == g]
+        assert np.array_equal(counts[:, g, 0], np.sum(in_group > 0.5, axis=-1))
+        assert np.array_equal(counts[:, g, 1], np.sum(in_group > 0.2, axis=-1))
+        assert np.array_equal(n_nan[:, g], np.sum(np.isnan(in_group), axis=-1))
+
+
+def _grid():
+    lats, lons = np.meshgrid(
+        np.linspace(45.5, 48.5, 150), np.linspace(5.0, 11.0, 200), indexing="ij"
+    )
+    return lats, lons
+
+
+def test_points_in_polygon_matches_matplotlib():
+    lats, lons = _grid()
+    path = mpath.Path(ML_POLYGON + ML_POLYGON[:1], closed=True)
+    expected = path.contains_points(np.column_stack([lats.ravel(), lons.ravel()]))
+    mask = points_in_polygon(lats, lons, ML_POLYGON)
+    assert mask.shape == lats.shape
+    assert np.array_equal(mask.ravel(), expected)
+
+
+def test_get_ml_mask_cache(tmp_path):
+    lats, lons = _grid()
+    mask = get_ml_mask(lats, lons, cache_dir=tmp_path)
+    assert np.array_equal(mask, points_in_polygon(lats, lons, ML_POLYGON))
+    cached = list(tmp_path.glob("region_labels_*.npy"))
+    assert len(cached) == 1
+    assert np.array_equal(np.load(cached[0]) > 0, mask)
+    assert np.array_equal(get_ml_mask(lats, lons, cache_dir=tmp_path), mask)
+
+
+def test_region_labels(tmp_path):
+    lats, lons = _grid()
+    square = [[6.0, 46.0], [7.0, 46.0], [7.0, 47.0], [6.0, 47.0], [6.0, 46.0]]
+    hole = [[6.4, 46.4], [6.6, 46.4], [6.6, 46.6], [6.4, 46.6], [6.4, 46.4]]
+    region_file = tmp_path / "regions.geojson"
+    region_file.write_text(
+        json.dumps(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    _feature("square", "Polygon", [square, hole]),
+                    _feature("plateau", "MultiPolygon", [[_lonlat(ML_POLYGON)]]),
+                ],
+            }
+        )
+    )
+    regions = read_regions(region_file)
+    assert list(regions) == ["square", "plateau"]
+
+    labels = get_region_labels(lats, lons, regions, tmp_path)
+    assert labels.dtype == np.int16
+    assert np.array_equal(
+        labels == 1,
+        points_in_polygon(lats, lons, [(lat, lon) for lon, lat in square])
+        & ~points_in_polygon(lats, lons, [(lat, lon) for lon, lat in hole]),
+    )
+    # overlap with square belongs to square
+    plateau = points_in_polygon(lats, lons, ML_POLYGON)
+    assert np.array_equal(labels == 2, plateau & (labels != 1))
+    assert len(list(tmp_path.glob("region_labels_*.npy"))) == 1
+    assert np.array_equal(get_region_labels(lats, lons, regions, tmp_path), labels)
+
+
+def test_mask_window():
+    mask = np.zeros((6, 8), dtype=bool)
+    mask[2, 3] = mask[4, 5] = True
+    window = mask_window(mask)
+    assert window == (slice(2, 5), slice(3, 6))
+    assert mask[window].sum() == mask.sum()
+
+    # empty mask: empty window
+    empty = np.zeros((6, 8), dtype=bool)
+    assert mask_window(empty) == (slice(0, 0), slice(0, 0))
+    assert empty[mask_window(empty)].size == 0
+
+
+def test_read_window(tmp_path):
+    valid_time = dt.datetime(2021, 11, 1, 0)
+    write_sat_files(tmp_path, [valid_time], "c1e", shape=(20, 30))
+    obs_file = sat_file_path(tmp_path, valid_time, "c1e")
+    window = (slice(5, 12), slice(3, 25))
+
+    lscl = read_lscl(obs_file, window)
+    assert lscl.dtype == np.float32
+    np.testing.assert_array_equal(lscl, read_lscl(obs_file)[window])
+
+    lats, lons = read_latlon(obs_file, window)
+    full_lats, full_lons = read_latlon(obs_file)
+    np.testing.assert_array_equal(lats, full_lats[window])
+    np.testing.assert_array_equal(lons, full_lons[window])
+
+
+def _lonlat(polygon):
+    return [[lon, lat] for lat, lon in polygon]
+
+
+def _feature(name, geometry_type, coordinates):
+    return {
+        "type": "Feature",
+        "properties": {"name": name},
+        "geometry": {"type": geometry_type, "coordinates": coordinates},
+    }
+
+
+def test_scan_model_archive(tmp_path):
+    for run, lts in [("21110100_001", [0, 1]), ("21110112_001", [0])]:
+        grib_dir = tmp_path / "FCST21" / run / "grib"
+        grib_dir.mkdir(parents=True)
+        for lt in lts:
+            (grib_dir / f"c1effsurf{lt:03}_000").touch()
+        (grib_dir / "c1effsurf000_000p").touch()
+    dates = pd.date_range("2021-11-01 00:00", "2021-11-01 12:00", freq="12H")
+    cache_file = tmp_path / "index.json"
+
+    index = scan_model_archive(tmp_path, "c1e", dates, cache_file)
+    assert sorted(index) == [("21110100", 0), ("21110100", 1), ("21110112", 0)]
+    assert index[("21110100", 1)] == [
+        tmp_path / "FCST21" / "21110100_001" / "grib" / "c1effsurf001_000"
+    ]
+    assert cache_file.is_file()
+    assert scan_model_archive(tmp_path, "c1e", dates, cache_file) == index
+
+
+# fieldextra stand-in: writes a partial output, fails on the first call per
+# output file (and always for inputs containing "broken"), then copies input
+FAKE_FXFILTER = """#!/bin/sh
+out="$2"
+shift 4
+echo "$out" >> "$FXFILTER_CALLS"
+printf partial > "$out"
+if grep -q broken "$@"; then echo "cannot decode" >&2; exit 1; fi
+if [ "$(grep -cx "$out" "$FXFILTER_CALLS")" -eq 1 ]; then exit 2; fi
+cat "$@" > "$out"
+"""
+
+
+def test_retrieve_cosmo_files_retries(tmp_path, monkeypatch, caplog):
+    grib_dir = tmp_path / "archive" / "FCST21" / "21110100_001" / "grib"
+    grib_dir.mkdir(parents=True)
+    (grib_dir / "c1effsurf000_000").write_text("grib")
+    (grib_dir / "c1effsurf001_000").write_text("broken")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "fxfilter").write_text(FAKE_FXFILTER)
+    (bin_dir / "fxfilter").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FXFILTER_CALLS", str(tmp_path / "calls.txt"))
+
+    start = dt.datetime(2021, 11, 1, 0)
+    retrieve_cosmo_files(
+        start, start, 3, 1, tmp_path / "tqc", tmp_path / "archive", "e1", "c1e"
+    )
+
+    out_dir = tmp_path / "tqc" / "e1"
+    calls = (tmp_path / "calls.txt").read_text().splitlines()
+    # +0h succeeds on the retry, +1h fails on all 3 attempts
+    assert calls.count(str(out_dir / "tqc_21110100_000.grb2.part")) == 2
+    assert calls.count(str(out_dir / "tqc_21110100_001.grb2.part")) == 3
+    assert (out_dir / "tqc_21110100_000.grb2").read_text() == "grib"
+    assert not (out_dir / "tqc_21110100_001.grb2").exists()
+    assert list(out_dir.glob("*.part")) == []
+    assert "fxfilter failed for 1 jobs" in caplog.text
+    assert "  21110100 +1h" in caplog.text
+
+
+def test_read_tqc(tmp_path):
+    rng = np.random.default_rng(0)
+    fields = {lt: rng.random((6, 8)) * 1e-3 for lt in range(3)}
+    run_file = tmp_path / "tqc_21110100.grb2"
+    write_tqc_file(run_file, fields, BENCH_START)
+
+    window = (slice(1, 4), slice(2, 7))
+    tqc = read_tqc(run_file, window, lt=2)
+    assert tqc.dtype == np.float32
+    assert np.allclose(tqc, fields[2][window], atol=1e-6)
+    with pytest.raises(KeyError):
+        read_tqc(run_file, lt=3)
+    assert list(tmp_path.glob("*.idx")) == []
+
+
+def test_read_tqc_run_file_index(tmp_path, monkeypatch):
+    fields = {lt: np.full((6, 8), lt * 1e-4) for lt in range(6)}
+    run_file = tmp_path / "tqc_21110100.grb2"
+    write_tqc_file(run_file, fields, BENCH_START)
+
+    calls = []
+    new_from_file = eccodes.codes_grib_new_from_file
+
+    def counting(*args, **kwargs):
+        calls.append(kwargs.get("headers_only", False))
+        return new_from_file(*args, **kwargs)
+
+    monkeypatch.setattr(eccodes, "codes_grib_new_from_file", counting)
+    for lt in reversed(fields):
+        assert np.allclose(read_tqc(run_file, lt=lt), fields[lt], atol=1e-6)
+
+    # headers scanned once, then one message decoded per leadtime
+    assert calls.count(True) == len(fields) + 1
+    assert calls.count(False) == len(fields)
+
+
+def test_reduce_fcst_exps(tmp_path):
+    labels = np.zeros((6, 8), dtype=np.int16)
+    labels[1:4, 2:6] = 1
+    labels[4:6, 2:6] = 2
+    points = region_points(labels, 2)
+
+    # e1: FLS everywhere, e2: no FLS; e2 has no +1h
+    for exp, value, lead_times in [("e1", 1e-3, [0, 1]), ("e2", 0.0, [0])]:
+        (tmp_path / exp).mkdir()
+        fields = {lt: np.full((6, 8), value) for lt in lead_times}
+        write_tqc_file(tmp_path / exp / "tqc_21110100.grb2", fields, BENCH_START)
+
+    calls = []
+
+    def high_clouds_ml():
+        calls.append(1)
+        high_clouds = np.zeros(int(np.sum(labels > 0)), dtype=bool)
+        high_clouds[:6] = True
+        return high_clouds
+
+    fcst_fracs = reduce_fcst_exps(
+        pd.Timestamp("2021-11-01 01:00"),
+        high_clouds_ml,
+        points,
+        None,
+        tmp_path,
+        ["e1", "e2"],
+        1,
+    )
+
+    # high cloud mask of the shared OBS is determined once
+    assert len(calls) == 1
+    assert sorted(fcst_fracs["e1"]) == [1] and sorted(fcst_fracs["e2"]) == []
+    assert np.allclose(fcst_fracs["e1"][1][:, 0], [6 / 12, 1.0])
+
+
+def test_reduce_fcst_corrupt_file(tmp_path, caplog):
+    labels = np.ones((6, 8), dtype=np.int16)
+    points = region_points(labels, 1)
+    (tmp_path / "e1").mkdir()
+    for name, lt in [("tqc_21110100_001.grb2", 1), ("tqc_21110101_000.grb2", 0)]:
+        fields = {lt: np.full((6, 8), 1e-3)}
+        write_tqc_file(tmp_path / "e1" / name, fields, BENCH_START)
+    # truncated +0h
+    corrupt_file = tmp_path / "e1" / "tqc_21110101_000.grb2"
+    corrupt_file.write_bytes(corrupt_file.read_bytes()[:100])
+
+    fcst_fracs = reduce_fcst(
+        pd.Timestamp("2021-11-01 01:00"),
+        np.zeros(48, dtype=bool),
+        points,
+        None,
+        tmp_path,
+        "e1",
+        1,
+    )
+    assert sorted(fcst_fracs) == [1]
+    assert f"Skipping corrupt {corrupt_file}" in caplog.text
+
+
+def test_reduce_fcst_empty_file(tmp_path, caplog):
+    points = region_points(np.ones((6, 8), dtype=np.int16), 1)
+    (tmp_path / "e1").mkdir()
+    empty_file = tmp_path / "e1" / "tqc_21110101_000.grb2"
+    empty_file.touch()
+    cache = ReductionCache(tmp_path / "cache.sqlite")
+
+    def reduce():
+        return reduce_fcst(
+            pd.Timestamp("2021-11-01 01:00"),
+            np.zeros(48, dtype=bool),
+            points,
+            None,
+            tmp_path,
+            "e1",
+            0,
+            cache=cache,
+        )
+
+    # corrupt, not a missing leadtime: reported and not cached
+    assert reduce() == {}
+    assert f"Skipping corrupt {empty_file}" in caplog.text
+
+    # file fetched again
+    write_tqc_file(empty_file, {0: np.full((6, 8), 1e-3)}, BENCH_START)
+    assert sorted(reduce()) == [0]
+
+
+@pytest.fixture
+def bench_wd(tmp_path):
+    """Synthetic input as used by the benchmarks."""
+    create_fixtures(tmp_path, BENCH_START, 6, 3, 3, "bench", "c1e", (90, 150))
+    return tmp_path
+
+
+def _calc(wd, out_dir, **kwargs):
+    return calc_fls_fractions(
+        BENCH_START,
+        BENCH_START + dt.timedelta(hours=5),
+        3,
+        wd / "sat",
+        wd / "tqc",
+        out_dir,
+        "bench",
+        3,
+        extend_previous=False,
+        threshold=0.7,
+        model="c1e",
+        **kwargs,
+    )
+
+
+def test_calc_fls_fractions_workers(bench_wd):
+    obs, fcst = _calc(bench_wd, bench_wd / "fls_1")
+    obs_2, fcst_2 = _calc(bench_wd, bench_wd / "fls_2", workers=2)
+
+    assert obs["fls_frac"].notna().all()
+    pd.testing.assert_frame_equal(obs_2, obs)
+    pd.testing.assert_frame_equal(fcst_2, fcst)
+    pd.testing.assert_frame_equal(
+        read_store(obs_store_path(bench_wd / "fls_2")),
+        read_store(obs_store_path(bench_wd / "fls_1")),
+    )
+
+
+def test_calc_fls_fractions_workers_error(bench_wd, monkeypatch):
+    pools = []
+
+    class Pool(utils._CancellablePool):
+        def cancel_pending(self):
+            pools.append(self)
+            super().cancel_pending()
+
+    def read_lscl(obs_file, window=None):
+        raise RuntimeError(f"Cannot read {obs_file}")
+
+    # inherited by the forked worker processes
+    monkeypatch.setattr(utils, "_CancellablePool", Pool)
+    monkeypatch.setattr(utils, "read_lscl", read_lscl)
+
+    with pytest.raises(RuntimeError, match="Cannot read"):
+        _calc(bench_wd, bench_wd / "fls", workers=2, checkpoint_every=0)
+    # valid times still queued are not started
+    assert len(pools) == 1
+    assert not obs_store_path(bench_wd / "fls").exists()
+
+
+def test_calc_fls_fractions_keeps_store_on_error(bench_wd, monkeypatch):
+    _calc(bench_wd, bench_wd / "fls")
+    previous = read_store(obs_store_path(bench_wd / "fls"))
+
+    def read_lscl(obs_file, window=None):
+        raise RuntimeError(f"Cannot read {obs_file}")
+
+    monkeypatch.setattr(utils, "read_lscl", read_lscl)
+    with pytest.raises(RuntimeError, match="Cannot read"):
+        _calc(bench_wd, bench_wd / "fls", checkpoint_every=0)
+    pd.testing.assert_frame_equal(
+        read_store(obs_store_path(bench_wd / "fls")), previous
+    )
+
+
+def test_calc_fls_fractions_shard_caches(bench_wd):
+    cache_dir = bench_wd / "cache"
+    for shard in [(0, 2), (1, 2)]:
+        _calc(bench_wd, bench_wd / "fls", cache_dir=cache_dir, shard=shard)
+
+    # no sqlite database shared between the nodes
+    assert sorted(path.name for path in cache_dir.glob("*.sqlite")) == [
+        "reductions_shard0of2.sqlite",
+        "reductions_shard1of2.sqlite",
+    ]
+
+
+def test_reduce_fcst_io_error(tmp_path, monkeypatch):
+    (tmp_path / "e1").mkdir()
+    write_tqc_file(
+        tmp_path / "e1" / "tqc_21110101_000.grb2", {0: np.zeros((6, 8))}, BENCH_START
+    )
+
+    def read_tqc(fcst_file, window=None, lt=None):
+        raise OSError(errno.EIO, "Input/output error", str(fcst_file))
+
+    # not a corrupt file: not skipped
+    monkeypatch.setattr(utils, "read_tqc", read_tqc)
+    with pytest.raises(OSError):
+        reduce_fcst(
+            pd.Timestamp("2021-11-01 01:00"),
+            np.zeros(48, dtype=bool),
+            region_points(np.ones((6, 8), dtype=np.int16), 1),
+            None,
+            tmp_path,
+            "e1",
+            0,
+        )
+
+
+@pytest.mark.parametrize("obs_chunk", [0, 4])
+def test_calc_fls_fractions_corrupt_sat_file(bench_wd, obs_chunk):
+    obs, _ = _calc(bench_wd, bench_wd / "fls", reduction_cache=False)
+    valid_time = obs.index.get_level_values(0)[2]
+    sat_file = sat_file_path(bench_wd / "sat", valid_time, "c1e")
+    sat_file.write_bytes(sat_file.read_bytes()[:1000])
+
+    obs_corrupt, _ = _calc(
+        bench_wd, bench_wd / "fls", reduction_cache=False, obs_chunk=obs_chunk
+    )
+    assert obs_corrupt.loc[valid_time].isna().all().all()
+    pd.testing.assert_frame_equal(
+        obs_corrupt.drop(valid_time, level=0), obs.drop(valid_time, level=0)
+    )
+
+
+def test_calc_fls_fractions_resume_retries_skipped(bench_wd, monkeypatch):
+    obs, fcst = _calc(bench_wd, bench_wd / "fls_ref", reduction_cache=False)
+    valid_times = obs.index.get_level_values(0).unique()
+    corrupt_file = sat_file_path(bench_wd / "sat", valid_times[1], "c1e")
+    last_file = sat_file_path(bench_wd / "sat", valid_times[-1], "c1e")
+    content = corrupt_file.read_bytes()
+    corrupt_file.write_bytes(content[:1000])
+
+    read_lscl = utils.read_lscl
+
+    def interrupted(obs_file, window=None):
+        if obs_file == last_file:
+            raise KeyboardInterrupt
+        return read_lscl(obs_file, window)
+
+    monkeypatch.setattr(utils, "read_lscl", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _calc(bench_wd, bench_wd / "fls", reduction_cache=False)
+
+    # sat file fetched again: reduced on resume
+    corrupt_file.write_bytes(content)
+    monkeypatch.setattr(utils, "read_lscl", read_lscl)
+    obs_resumed, fcst_resumed = _calc(
+        bench_wd, bench_wd / "fls", reduction_cache=False, resume=True
+    )
+    pd.testing.assert_frame_equal(obs_resumed, obs)
+    pd.testing.assert_frame_equal(fcst_resumed, fcst)
+
+
+def test_calc_fls_fractions_interrupted_keeps_tables(bench_wd, monkeypatch):
+    _calc(bench_wd, bench_wd / "fls", contingency=True)
+    tables_path = contingency_path(bench_wd / "fls", "bench")
+    previous = ContingencyAccumulator.load(tables_path)
+    obs, _ = _calc(bench_wd, bench_wd / "fls_ref", contingency=True)
+    last_file = sat_file_path(
+        bench_wd / "sat", obs.index.get_level_values(0)[-1], "c1e"
+    )
+
+    read_lscl = utils.read_lscl
+
+    def interrupted(obs_file, window=None):
+        if obs_file == last_file:
+            raise KeyboardInterrupt
+        return read_lscl(obs_file, window)
+
+    # killed run: its partial tables do not replace the complete ones
+    monkeypatch.setattr(utils, "read_lscl", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _calc(bench_wd, bench_wd / "fls", contingency=True, checkpoint_every=1)
+    kept = ContingencyAccumulator.load(tables_path)
+    assert kept.valid_times == previous.valid_times
+    np.testing.assert_array_equal(kept.counts, previous.counts)
+
+    # resumed from the checkpointed tables
+    monkeypatch.setattr(utils, "read_lscl", read_lscl)
+    _calc(bench_wd, bench_wd / "fls", contingency=True, resume=True)
+    resumed = ContingencyAccumulator.load(tables_path)
+    reference = ContingencyAccumulator.load(
+        contingency_path(bench_wd / "fls_ref", "bench")
+    )
+    np.testing.assert_array_equal(resumed.counts, reference.counts)
+    assert not list((bench_wd / "fls").glob("checkpoint*"))
@@ -0,0 +1,76 @@
+"""Test module ``fls_sat_verif/watch.py``."""
+# Standard library
+import datetime as dt
+
+# Third-party
+import numpy as np
+import pandas as pd
+
+# First-party
+from fls_sat_verif import watch
+from fls_sat_verif.store import fcst_store_path
+from fls_sat_verif.store import obs_store_path
+from fls_sat_verif.store import read_store
+from fls_sat_verif.synthetic import write_sat_files
+from fls_sat_verif.synthetic import write_tqc_file
+from fls_sat_verif.utils import tqc_file_path
+from fls_sat_verif.watch import Watcher
+
+SHAPE = (6, 8)
+# box around 6 grid points of the synthetic lat/lon grid
+REGIONS = {"box": [[[(43.0, 4.0), (43.0, 9.0), (47.0, 9.0), (47.0, 4.0)]]]}
+
+
+def test_watcher(tmp_path, monkeypatch):
+    in_dir_obs = tmp_path / "sat"
+    in_dir_model = tmp_path / "tqc"
+    (in_dir_model / "e1").mkdir(parents=True)
+    in_dir_obs.mkdir()
+    ini_time = dt.datetime(2021, 11, 1, 0)
+
+    # present before watching: ignored
+    write_sat_files(in_dir_obs, [ini_time], "c1e", SHAPE, lscl=1.0)
+
+    watcher = Watcher(
+        in_dir_obs,
+        in_dir_model,
+        tmp_path / "fls",
+        ["e1"],
+        2,
+        [0.5],
+        "c1e",
+        regions=REGIONS,
+        cache_dir=tmp_path / "cache",
+        settle=0,
+    )
+    assert watcher.poll() == []
+
+    # FCST waits for its sat file
+    tqc_file = tqc_file_path(in_dir_model, "e1", ini_time, 1)
+    write_tqc_file(tqc_file, {1: np.full(SHAPE, 1e-3)}, ini_time)
+    assert watcher.poll() == []
+    valid_time = pd.Timestamp(ini_time + dt.timedelta(hours=1))
+    write_sat_files(in_dir_obs, [valid_time], "c1e", SHAPE, lscl=0.0)
+    assert watcher.poll() == [valid_time]
+    assert watcher.poll() == []
+
+    # FCST of a valid time already in the store
+    tqc_file = tqc_file_path(in_dir_model, "e1", valid_time, 0)
+    write_tqc_file(tqc_file, {0: np.zeros(SHAPE)}, valid_time)
+    assert watcher.poll() == [valid_time]
+
+    # files seen before are not inspected again
+    inspected = []
+    with monkeypatch.context() as m:
+        m.setattr(watch, "_mtime", inspected.append)
+        assert watcher.poll() == []
+    assert inspected == []
+    watcher.close()
+
+    obs = read_store(obs_store_path(tmp_path / "fls"))
+    fcst = read_store(fcst_store_path(tmp_path / "fls", "e1"))
+    assert obs.index.get_level_values(0).tolist() == [valid_time]
+    assert obs["fls_frac"].tolist() == [0.0]
+    assert np.allclose(
+        fcst.loc[valid_time].values, [[0.0, 1.0, np.nan]], equal_nan=True
+    )